@@ -0,0 +1,75 @@
+"""
+Generate large synthetic C programs for benchmarking.
+The programs only use constructs our grammar and later phases support.
+"""
+
+import sys
+
+
+def generateFunction(index, statements):
+    """Generate a function with roughly the given number of statements."""
+
+    lines = [f"int f{index}(int a, int b) {{", "\tint x = a + b * 2;", "\tint y = 0;"]
+
+    for i in range(statements):
+        kind = i % 5
+        if kind == 0:
+            lines.append(f"\tx = x + {i} * (y - a);")
+        elif kind == 1:
+            lines.append(f"\tif (x > {i}) {{\n\t\ty = y + 1;\n\t}} else {{\n\t\ty -= 2;\n\t}}")
+        elif kind == 2:
+            lines.append(f"\twhile (y < {i}) {{\n\t\ty++;\n\t\tx = x % 7;\n\t}}")
+        elif kind == 3:
+            lines.append(f"\ty += x & {i} | b;")
+        else:
+            if index > 0:
+                lines.append(f"\tx = f{index - 1}(x, {i});")
+            else:
+                lines.append(f"\tx = x << {i % 4};")
+
+    lines.append("\treturn x + y;")
+    lines.append("}")
+
+    return "\n".join(lines)
+
+
+def generateProgram(functions, statements=10):
+    """Generate a program with the given number of functions."""
+
+    parts = [generateFunction(i, statements) for i in range(functions)]
+    parts.append(f"int main() {{\n\tint r = f{functions - 1}(1, 2);\n\treturn r;\n}}")
+
+    return "\n\n".join(parts) + "\n"
+
+
+def generateNested(index, depth):
+    """Generate a function with while loops nested depth deep, each with a break and continue."""
+
+    lines = [f"int f{index}(int a) {{"]
+    lines += [f"\tint x{level} = 0;" for level in range(depth)]
+
+    for level in range(depth):
+        indent = "\t" * (level + 1)
+        lines.append(f"{indent}while (x{level} < a) {{")
+        lines.append(f"{indent}\tx{level}++;")
+        lines.append(f"{indent}\tif (x{level} == {level}) {{\n{indent}\t\tbreak;\n{indent}\t}}")
+        lines.append(f"{indent}\tif (x{level} > a) {{\n{indent}\t\tcontinue;\n{indent}\t}}")
+
+    for level in reversed(range(depth)):
+        lines.append("\t" * (level + 1) + "}")
+
+    lines.append("\treturn x0;")
+    lines.append("}")
+
+    return "\n".join(lines)
+
+
+def generateLines(lines):
+    """Generate a program of roughly the given number of lines."""
+
+    # Each generated function is about 26 lines long
+    return generateProgram(max(1, lines // 26), statements=10)
+
+
+if __name__ == "__main__":
+    print(generateLines(int(sys.argv[1]) if len(sys.argv) > 1 else 1000), end="")
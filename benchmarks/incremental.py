@@ -0,0 +1,56 @@
+"""
+Benchmark incremental reparsing against full parses after a one line edit.
+Run from the repository root: python3 -m benchmarks.incremental [lines...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# pylint: disable=wrong-import-position
+from parser.lrParser import ParserRun, getParseTables
+from parser.incremental import IncrementalParser
+import lexer.lexer as lexer
+from benchmarks.generate import generateLines
+
+
+def editMiddle(code):
+    """Change the constant of the assignment closest to the middle of the code."""
+
+    index = code.find(" = ", len(code) // 2)
+    end = code.find(";", index)
+    return code[: index + 3] + "12345" + code[end:]
+
+
+def main():
+    """Time full and incremental reparses for growing programs."""
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 4000, 16000]
+    tables = getParseTables("grammars/main_grammar.txt")
+
+    print(f"{'lines':>8} {'tokens':>8} {'full':>10} {'incremental':>12} {'reused':>8}")
+    for lines in sizes:
+        code = generateLines(lines)
+        incremental = IncrementalParser(tables)
+        incremental.parse(lexer.tokenize(code))
+
+        tokens = lexer.tokenize(editMiddle(code))
+
+        start = time.perf_counter()
+        ParserRun(tables).parse(tokens)
+        full = time.perf_counter() - start
+
+        start = time.perf_counter()
+        incremental.parse(tokens)
+        reparse = time.perf_counter() - start
+
+        print(
+            f"{lines:>8} {len(tokens):>8} {full:>9.4f}s {reparse:>11.4f}s "
+            f"{incremental.reusedTokens / len(tokens):>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
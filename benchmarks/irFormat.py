@@ -0,0 +1,102 @@
+"""
+Compare the binary IR format with JSON in file size and write and load time.
+Run from the repository root: python3 -m benchmarks.irFormat [instructions] [repeats]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# pylint: disable=wrong-import-position
+from main import Compiler
+from ir.ir import readJson, readBinary
+from benchmarks.generate import generateLines
+
+# Lines of the program that is compiled, then repeated up to the size asked for
+lines = 20000
+
+
+def buildIr(instructions):
+    """Return an IR with at least the given number of instructions."""
+
+    with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as file:
+        file.write(generateLines(lines))
+
+    compiler = Compiler({"filename": file.name})
+    compiler.tokenize()
+    compiler.parse()
+    compiler.analyze()
+    os.remove(file.name)
+
+    ir = compiler.ir
+    functions = list(ir.ir.items())
+    count = sum(
+        len(block.instructions) for _, function in functions for block in function["blocks"]
+    )
+
+    # Copy the functions under new names until there are enough instructions
+    copy = 0
+    total = count
+    while total < instructions:
+        copy += 1
+        for name, function in functions:
+            ir.ir[f"{name}_{copy}"] = function
+        total += count
+
+    return ir, total
+
+
+def bestTime(function, repeats):
+    """Return the fastest of several runs of the function."""
+
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    """Report the size and write and load times of both formats."""
+
+    instructions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    ir, total = buildIr(instructions)
+    directory = tempfile.mkdtemp()
+    formats = [
+        ("JSON", os.path.join(directory, "ir.json"), readJson),
+        ("binary", os.path.join(directory, "ir.irb"), readBinary),
+    ]
+
+    print(f"instructions: {total}")
+    for name, path, read in formats:
+
+        def write():
+            if os.path.exists(path):
+                os.remove(path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                ir.write(path)
+
+        writeTime = bestTime(write, repeats)
+        loadTime = bestTime(lambda: read(path), repeats)
+        size = os.path.getsize(path)
+        os.remove(path)
+
+        print(
+            f"{name + ':':8} {size / 1e6:7.2f} MB  write {writeTime:.3f}s  load {loadTime:.3f}s"
+        )
+
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
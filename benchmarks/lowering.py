@@ -0,0 +1,72 @@
+"""
+Compare the later phase walkers on the flattened parse tree and the lowered AST.
+Run from the repository root: python3 -m benchmarks.lowering [lines] [repeats]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# pylint: disable=wrong-import-position
+from main import Compiler
+from ir.ir import IR
+from parser.lowering import lowerTree, countNodes
+from symbolTable.symbolTable import buildSymbolTable
+from benchmarks.generate import generateLines
+
+
+def bestTime(function, repeats):
+    """Return the fastest of several runs of the function."""
+
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def walk(tree):
+    """Build the symbol table and the IR of a tree."""
+
+    # Each symbol table numbers its temporaries and labels from the start
+    IR(tree, buildSymbolTable(tree)).generate()
+
+
+def main():
+    """Report the node counts and walker times of both trees."""
+
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as file:
+        file.write(generateLines(lines))
+
+    compiler = Compiler({"filename": file.name})
+    compiler.tokenize()
+    parseTree = compiler.parse()
+    os.remove(file.name)
+
+    loweringTime = bestTime(lambda: lowerTree(parseTree), repeats)
+    ast = lowerTree(parseTree)
+
+    before = countNodes(parseTree)
+    after = countNodes(ast)
+    treeTime = bestTime(lambda: walk(parseTree), repeats)
+    astTime = bestTime(lambda: walk(ast), repeats)
+
+    print(f"parse tree nodes:  {before}")
+    print(f"AST nodes:         {after} ({1 - after / before:.1%} fewer)")
+    print(f"lowering time:     {loweringTime:.4f}s")
+    print(f"parse tree walks:  {treeTime:.4f}s")
+    print(f"AST walks:         {astTime:.4f}s ({1 - astTime / treeTime:.1%} faster)")
+    print(f"lowering + walks:  {loweringTime + astTime:.4f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark IR generation for functions with deeply nested loops.
+Run from the repository root: python3 -m benchmarks.nesting [depth...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# pylint: disable=wrong-import-position
+from main import Compiler
+from ir.ir import IR
+from symbolTable.symbolTable import buildSymbolTable
+from util import CompilationContext
+from benchmarks.generate import generateNested
+
+# Functions per program, so each timing is long enough to measure
+functions = 20
+
+
+def timeDepth(depth, repeats=3):
+    """Return the number of instructions and best IR time for a nesting depth."""
+
+    code = "\n\n".join(generateNested(i, depth) for i in range(functions))
+    code += "\n\nint main() {\n\treturn f0(1);\n}\n"
+    with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as file:
+        file.write(code)
+
+    compiler = Compiler({"filename": file.name})
+    compiler.tokenize()
+    compiler.parse()
+    ast = compiler.lower()
+    os.remove(file.name)
+
+    symbolTable = buildSymbolTable(ast, prepare=True)
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        ir = IR(ast, symbolTable, CompilationContext())
+        ir.generate(prepared=True)
+        times.append(time.perf_counter() - start)
+
+    instructions = sum(
+        len(block.instructions)
+        for function in ir.ir.values()
+        for block in function["blocks"]
+    )
+
+    return instructions, min(times)
+
+
+def main():
+    """Time IR generation as loops nest deeper."""
+
+    depths = [int(arg) for arg in sys.argv[1:]] or [10, 25, 50]
+
+    print(f"{'depth':>6} {'instructions':>13} {'IR':>10}")
+    for depth in depths:
+        instructions, best = timeDepth(depth)
+        print(f"{depth:>6} {instructions:>13} {best:>9.4f}s")
+
+
+if __name__ == "__main__":
+    main()
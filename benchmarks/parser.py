@@ -0,0 +1,72 @@
+"""
+Benchmark the LR parser in reductions per second.
+Run from the repository root: python3 -m benchmarks.parser [lines] [repeats]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# pylint: disable=wrong-import-position
+from parser.lrParser import ParserRun, getParseTables
+import lexer.lexer as lexer
+from benchmarks.generate import generateLines
+
+
+def countReductions(tables, tokens):
+    """Count the reductions of a parse by replaying the raw action table."""
+
+    states = [0]
+    lookahead = 0
+    reductions = 0
+
+    while True:
+        realToken = tokens[lookahead]
+        token = realToken.kind.desc()
+        if token not in tables.terminals:
+            token = realToken.content
+
+        row = tables.actions[states[-1]]
+        action = row.get(token, row.get("EMPTY")).split(" ")
+
+        if action[0] == "s":
+            states.append(int(action[1]))
+            if token in row:
+                lookahead += 1
+            continue
+
+        reductions += 1
+        if action[1] == "ACC":
+            return reductions
+
+        del states[-len(tables.rules[action[1]][int(action[2])]) :]
+        states.append(tables.goto[states[-1]][action[1]])
+
+
+def main():
+    """Time repeated parses of a generated program."""
+
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    tables = getParseTables("grammars/main_grammar.txt")
+    tokens = lexer.tokenize(generateLines(lines))
+    reductions = countReductions(tables, tokens)
+
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        ParserRun(tables).parse(tokens)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"tokens:          {len(tokens)}")
+    print(f"reductions:      {reductions}")
+    print(f"best parse time: {best:.4f}s")
+    print(f"reductions/s:    {reductions / best:,.0f}")
+
+
+if __name__ == "__main__":
+    main()
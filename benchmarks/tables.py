@@ -0,0 +1,201 @@
+"""
+Benchmark parse table generation on synthetic grammars of growing size.
+Run from the repository root: python3 -m benchmarks.tables [scales] [options]
+
+  --plot <filename>     Save a plot with matplotlib instead of printing one
+  --save <filename>     Save the results as JSON
+  --compare <filename>  Compare against saved results and flag regressions
+"""
+
+import getopt
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# pylint: disable=wrong-import-position
+from parser.lrParser import LRParser
+
+# A run this much slower than the saved one counts as a regression
+slowdown = 1.5
+
+
+def generateGrammar(statements, alternatives, levels):
+    """
+    Generate a grammar in the grammars/*.txt format with the given number
+    of statement nonterminals, alternatives for each of them, and expression
+    precedence levels.
+    """
+
+    lines = [
+        "program -> declarationList",
+        "declarationList -> declarationList declaration \\ declaration",
+        "declaration -> typeSpecifier ID ( ) { statementList }",
+        "statementList -> statementList statement \\ statement",
+        "statement -> " + " \\ ".join(f"stmt{i}" for i in range(statements)),
+    ]
+
+    for i in range(statements):
+        rules = []
+        for j in range(alternatives):
+            if j % 2 == 0:
+                rules.append(f"kw{i} mark{j} expr0 ;")
+            else:
+                rules.append(f"kw{i} mark{j} ( expr0 ) {{ statementList }}")
+        lines.append(f"stmt{i} -> " + " \\ ".join(rules))
+
+    # Each level is a left recursive binary operator binding tighter than the last
+    for k in range(levels):
+        lines.append(f"expr{k} -> expr{k} op{k} expr{k + 1} \\ expr{k + 1}")
+    lines.append(f"expr{levels} -> ( expr0 ) \\ ID \\ constNum")
+
+    return "\n".join(lines) + "\n"
+
+
+def measure(grammarText):
+    """Build and save the tables of a grammar, returning its statistics."""
+
+    parser = LRParser()
+    parser.parseGrammar(grammarText)
+
+    start = time.perf_counter()
+    parser.buildTables()
+    buildTime = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        tableFileName = os.path.join(directory, "table.json")
+        start = time.perf_counter()
+        parser.saveTables(tableFileName)
+        saveTime = time.perf_counter() - start
+        report = parser.tableReport(tableFileName)
+
+    # Build again under tracemalloc, which would skew the times above
+    parser = LRParser()
+    parser.parseGrammar(grammarText)
+    tracemalloc.start()
+    parser.buildTables()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "productions": report["productions"],
+        "nonTerminals": report["nonTerminals"],
+        "states": report["states"],
+        "buildTime": buildTime,
+        "saveTime": saveTime,
+        "peakMemory": peak,
+        "tableFileBytes": report["tableFileBytes"],
+    }
+
+
+def asciiPlot(results, key, label, width=50):
+    """Print a bar chart of one statistic against grammar size."""
+
+    print(f"\n{label} by productions")
+    biggest = max(result[key] for result in results) or 1
+    for result in results:
+        bar = "#" * max(1, round(result[key] / biggest * width))
+        value = result[key]
+        text = f"{value:.3f}" if isinstance(value, float) else str(value)
+        print(f"{result['productions']:>6} | {bar} {text}")
+
+
+def savePlot(results, filename):
+    """Plot the state count and build time with matplotlib."""
+
+    # matplotlib is only needed for this option, so it is not a requirement
+    import matplotlib  # pylint: disable=import-outside-toplevel
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    sizes = [result["productions"] for result in results]
+    figure, states = plt.subplots()
+    states.plot(sizes, [r["states"] for r in results], "o-", color="tab:blue")
+    states.set_xlabel("productions")
+    states.set_ylabel("states", color="tab:blue")
+
+    times = states.twinx()
+    times.plot(sizes, [r["buildTime"] for r in results], "s-", color="tab:red")
+    times.set_ylabel("buildTables seconds", color="tab:red")
+
+    figure.tight_layout()
+    figure.savefig(filename)
+
+
+def compare(results, baseline):
+    """Return a description of every regression against the saved results."""
+
+    regressions = []
+    saved = {result["scale"]: result for result in baseline}
+    for result in results:
+        old = saved.get(result["scale"])
+        if old is None:
+            continue
+        if result["states"] != old["states"]:
+            regressions.append(
+                f"scale {result['scale']}: {result['states']} states, was {old['states']}"
+            )
+        if result["buildTime"] > old["buildTime"] * slowdown:
+            regressions.append(
+                f"scale {result['scale']}: buildTables took {result['buildTime']:.3f}s,"
+                f" was {old['buildTime']:.3f}s"
+            )
+
+    return regressions
+
+
+def main():
+    """Time table generation for each scale and report the results."""
+
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "", ["plot=", "save=", "compare="])
+    options = dict(opts)
+    scales = sorted(int(arg) for arg in args) or [1, 2, 3, 4, 5]
+
+    results = []
+    print(
+        f"{'scale':>5} {'prods':>6} {'nonterms':>8} {'states':>7}"
+        f" {'build':>9} {'save':>8} {'peak':>9}"
+    )
+    for scale in scales:
+        # Grow every dimension of the grammar together
+        result = measure(generateGrammar(2 * scale, 2 + scale // 2, scale + 1))
+        result["scale"] = scale
+        results.append(result)
+        print(
+            f"{scale:>5} {result['productions']:>6} {result['nonTerminals']:>8}"
+            f" {result['states']:>7} {result['buildTime']:>8.3f}s"
+            f" {result['saveTime']:>7.3f}s {result['peakMemory'] / 1e6:>7.1f}MB"
+        )
+
+    plotted = False
+    if "--plot" in options:
+        try:
+            savePlot(results, options["--plot"])
+            plotted = True
+        except ImportError:
+            print("matplotlib is not installed, printing the plot instead.")
+
+    if not plotted:
+        asciiPlot(results, "states", "States")
+        asciiPlot(results, "buildTime", "buildTables seconds")
+
+    if "--save" in options:
+        with open(options["--save"], "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if "--compare" in options:
+        with open(options["--compare"]) as infile:
+            regressions = compare(results, json.load(infile))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
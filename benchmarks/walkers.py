@@ -0,0 +1,60 @@
+"""
+Benchmark the symbol table and IR walkers in nodes per second.
+Run from the repository root: python3 -m benchmarks.walkers [lines] [repeats]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+# pylint: disable=wrong-import-position
+from main import Compiler
+from ir.ir import IR
+from parser.lowering import countNodes
+from symbolTable.symbolTable import buildSymbolTable
+from benchmarks.generate import generateLines
+
+
+def main():
+    """Time the walks over the AST of a generated program."""
+
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as file:
+        file.write(generateLines(lines))
+
+    compiler = Compiler({"filename": file.name})
+    compiler.tokenize()
+    compiler.parse()
+    ast = compiler.lower()
+    os.remove(file.name)
+
+    # The values are computed once, as analyze does, so only the walks are timed
+    nodes = countNodes(ast)
+    buildSymbolTable(ast, prepare=True)
+
+    symbolTimes = []
+    irTimes = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        symbolTable = buildSymbolTable(ast)
+        symbolTimes.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        IR(ast, symbolTable).generate(prepared=True)
+        irTimes.append(time.perf_counter() - start)
+
+    bestSymbols = min(symbolTimes)
+    bestIr = min(irTimes)
+
+    print(f"AST nodes:    {nodes}")
+    print(f"symbol table: {bestSymbols:.4f}s ({nodes / bestSymbols:,.0f} nodes/s)")
+    print(f"IR:           {bestIr:.4f}s ({nodes / bestIr:,.0f} nodes/s)")
+
+
+if __name__ == "__main__":
+    main()
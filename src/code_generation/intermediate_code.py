@@ -4,7 +4,7 @@ Generacion de codigo intermedio a partir del ast
 """
 
 import json
-from util import unique, writeFile, readFile
+from util import CompilationContext, writeFile, readFile
 import parser.grammar as grammar
 
 
@@ -26,17 +26,23 @@ class BasicBlock:
 class IR:
     """Clase de Representación Intermedia para contener datos de IR."""
 
-    def __init__(self, parseTree, symbolTable):
+    def __init__(self, parseTree, symbolTable, context=None):
         self.parseTree = parseTree
         self.symbolTable = symbolTable
         self.stack = []
         self.ir = {}
         self.current = None
 
+        # Los temporales siguen a los numerados al construir la tabla de símbolos
+        if context is None:
+            context = getattr(symbolTable, "context", None) or CompilationContext()
+        self.context = context
+        self.unique = context.unique
+
     def generate(self):
         """Genera la IR a partir del árbol de análisis sintáctico."""
 
-        self.parseTree.visit()
+        self.parseTree.visit(self.context)
         self.visit(self.parseTree)
 
         return self.ir
@@ -45,7 +51,7 @@ class IR:
         """Guarda la pila como un bloque y comienza un nuevo bloque."""
 
         if self.stack or force is True:
-            bb = BasicBlock(self.stack, unique.new("_L"))
+            bb = BasicBlock(self.stack, self.unique.new("_L"))
             self.ir[self.current]["blocks"].append(bb)
 
         self.stack = []
@@ -64,7 +70,7 @@ class IR:
             self.current = node.name
         elif isinstance(node, grammar.IfStatement):
             self.closeBlock()
-            node.savedLabel = unique.get("_L")
+            node.savedLabel = self.unique.get("_L")
         elif isinstance(node, grammar.ElseStatement):
             self.closeBlock()
         elif isinstance(node, grammar.LabelDeclaration):
@@ -73,14 +79,14 @@ class IR:
             self.closeBlock()
         elif isinstance(node, grammar.WhileStatement):
             self.closeBlock()
-            node.savedLabel = unique.get("_L")
+            node.savedLabel = self.unique.get("_L")
         elif isinstance(node, grammar.WhileCondition):
             self.closeBlock()
         elif isinstance(node, grammar.SwitchCondition):
             self.closeBlock()
         elif isinstance(node, grammar.SwitchStatement):
             self.closeBlock()
-            node.savedLabel = unique.get("_L")
+            node.savedLabel = self.unique.get("_L")
 
         # Recursion
         if hasattr(node, "children"):
@@ -101,15 +107,15 @@ class IR:
                 self.closeBlock(force=True)
             elif isinstance(node, grammar.IfBody):
                 if node.hasElse:
-                    self.stack.append(["goto", f"_L{unique.get('_L') + 3}"])
+                    self.stack.append(["goto", f"_L{self.unique.get('_L') + 3}"])
                 self.closeBlock()
             elif isinstance(node, grammar.IfStatement):
                 self.closeBlock()
 
                 if node.hasElse:
-                    elseLabel = f"_L{unique.get('_L')}"
+                    elseLabel = f"_L{self.unique.get('_L')}"
                 else:
-                    elseLabel = f"_L{unique.get('_L') + 1}"
+                    elseLabel = f"_L{self.unique.get('_L') + 1}"
 
                 # La condición será el bloque después de la condición especificada por savedLabel
                 # Pero savedLabel no es relativo a la función actual, mientras que self.ir sí lo es
@@ -132,7 +138,7 @@ class IR:
                         "if",
                         node.value,
                         "GOTO",
-                        f"_L{unique.get('_L') + 2}",
+                        f"_L{self.unique.get('_L') + 2}",
                         "else",
                         "GOTO",
                         "UNKNOWN",
@@ -158,7 +164,7 @@ class IR:
                 index = node.savedLabel - firstLabel + 1
 
                 # breakLabel es el bloque básico que viene después de la declaración while
-                breakLabel = f"_L{unique.get('_L') + 1}"
+                breakLabel = f"_L{self.unique.get('_L') + 1}"
 
                 # Reemplaza el marcador de posición de la condición while con la etiqueta de ruptura
                 x = self.ir[self.current]["blocks"][index].instructions
@@ -185,7 +191,7 @@ class IR:
                         "if",
                         node.value,
                         "GOTO",
-                        f"_L{unique.get('_L') + 2}",
+                        f"_L{self.unique.get('_L') + 2}",
                         "else",
                         "GOTO",
                         "UNKNOWN",
@@ -195,7 +201,7 @@ class IR:
             elif isinstance(node, grammar.SwitchCondition):
                 self.closeBlock()
             elif isinstance(node, grammar.SwitchCase):
-                condition = unique.new()
+                condition = self.unique.new()
                 self.stack.insert(0, [condition, "=", node.operator, "==", node.value])
                 self.stack.insert(
                     1,
@@ -203,10 +209,10 @@ class IR:
                         "if",
                         condition,
                         "GOTO",
-                        f"_L{unique.get('_L') + 2}",
+                        f"_L{self.unique.get('_L') + 2}",
                         "else",
                         "GOTO",
-                        f"_L{unique.get('_L') + 2}",
+                        f"_L{self.unique.get('_L') + 2}",
                     ],
                 )
                 self.closeBlock()
@@ -218,7 +224,7 @@ class IR:
                 )
                 index = node.savedLabel - firstLabel
 
-                breakLabel = f"_L{unique.get('_L') + 1}"
+                breakLabel = f"_L{self.unique.get('_L') + 1}"
 
                 # Reemplaza cualquier declaración de break con un goto a breakLabel
                 for block in self.ir[self.current]["bloques"][index + 1 :]:
@@ -265,7 +271,7 @@ class IR:
                 for instruction in block.instructions:
                     s.append(instruction)
 
-        writeFile(filename, json.dumps(s))
+        writeFile(filename, json.dumps(s), self.context)
 
     def __str__(self):
         s = []
@@ -0,0 +1,256 @@
+"""
+A compact binary file format for the IR, written and read as a stream.
+The file starts with a magic number and version, then holds one record
+after another. Each record is its length as a varint, then a tag byte:
+
+    an opcode   an instruction, with a varint for each operand it uses
+    a string    an entry added to the string table, as UTF-8
+    a function  the start of a function: its name, arguments and the
+                number of variables it declares
+
+Operands refer to the string table, so every name is stored once. A table
+entry is defined the first time it is used, so nothing has to be collected
+before writing starts. Temporaries are kept apart from other names, so they
+read back as Temp without looking at how they are written.
+"""
+
+import mmap
+from ir.instructions import Instr, Opcode, Temp
+from parser.treeCache import writeVarint, readVarint
+from util import CompilerMessage
+
+# Bump this whenever the binary layout below changes
+version = 1
+magic = b"CIRB"
+
+# The IR is only written in this format to files with this extension
+extension = ".irb"
+
+# Tags of the records that are not instructions
+nameTag = 0x80
+tempTag = 0x81
+functionTag = 0x82
+
+# Operands: 0 is None, 1 a list of operands, and the rest string table entries
+noOperand = 0
+listOperand = 1
+firstEntry = 2
+
+# The tag of each opcode, and the fields its instructions use, in order
+opcodes = list(Opcode)
+layouts = {
+    Opcode.LABEL: ("target",),
+    Opcode.COPY: ("dest", "a"),
+    Opcode.BINARY: ("dest", "a", "operator", "b"),
+    Opcode.UNARY: ("dest", "operator", "a"),
+    Opcode.CALL: ("dest", "a", "b"),
+    Opcode.RETURN: ("a",),
+    Opcode.GOTO: ("target",),
+    Opcode.BRANCH: ("a", "target", "otherwise"),
+    Opcode.BREAK: (),
+    Opcode.CONTINUE: (),
+}
+layoutTable = [layouts[op] for op in opcodes]
+encodings = {op: (tag, layouts[op]) for tag, op in enumerate(opcodes)}
+
+# Flush the buffered records to the file once they reach this size
+bufferSize = 1 << 16
+
+
+def isBinary(filename):
+    """Return whether a file holds IR in the binary format."""
+
+    try:
+        with open(filename, "rb") as file:
+            return file.read(len(magic)) == magic
+    except IOError:
+        return False
+
+
+class Writer:
+    """Write an IR to a binary file as the functions and instructions come."""
+
+    def __init__(self, file):
+        self.file = file
+        self.buffer = bytearray(magic)
+        self.buffer.append(version)
+
+        # The table entry of every name and temporary written so far
+        self.names = {}
+        self.temps = {}
+        self.entries = 0
+
+    def record(self, body):
+        """Add a record to the buffer, flushing it once it is full."""
+
+        buffer = self.buffer
+        writeVarint(buffer, len(body))
+        buffer += body
+        if len(buffer) >= bufferSize:
+            self.flush()
+
+    def entry(self, value):
+        """Return the table entry of a string, defining it if it is new."""
+
+        table = self.temps if type(value) is Temp else self.names
+        index = table.get(value)
+        if index is None:
+            index = table[value] = self.entries
+            self.entries += 1
+            body = bytearray((tempTag if table is self.temps else nameTag,))
+            body += value.encode()
+            self.record(body)
+
+        return index
+
+    def operand(self, body, value):
+        """Append an operand to the body of a record."""
+
+        if value is None:
+            body.append(noOperand)
+        elif type(value) is list:
+            body.append(listOperand)
+            writeVarint(body, len(value))
+            for item in value:
+                self.operand(body, item)
+        else:
+            if not isinstance(value, str):
+                value = str(value)
+            writeVarint(body, firstEntry + self.entry(value))
+
+    def function(self, name, arguments, declarations):
+        """Start a new function."""
+
+        body = bytearray((functionTag,))
+        self.operand(body, name)
+        self.operand(body, list(arguments))
+        writeVarint(body, declarations)
+        self.record(body)
+
+    def instruction(self, instruction):
+        """Write an instruction of the current function."""
+
+        tag, layout = encodings[instruction.op]
+        body = bytearray((tag,))
+        for field in layout:
+            value = getattr(instruction, field)
+
+            # Most operands are names already in the table
+            kind = type(value)
+            if kind is str:
+                index = self.names.get(value)
+            elif kind is Temp:
+                index = self.temps.get(value)
+            else:
+                self.operand(body, value)
+                continue
+            if index is None:
+                index = self.entry(value)
+
+            code = firstEntry + index
+            if code < 0x80:
+                body.append(code)
+            else:
+                writeVarint(body, code)
+
+        self.record(body)
+
+    def flush(self):
+        """Write the buffered records to the file."""
+
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+
+def readOperand(body, pos, table):
+    """Read an operand of a record body, returning it and the new position."""
+
+    code, pos = readVarint(body, pos)
+    if code >= firstEntry:
+        return table[code - firstEntry], pos
+    if code == noOperand:
+        return None, pos
+
+    count, pos = readVarint(body, pos)
+    items = []
+    for _ in range(count):
+        item, pos = readOperand(body, pos, table)
+        items.append(item)
+
+    return items, pos
+
+
+def decodeRecords(data):
+    """
+    Yield the records of a binary IR: a (name, arguments, declarations)
+    tuple for the start of each function and an Instr for each instruction.
+    """
+
+    if data[: len(magic)] != magic or data[len(magic)] != version:
+        raise CompilerMessage("The IR file has an unknown binary format.")
+
+    table = []
+    end = len(data)
+    pos = len(magic) + 1
+
+    while pos < end:
+        length = data[pos]
+        pos += 1
+        if length >= 0x80:
+            length, pos = readVarint(data, pos - 1)
+        following = pos + length
+
+        # Copy the record out once, as bytes are quicker to index than a map.
+        # Records this version does not know are skipped by their length.
+        body = data[pos:following]
+        pos = following
+
+        tag = body[0]
+        if tag < nameTag:
+            instruction = Instr(opcodes[tag])
+            index = 1
+            for field in layoutTable[tag]:
+                # Operand varints are read inline, as this is where loading goes
+                code = body[index]
+                index += 1
+                if code >= 0x80:
+                    code &= 0x7F
+                    shift = 7
+                    while True:
+                        byte = body[index]
+                        index += 1
+                        code |= (byte & 0x7F) << shift
+                        if byte < 0x80:
+                            break
+                        shift += 7
+
+                if code >= firstEntry:
+                    setattr(instruction, field, table[code - firstEntry])
+                elif code == listOperand:
+                    value, index = readOperand(body, index - 1, table)
+                    setattr(instruction, field, value)
+
+            yield instruction
+        elif tag == nameTag:
+            table.append(body[1:].decode())
+        elif tag == tempTag:
+            table.append(Temp(body[1:].decode()))
+        elif tag == functionTag:
+            name, index = readOperand(body, 1, table)
+            arguments, index = readOperand(body, index, table)
+            declarations, _ = readVarint(body, index)
+            yield name, arguments, declarations
+
+
+def readRecords(filename):
+    """Yield the records of a binary IR file, mapped into memory as it is read."""
+
+    try:
+        with open(filename, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            yield from decodeRecords(data)
+    except (IndexError, UnicodeDecodeError):
+        raise CompilerMessage(f"The IR file '{filename}' is truncated or corrupt.")
+    except (IOError, ValueError):
+        raise CompilerMessage(f"Cannot read file: {filename}.")
@@ -0,0 +1,136 @@
+"""
+Control-flow graphs over the basic blocks of IR functions.
+The edges come from the jumps in each block, so passes can follow them
+instead of searching instructions for labels.
+"""
+
+from ir.instructions import Opcode
+
+# Instructions that end a block, where control does not fall through
+transfers = (Opcode.GOTO, Opcode.BRANCH, Opcode.RETURN)
+
+
+def jumpTargets(block):
+    """
+    Return the labels control can go to at the end of a block, or None if it
+    falls through to the next block. A block ends at its first goto, branch
+    or return, and anything after that is never run.
+    """
+
+    for instruction in block.instructions:
+        op = instruction.op
+        if op in transfers:
+            if op is Opcode.GOTO:
+                return [instruction.target]
+            if op is Opcode.RETURN:
+                return []
+
+            # A branch still waiting for its else label only knows the body
+            targets = [instruction.target]
+            otherwise = instruction.otherwise
+            if otherwise is not None and otherwise != instruction.target:
+                targets.append(otherwise)
+            return targets
+
+    return None
+
+
+class ControlFlowGraph:
+    """The basic blocks of a function and the edges between them."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.entry = blocks[0] if blocks else None
+
+        # Where each block is, for falling through to the next one
+        self.positions = {block: index for index, block in enumerate(blocks)}
+
+        # Every label at the start of a block, generated or declared in the code
+        self.labels = {}
+        for block in blocks:
+            for instruction in block.instructions:
+                if instruction.op is not Opcode.LABEL:
+                    break
+                self.labels[instruction.target] = block
+
+        self.successors = {block: [] for block in blocks}
+        self.predecessors = {block: [] for block in blocks}
+        for block in blocks:
+            for successor in self.findSuccessors(block):
+                self.addEdge(block, successor)
+
+        self.order = None
+
+    def findSuccessors(self, block):
+        """Return the blocks that can follow a block, from its instructions."""
+
+        targets = jumpTargets(block)
+        if targets is None:
+            index = self.positions[block] + 1
+            return self.blocks[index : index + 1]
+
+        # Jumps to labels outside the function have no block to go to
+        labels = self.labels
+        return [labels[target] for target in targets if target in labels]
+
+    def addEdge(self, source, target):
+        """Add an edge between two blocks."""
+
+        if target not in self.successors[source]:
+            self.successors[source].append(target)
+            self.predecessors[target].append(source)
+            self.order = None
+
+    def removeEdge(self, source, target):
+        """Remove the edge between two blocks, if there is one."""
+
+        if target in self.successors[source]:
+            self.successors[source].remove(target)
+            self.predecessors[target].remove(source)
+            self.order = None
+
+    def refresh(self, block):
+        """Update the edges out of a block after its instructions changed."""
+
+        for successor in list(self.successors[block]):
+            self.removeEdge(block, successor)
+        for successor in self.findSuccessors(block):
+            self.addEdge(block, successor)
+
+    def reversePostorder(self):
+        """
+        Return the blocks reachable from the entry in reverse postorder, so
+        every block comes before its successors except along back edges.
+        The order is kept until the edges change.
+        """
+
+        if self.order is not None:
+            return self.order
+
+        order = []
+        if self.entry is not None:
+            visited = {self.entry}
+            stack = [(self.entry, iter(self.successors[self.entry]))]
+            while stack:
+                block, successors = stack[-1]
+                for successor in successors:
+                    if successor not in visited:
+                        visited.add(successor)
+                        stack.append((successor, iter(self.successors[successor])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(block)
+
+        order.reverse()
+        self.order = order
+
+        return order
+
+
+def buildGraphs(ir):
+    """Return the control-flow graph of every function in an IR, by name."""
+
+    return {
+        name: ControlFlowGraph(function["blocks"]) for name, function in ir.ir.items()
+    }
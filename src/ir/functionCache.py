@@ -0,0 +1,363 @@
+"""
+On-disk cache of the symbol table scope and IR of each function.
+A function is keyed by the hash of its subtree and of every top-level
+declaration before it, which is all it can see. Temporaries and labels are
+numbered across the whole program, so a cached function also records the
+numbers it used and is renumbered to fit wherever it is reused.
+The cache is kept under the user's cache directory, and the least recently
+used functions are deleted once it grows past cacheLimit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import parser.grammar as grammar
+import symbolTable.symbolTable as symbolTable
+import ir.ir as ir
+import ir.instructions as instructions
+from ir.instructions import Instr
+from parser.treeCache import hashText
+from util import userCacheDirectory, CacheSize
+
+cacheDirectory = userCacheDirectory("functions")
+
+# The least recently used functions are deleted once the cache is bigger than this
+cacheLimit = 32 * 1024 * 1024
+cacheSize = CacheSize(".function")
+
+# Changing how a function is compiled invalidates every cached function
+version = 2
+sourceHash = hashlib.sha256()
+for module in (grammar, symbolTable, ir, instructions):
+    with open(module.__file__, "rb") as source:
+        sourceHash.update(source.read())
+sourceHash = sourceHash.hexdigest()[:16]
+
+terminalKinds = set(grammar.terminals.values())
+
+# A temporary or label the compiler made up, like r12 or _L3, as a whole
+# word of a string in the JSON text of the blocks
+generated = re.compile(r'(?<=[" ])(r|_L)(\d+)(?=[" ])')
+
+
+def hashFunction(chain, root):
+    """
+    Return the key of a subtree seen after the declarations hashed into
+    chain, whether a name in it could be mistaken for a generated temporary
+    or label, and its nodes in preorder.
+    """
+
+    parts = [version, sourceHash, chain]
+    append = parts.append
+    values = []
+    nodes = []
+
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        kind = type(node)
+        append(kind.__name__)
+        if kind in terminalKinds:
+            append(node.value)
+            values.append(node.value)
+        else:
+            children = node if kind is list else getattr(node, "children", ())
+            append(len(children))
+            stack.extend(reversed(children))
+
+    ambiguous = generated.search(json.dumps(values)) is not None
+
+    return hashText("\0".join(map(str, parts))), ambiguous, nodes
+
+
+def cachePath(key):
+    """Return the cache filename for a function key."""
+
+    return os.path.join(cacheDirectory, f"{key}.function")
+
+
+def internNames(value):
+    """Return a value read from JSON with every string in it interned."""
+
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) is list:
+        return [internNames(item) for item in value]
+    return value
+
+
+def lookup(key):
+    """
+    Return the header and the JSON text of the blocks of a cached function,
+    or None if it is not cached.
+    """
+
+    path = cachePath(key)
+    try:
+        with open(path) as file:
+            header, blocks = file.read().split("\n", 1)
+        header = json.loads(header)
+    except (IOError, ValueError):
+        return None
+
+    # Mark the function as recently used, so pruning keeps it
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    # Share the lexer's strings for the names, as a fresh compile would
+    for field in ("variables", "labels", "globalUses", "arguments"):
+        header[field] = internNames(header[field])
+
+    return header, blocks
+
+
+def store(key, header, blocks):
+    """Save the header and blocks of a function under its key."""
+
+    os.makedirs(cacheDirectory, exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial entry
+    path = cachePath(key)
+    tempPath = f"{path}.{os.getpid()}"
+    text = f"{json.dumps(header)}\n{blocks}"
+    with open(tempPath, "w") as file:
+        file.write(text)
+    os.replace(tempPath, path)
+
+    cacheSize.add(cacheDirectory, len(text), cacheLimit)
+
+
+def counters(context):
+    """Return the current temporary and label counts of a compilation."""
+
+    return context.unique.get("none"), context.unique.get("_L")
+
+
+def relocate(blocks, shifts):
+    """Renumber the generated names in the JSON text of the blocks."""
+
+    if not any(shift for ranges in shifts.values() for _, _, shift in ranges):
+        return blocks
+
+    # Split into text, then the prefix and number of each name, then text
+    pieces = generated.split(blocks)
+    for index in range(2, len(pieces), 3):
+        number = int(pieces[index])
+        for low, high, shift in shifts[pieces[index - 1]]:
+            if low < number <= high:
+                pieces[index] = str(number + shift)
+                break
+
+    return "".join(pieces)
+
+
+def recordSymbols(st, declaration, nodes):
+    """
+    Return the def-use index of a function that was just walked, with nodes
+    given by their position in its preorder: the declaration and uses of each
+    variable and label, and the uses of each global name.
+    """
+
+    positions = {id(node): index for index, node in enumerate(nodes)}
+    name = declaration.name
+    scope = st.table.children[name]
+    symbols = st.symbols
+
+    def record(symbol):
+        declared = symbol.declaration
+        return [
+            None if declared is None else positions[id(declared)],
+            [positions[id(use)] for use in symbol.uses],
+        ]
+
+    variables = [
+        [variable, kind, *record(symbols[(name, variable)])]
+        for variable, kind in scope.variables.items()
+    ]
+    labels = [
+        [label, declared, *record(symbols[(name, label)])]
+        for label, declared in scope.labels.items()
+    ]
+
+    # The uses of a global name in this function are the last ones it has
+    globalUses = []
+    identifiers = dict.fromkeys(
+        node.value for node in nodes if type(node) is grammar.Identifier
+    )
+    for value in identifiers:
+        symbol = symbols.get(("global", value))
+        if symbol is None:
+            continue
+        uses = symbol.uses
+        first = len(uses)
+        while first and id(uses[first - 1]) in positions:
+            first -= 1
+        if first < len(uses):
+            globalUses.append([value, [positions[id(use)] for use in uses[first:]]])
+
+    return {"variables": variables, "labels": labels, "globalUses": globalUses}
+
+
+def restoreSymbols(st, declaration, header, nodes):
+    """Fill the scope of a cached function just opened, with its def-use index."""
+
+    name = declaration.name
+    symbols = st.symbols
+
+    for variable, kind, declared, uses in header["variables"]:
+        st.declareVariable(kind, variable, nodes[declared])
+        symbols[(name, variable)].uses.extend(map(nodes.__getitem__, uses))
+    for label, declared, position, uses in header["labels"]:
+        if declared:
+            st.declareLabel(label, nodes[position])
+        else:
+            st.useLabel(label)
+        symbols[(name, label)].uses.extend(map(nodes.__getitem__, uses))
+    for value, uses in header["globalUses"]:
+        symbols[("global", value)].uses.extend(map(nodes.__getitem__, uses))
+
+
+def analyze(ast, context=None):
+    """
+    Build the symbol table and IR like Compiler.analyze, reusing every
+    function that is cached. Returns the symbol table, the IR and the number
+    of cache hits and misses, or None if the tree has no declaration list.
+    """
+
+    if type(ast) is not grammar.DeclarationList:
+        return None
+
+    st = symbolTable.SymbolTable(context)
+    context = st.context
+    unique = context.unique
+    hits = 0
+    misses = 0
+
+    # Every declaration in order, with the key, cached entry, temporaries and
+    # def-use index of a function, which the IR is then generated from
+    declarations = []
+    chain = ""
+    for declaration in ast.children:
+        if type(declaration) is not grammar.FunctionDeclaration:
+            symbolTable.visitChildren(declaration, st, level=1, prepare=True)
+            declarations.append((declaration, None, True, None, None, None))
+            chain = hashFunction(chain, declaration)[0]
+            continue
+
+        key, ambiguous, nodes = hashFunction(chain, declaration)
+        entry = None if ambiguous else lookup(key)
+        temps = unique.get("none")
+        symbols = None
+
+        if entry is None:
+            misses += 1
+            symbolTable.visitChildren(declaration, st, level=1, prepare=True)
+            if not ambiguous:
+                symbols = recordSymbols(st, declaration, nodes)
+        else:
+            # Open the scope as the walk would, then fill it from the cache
+            hits += 1
+            header = entry[0]
+            symbolTable.startFunction(declaration, st, 1)
+            restoreSymbols(st, declaration, header, nodes)
+            low, high = header["prepareTemps"]
+            unique.count["none"] = temps + high - low
+
+        prepareTemps = (temps, unique.get("none"))
+        declarations.append((declaration, key, ambiguous, entry, prepareTemps, symbols))
+
+        # Later functions can call this one
+        chain = hashText(f"{chain} {declaration.name}")
+
+    ast.prepare(context)
+    st.verifyLabels()
+
+    result = ir.IR(ast, st)
+    for declaration, key, ambiguous, entry, prepareTemps, symbols in declarations:
+        temps, labels = counters(context)
+
+        if entry is None:
+            # The instructions of a global declaration end up in the next function
+            leftover = bool(result.stack)
+            result.visit(declaration)
+            if not (ambiguous or leftover):
+                start = (temps, labels)
+                saveFunction(result, st, declaration, key, prepareTemps, start, symbols)
+            continue
+
+        # Shift the cached numbers to start where this compile has got to
+        header, text = entry
+        low, high = header["prepareTemps"]
+        irLow, irHigh = header["irTemps"]
+        labelLow, labelHigh = header["labelNumbers"]
+        shifts = {
+            "r": [
+                (low, high, prepareTemps[0] - low),
+                (irLow, irHigh, temps - irLow),
+            ],
+            "_L": [(labelLow, labelHigh, labels - labelLow)],
+        }
+
+        blocks = []
+        for instructions in internNames(json.loads(relocate(text, shifts))):
+            blocks.append(
+                ir.BasicBlock(
+                    [Instr.fromList(entry) for entry in instructions[1:]],
+                    instructions[0][1],
+                )
+            )
+
+        result.ir[declaration.name] = {
+            "blocks": blocks,
+            "declarations": header["declarations"],
+            "arguments": header["arguments"],
+        }
+        result.current = declaration.name
+        unique.count["none"] = temps + irHigh - irLow
+        unique.count["_L"] = labels + labelHigh - labelLow
+
+    logging.info("Function cache: %d hits, %d misses.", hits, misses)
+
+    return st, result, hits, misses
+
+
+def saveFunction(result, st, declaration, key, prepareTemps, start, symbols):
+    """Cache the scope, def-use index and IR of a function that was just compiled."""
+
+    function = result.ir[declaration.name]
+    temps, labels = counters(st.context)
+
+    header = {
+        **symbols,
+        "prepareTemps": list(prepareTemps),
+        "irTemps": [start[0], temps],
+        "labelNumbers": [start[1], labels],
+        "declarations": function["declarations"],
+        "arguments": function["arguments"],
+    }
+    blocks = [
+        [instruction.toList() for instruction in block.instructions]
+        for block in function["blocks"]
+    ]
+    text = json.dumps(blocks)
+
+    # Only cache what reads back exactly and can be renumbered
+    if json.loads(json.dumps(header)) != header or json.loads(text) != blocks:
+        return
+
+    ranges = {
+        "r": [header["prepareTemps"], header["irTemps"]],
+        "_L": [header["labelNumbers"]],
+    }
+    for match in generated.finditer(text):
+        number = int(match.group(2))
+        if not any(low < number <= high for low, high in ranges[match.group(1)]):
+            return
+
+    store(key, header, text)
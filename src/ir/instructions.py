@@ -0,0 +1,168 @@
+"""
+Typed instructions of the intermediate representation.
+Operands are kept in named fields instead of list positions. Instructions
+still print and serialize as the lists the IR has always been written as,
+like ['r3', '=', 'a', '+', 'b'].
+"""
+
+import enum
+import re
+
+# What the fields of each kind of instruction hold:
+#   LABEL     target:
+#   COPY      dest = a
+#   BINARY    dest = a operator b
+#   UNARY     dest = operator a
+#   CALL      dest = call a with the argument list b
+#   RETURN    ret a
+#   GOTO      goto target
+#   BRANCH    if a goto target else goto otherwise
+#   BREAK     placeholders patched into gotos once the loop or switch ends
+#   CONTINUE
+# A branch whose otherwise is still None is waiting for its else label.
+
+
+class Opcode(enum.Enum):
+    """The kinds of IR instruction."""
+
+    LABEL = "label"
+    COPY = "copy"
+    BINARY = "binary"
+    UNARY = "unary"
+    CALL = "call"
+    RETURN = "ret"
+    GOTO = "goto"
+    BRANCH = "if"
+    BREAK = "break"
+    CONTINUE = "continue"
+
+
+class Temp(str):
+    """The name of a temporary, told apart from a variable by its type."""
+
+    __slots__ = ()
+
+
+def newTemp(context):
+    """Generate a new temporary of a compilation."""
+
+    return Temp(context.unique.new())
+
+
+# How a temporary is written, which is all a list read back can go by
+tempName = re.compile(r"r\d+")
+
+# Numbers, characters and strings
+constantName = re.compile(r"""[-+.\d'"]""")
+
+
+def operandKind(value):
+    """Return whether an operand is a "temporary", "constant" or "variable"."""
+
+    if type(value) is Temp:
+        return "temporary"
+    if constantName.match(value):
+        return "constant"
+    return "variable"
+
+
+def readOperand(value):
+    """Give an operand read back from a list its type again."""
+
+    if type(value) is str and tempName.fullmatch(value):
+        return Temp(value)
+    return value
+
+
+class Instr:
+    """A single IR instruction."""
+
+    __slots__ = ("op", "dest", "a", "b", "operator", "target", "otherwise")
+
+    def __init__(
+        self, op, dest=None, a=None, b=None, operator=None, target=None, otherwise=None
+    ):
+        self.op = op
+        self.dest = dest
+        self.a = a
+        self.b = b
+        self.operator = operator
+        self.target = target
+        self.otherwise = otherwise
+
+    def toList(self):
+        """Return the instruction as the list it prints and serializes as."""
+
+        op = self.op
+        if op is Opcode.COPY:
+            return [self.dest, "=", self.a]
+        if op is Opcode.BINARY:
+            return [self.dest, "=", self.a, self.operator, self.b]
+        if op is Opcode.LABEL:
+            return ["label", self.target]
+        if op is Opcode.RETURN:
+            return ["ret", self.a]
+        if op is Opcode.GOTO:
+            return ["goto", self.target]
+        if op is Opcode.BRANCH:
+            if self.otherwise is None:
+                return [
+                    "REPLACEME", "if", self.a, "GOTO", self.target, "else", "GOTO", "UNKNOWN"
+                ]
+            return ["if", self.a, "GOTO", self.target, "else", "GOTO", self.otherwise]
+        if op is Opcode.CALL:
+            return ["call", self.dest, "=", self.a, self.b]
+        if op is Opcode.UNARY:
+            return [self.dest, "=", self.operator, self.a]
+
+        return [op.value]
+
+    @classmethod
+    def fromList(cls, entry):
+        """Read an instruction back from its list."""
+
+        head = entry[0]
+        if len(entry) > 1 and entry[1] == "=":
+            dest = readOperand(head)
+            if len(entry) == 3:
+                return cls(Opcode.COPY, dest, readOperand(entry[2]))
+            if len(entry) == 4:
+                return cls(Opcode.UNARY, dest, readOperand(entry[3]), operator=entry[2])
+            return cls(
+                Opcode.BINARY,
+                dest,
+                readOperand(entry[2]),
+                readOperand(entry[4]),
+                operator=entry[3],
+            )
+
+        if head == "label":
+            return cls(Opcode.LABEL, target=entry[1])
+        if head == "ret":
+            return cls(Opcode.RETURN, a=readOperand(entry[1]))
+        if head == "goto":
+            return cls(Opcode.GOTO, target=entry[1])
+        if head == "if":
+            return cls(
+                Opcode.BRANCH, a=readOperand(entry[1]), target=entry[3], otherwise=entry[6]
+            )
+        if head == "REPLACEME":
+            return cls(Opcode.BRANCH, a=readOperand(entry[2]), target=entry[4])
+        if head == "call":
+            arguments = entry[4]
+            if type(arguments) is list:
+                arguments = [readOperand(argument) for argument in arguments]
+            return cls(Opcode.CALL, readOperand(entry[1]), entry[3], arguments)
+
+        return cls(Opcode(head))
+
+    def __eq__(self, other):
+        if type(other) is not Instr:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __str__(self):
+        return str(self.toList())
+
+    def __repr__(self):
+        return f"Instr({self.toList()!r})"
@@ -4,8 +4,28 @@ Intermediate Representations of the Parse Tree.
 """
 
 import json
-from util import unique, writeFile, readFile
+from util import (
+    writeFile,
+    readFile,
+    openOutput,
+    CompilerMessage,
+    Dispatch,
+    CompilationContext,
+)
 import parser.grammar as grammar
+import ir.binaryIr as binaryIr
+from ir.instructions import Instr, Opcode, newTemp
+
+# Statements whose first child is a condition
+conditionStatements = (
+    grammar.IfStatement,
+    grammar.WhileStatement,
+    grammar.SwitchStatement,
+)
+
+# What to do with each kind of node before and after the nodes within it
+enterHandlers = Dispatch()
+leaveHandlers = Dispatch()
 
 
 def readJson(filename):
@@ -33,18 +53,48 @@ def readJson(filename):
             currentBlock = BasicBlock([], entry[1])
             currentFunction["blocks"].append(currentBlock)
         else:
-            currentBlock.instructions.append(entry)
+            currentBlock.instructions.append(Instr.fromList(entry))
+
+    return ir
+
+
+def readBinary(filename):
+    """Read in a binary IR file, building the blocks as the records come."""
+
+    ir = IR(None, None)
+
+    for record in binaryIr.readRecords(filename):
+        if type(record) is tuple:
+            name, arguments, declarations = record
+            currentFunction = ir.ir[name] = {
+                "blocks": [],
+                "arguments": arguments,
+                "declarations": declarations,
+            }
+        elif record.op is Opcode.LABEL:
+            currentBlock = BasicBlock([], record.target)
+            currentFunction["blocks"].append(currentBlock)
+        else:
+            currentBlock.instructions.append(record)
 
     return ir
 
 
+def readIr(filename):
+    """Read in an IR file, in the binary format or as JSON."""
+
+    if binaryIr.isBinary(filename):
+        return readBinary(filename)
+    return readJson(filename)
+
+
 class BasicBlock:
     """Defines a set of instructions and data that compose a Basic Block."""
 
     def __init__(self, instructions, label=None):
         self.instructions = instructions
         self.label = label
-        self.instructions.insert(0, ["label", label])
+        self.instructions.insert(0, Instr(Opcode.LABEL, target=label))
 
     def print(self):
         """Print this basic block."""
@@ -57,17 +107,38 @@ class BasicBlock:
 class IR:
     """Intermediate Representation class to hold IR data."""
 
-    def __init__(self, parseTree, symbolTable):
+    def __init__(self, parseTree, symbolTable, context=None):
         self.parseTree = parseTree
         self.symbolTable = symbolTable
         self.stack = []
         self.ir = {}
         self.current = None
 
-    def generate(self):
-        """Generate the IR from the parse tree."""
+        # The breaks and continues of each open loop or switch, innermost last
+        self.jumps = []
 
-        self.parseTree.visit()
+        # The (instruction or node, field) pairs to set to the label of the
+        # next block, as jumps forward are made before their target exists
+        self.waiting = []
+
+        # Temporaries go on from those numbered while building the symbol table
+        if context is None:
+            if symbolTable is not None:
+                context = symbolTable.context
+            else:
+                context = CompilationContext()
+        self.context = context
+        self.unique = context.unique
+
+    def generate(self, prepared=False):
+        """
+        Generate the IR from the parse tree.
+        Pass prepared if the node values were already computed,
+        as buildSymbolTable does when asked to.
+        """
+
+        if not prepared:
+            self.parseTree.visit(self.context)
         self.visit(self.parseTree)
 
         return self.ir
@@ -76,198 +147,217 @@ class IR:
         """Save the stack as a block and start a new block."""
 
         if self.stack or force is True:
-            bb = BasicBlock(self.stack, unique.new("_L"))
+            bb = BasicBlock(self.stack, self.unique.new("_L"))
             self.ir[self.current]["blocks"].append(bb)
 
+            for owner, field in self.waiting:
+                setattr(owner, field, bb.label)
+            self.waiting = []
+
         self.stack = []
 
-    def visit(self, node):
-        """Visit a node of the parse tree and recurse."""
+    def visit(self, root):
+        """
+        Visit the nodes of the parse tree in order.
+        An explicit stack is used instead of recursion, so trees of any
+        depth can be visited. Besides nodes, it holds the calls to make
+        once the nodes above them on the stack are finished, as pairs of
+        a method and its argument.
+        """
+
+        stack = [root]
+        push = stack.append
+        while stack:
+            node = stack.pop()
+            kind = type(node)
+            if kind is tuple:
+                method, argument = node
+                method(self, argument)
+                continue
+
+            handler = enterHandlers[kind]
+            if handler is not None:
+                handler(self, node)
+            leave = leaveHandlers[kind]
+
+            # Slide to the left, slide to the right
+            # Recurse recurse, recurse recurse!
+            # ~ Dj Casper (Cha Cha Slide)
+            if kind in conditionStatements:
+                push((leave, node))
+                # The first child is the condition and an if's second is its body.
+                # They are Condition and IfBody nodes unless the tree was lowered.
+                for index in reversed(range(len(node.children))):
+                    child = node.children[index]
+                    if index == 0:
+                        push((IR.endCondition, node))
+                        push(child)
+                        push((IR.closeBlock, False))
+                    else:
+                        if index == 1 and kind is grammar.IfStatement:
+                            push((IR.endIfBody, node))
+                        push(child)
+            elif kind is list:
+                stack.extend(reversed(node))
+            elif getattr(node, "children", None):
+                push((leave, node))
+                stack.extend(reversed(node.children))
+            else:
+                # Leaves are finished straight away
+                leave(self, node)
+
+    @enterHandlers.register(grammar.FunctionDeclaration)
+    def enterFunction(self, node):
+        """Start a new function entry."""
+
+        self.ir[node.name] = {}
+        self.ir[node.name]["blocks"] = []
+        self.ir[node.name]["declarations"] = len(
+            self.symbolTable.table.children[node.name].variables
+        )
+        self.current = node.name
+
+    @enterHandlers.register(grammar.IfStatement)
+    def enterConditional(self, node):
+        """Start a new block for the condition, remembering its label."""
+
+        self.closeBlock()
+        self.waiting.append((node, "startLabel"))
+
+    @enterHandlers.register(grammar.WhileStatement, grammar.SwitchStatement)
+    def enterLoop(self, node):
+        """Start a loop or switch, collecting the jumps out of it."""
+
+        self.enterConditional(node)
+        self.jumps.append([])
+
+    @enterHandlers.register(grammar.ElseStatement, grammar.LabelDeclaration)
+    @leaveHandlers.register(grammar.ElseStatement)
+    def startBlock(self, node):
+        """Start a new basic block."""
+
+        self.closeBlock()
+
+    @leaveHandlers.register(grammar.Node)
+    def leaveNode(self, node):
+        """Add the instructions of a node to the current block."""
+
+        i = node.ir(self.context)
+        if i is not None:
+            self.stack.append(i)
+
+    @leaveHandlers.register(grammar.BreakStatement, grammar.ContinueStatement)
+    def leaveJump(self, node):
+        """Add a break or continue, patched once its loop or switch ends."""
+
+        jump = node.ir(self.context)
+        self.stack.append(jump)
+        if self.jumps:
+            self.jumps[-1].append(jump)
+
+    def patchJumps(self, continueLabel):
+        """
+        Point the jumps out of the innermost loop or switch at their labels,
+        the breaks at the next block.
+        """
+
+        for jump in self.jumps.pop():
+            if jump.op is Opcode.BREAK:
+                self.waiting.append((jump, "target"))
+            else:
+                jump.target = continueLabel
+            jump.op = Opcode.GOTO
 
-        # Start new basic blocks when we first encounter certain nodes.
-        if isinstance(node, grammar.FunctionDeclaration):
-            # Start a new function entry
-            self.ir[node.name] = {}
-            self.ir[node.name]["blocks"] = []
-            self.ir[node.name]["declarations"] = len(
-                self.symbolTable.table[node.name]["variables"]
-            )
-            self.current = node.name
-        elif isinstance(node, grammar.IfStatement):
-            self.closeBlock()
-            node.savedLabel = unique.get("_L")
-        elif isinstance(node, grammar.ElseStatement):
-            self.closeBlock()
-        elif isinstance(node, grammar.LabelDeclaration):
-            self.closeBlock()
-        elif isinstance(node, grammar.Condition):
-            self.closeBlock()
-        elif isinstance(node, grammar.WhileStatement):
-            self.closeBlock()
-            node.savedLabel = unique.get("_L")
-        elif isinstance(node, grammar.WhileCondition):
-            self.closeBlock()
-        elif isinstance(node, grammar.SwitchCondition):
+    @leaveHandlers.register(grammar.FunctionDeclaration)
+    def leaveFunction(self, node):
+        """Close the last blocks of a function."""
+
+        self.ir[node.name]["arguments"] = node.arguments.value
+        self.closeBlock()
+
+        # Add an extra basic block to ensure if jumps work correctly
+        self.closeBlock(force=True)
+
+    @leaveHandlers.register(grammar.IfStatement)
+    def leaveIf(self, node):
+        """Close an if, patching its condition or its body to jump past it."""
+
+        self.closeBlock()
+
+        # The condition already waits for the else, which the body jumps over
+        if node.hasElse:
+            self.waiting.append((node.exit, "target"))
+        else:
+            self.waiting.append((node.branch, "otherwise"))
+
+    @leaveHandlers.register(grammar.LabelDeclaration)
+    def leaveLabel(self, node):
+        """Put the label at the start of its block."""
+
+        self.stack.insert(0, node.ir(self.context))
+        self.closeBlock()
+
+    @leaveHandlers.register(grammar.WhileStatement)
+    def leaveWhile(self, node):
+        """Close a while, patching its condition, breaks and continues."""
+
+        # Must have a goto at the end of while statements to revisit the condition
+        self.stack.append(Instr(Opcode.GOTO, target=node.startLabel))
+        self.closeBlock()
+
+        # The condition and breaks leave for the block after the while statement
+        self.waiting.append((node.branch, "otherwise"))
+        self.patchJumps(node.startLabel)
+
+    @leaveHandlers.register(grammar.SwitchCase)
+    def leaveSwitchCase(self, node):
+        """Start a case with the comparison against the switch value."""
+
+        condition = newTemp(self.context)
+        self.stack.insert(
+            0, Instr(Opcode.BINARY, condition, node.operator, node.value, "==")
+        )
+        branch = Instr(Opcode.BRANCH, a=condition)
+        self.stack.insert(1, branch)
+        self.closeBlock()
+
+        # Either way the case goes on to the next block
+        self.waiting.append((branch, "target"))
+        self.waiting.append((branch, "otherwise"))
+
+    @leaveHandlers.register(grammar.SwitchStatement)
+    def leaveSwitch(self, node):
+        """Close a switch, patching its breaks and continues."""
+
+        self.closeBlock()
+        self.patchJumps(node.startLabel)
+
+    def endCondition(self, node):
+        """Finish the block of an if, while or switch condition."""
+
+        condition = node.children[0]
+
+        # Jump into the body, the else target is patched in once it is known
+        if not isinstance(node, grammar.SwitchStatement):
+            node.branch = Instr(Opcode.BRANCH, a=condition.value)
+            self.stack.append(node.branch)
             self.closeBlock()
-        elif isinstance(node, grammar.SwitchStatement):
+            self.waiting.append((node.branch, "target"))
+        else:
             self.closeBlock()
-            node.savedLabel = unique.get("_L")
-
-        # Slide to the left, slide to the right
-        # Recurse recurse, recurse recurse!
-        # ~ Dj Casper (Cha Cha Slide)
-        if hasattr(node, "children"):
-            for child in node.children:
-                self.visit(child)
-        elif isinstance(node, list):
-            for child in node:
-                self.visit(child)
-
-        if not isinstance(node, list):
-            # End the basic blocks we created earlier now that all
-            # the node within have been visited.
-            if isinstance(node, grammar.FunctionDeclaration):
-                self.ir[node.name]["arguments"] = node.arguments.value
-                self.closeBlock()
-
-                # Add an extra basic block to ensure if jumps work correctly
-                self.closeBlock(force=True)
-            elif isinstance(node, grammar.IfBody):
-                if node.hasElse:
-                    self.stack.append(["goto", f"_L{unique.get('_L') + 3}"])
-                self.closeBlock()
-            elif isinstance(node, grammar.IfStatement):
-                self.closeBlock()
-
-                if node.hasElse:
-                    elseLabel = f"_L{unique.get('_L')}"
-                else:
-                    elseLabel = f"_L{unique.get('_L') + 1}"
-
-                # The condition will be the block after the condition specified by savedLabel
-                # But savedLabel is not relational to the current function, whereas self.ir is
-                firstLabel = int(
-                    self.ir[self.current]["blocks"][0].instructions[0][1][2:]
-                )
-                index = node.savedLabel - firstLabel + 1
-
-                # Replace the placeholder of the if condition with the else label
-                x = self.ir[self.current]["blocks"][index].instructions
-                for index, ins in enumerate(x):
-                    if ins[0] == "REPLACEME":
-                        ins[-1] = elseLabel
-                        x[index] = ins[1:]
-
-            elif isinstance(node, grammar.Condition):
-                self.stack.append(
-                    [
-                        "REPLACEME",
-                        "if",
-                        node.value,
-                        "GOTO",
-                        f"_L{unique.get('_L') + 2}",
-                        "else",
-                        "GOTO",
-                        "UNKNOWN",
-                    ]
-                )
-                self.closeBlock()
-            elif isinstance(node, grammar.ElseStatement):
-                self.closeBlock()
-            elif isinstance(node, grammar.LabelDeclaration):
-                self.stack.insert(0, node.ir())
-                self.closeBlock()
-            elif isinstance(node, grammar.WhileStatement):
-                # Must have a goto at the end of while statements to revisit the condition
-                # The label of the condition is one after what was saved.
-                self.stack.append(["goto", f"_L{node.savedLabel + 1}"])
-                self.closeBlock()
-
-                # The condition will be the block after the condition specified by savedLabel
-                # But savedLabel is not relational to the current function, whereas self.ir is
-                firstLabel = int(
-                    self.ir[self.current]["blocks"][0].instructions[0][1][2:]
-                )
-                index = node.savedLabel - firstLabel + 1
-
-                # breakLabel is the basic block that comes after the while statement
-                breakLabel = f"_L{unique.get('_L') + 1}"
-
-                # Replace the placeholder of the while condition with break label
-                x = self.ir[self.current]["blocks"][index].instructions
-                for index, ins in enumerate(x):
-                    if ins[0] == "REPLACEME":
-                        ins[-1] = breakLabel
-                        x[index] = ins[1:]
-
-                # Replace any break statements with a goto to the breakLabel
-                for block in self.ir[self.current]["blocks"][index + 1 :]:
-                    for index, ins in enumerate(block.instructions):
-                        if ins == ["break"]:
-                            block.instructions[index] = ["goto", breakLabel]
-                        elif ins == ["continue"]:
-                            block.instructions[index] = [
-                                "goto",
-                                f"_L{node.savedLabel + 1}",
-                            ]
-
-            elif isinstance(node, grammar.WhileCondition):
-                self.stack.append(
-                    [
-                        "REPLACEME",
-                        "if",
-                        node.value,
-                        "GOTO",
-                        f"_L{unique.get('_L') + 2}",
-                        "else",
-                        "GOTO",
-                        "UNKNOWN",
-                    ]
-                )
-                self.closeBlock()
-            elif isinstance(node, grammar.SwitchCondition):
-                self.closeBlock()
-            elif isinstance(node, grammar.SwitchCase):
-                condition = unique.new()
-                self.stack.insert(0, [condition, "=", node.operator, "==", node.value])
-                self.stack.insert(
-                    1,
-                    [
-                        "if",
-                        condition,
-                        "GOTO",
-                        f"_L{unique.get('_L') + 2}",
-                        "else",
-                        "GOTO",
-                        f"_L{unique.get('_L') + 2}",
-                    ],
-                )
-                self.closeBlock()
-            elif isinstance(node, grammar.SwitchStatement):
-                self.closeBlock()
 
-                firstLabel = int(
-                    self.ir[self.current]["blocks"][0].instructions[0][1][2:]
-                )
-                index = node.savedLabel - firstLabel
-
-                breakLabel = f"_L{unique.get('_L') + 1}"
+    def endIfBody(self, node):
+        """Finish the body of an if, jumping over the else if there is one."""
 
-                # Replace any break statements with a goto to the breakLabel
-                for block in self.ir[self.current]["blocks"][index + 1 :]:
-                    for index, ins in enumerate(block.instructions):
-                        if ins == ["break"]:
-                            block.instructions[index] = ["goto", breakLabel]
-                        elif ins == ["continue"]:
-                            block.instructions[index] = [
-                                "goto",
-                                f"_L{node.savedLabel + 1}",
-                            ]
+        if node.hasElse:
+            # Patched to the block after the else once the if is left
+            node.exit = Instr(Opcode.GOTO)
+            self.stack.append(node.exit)
+        self.closeBlock()
 
-            else:
-                i = node.ir()
-                if i is not None:
-                    self.stack.append(i)
+        # The condition leaves for the else
+        if node.hasElse:
+            self.waiting.append((node.branch, "otherwise"))
 
     def print(self):
         """Print the intermediate representation as a string."""
@@ -281,7 +371,15 @@ class IR:
         print("```")
 
     def write(self, filename):
-        """Write the ASM to a JSON file."""
+        """Write the IR to a file, as JSON unless the name ends in .irb."""
+
+        if filename.endswith(binaryIr.extension):
+            self.writeBinary(filename)
+        else:
+            self.writeJson(filename)
+
+    def writeJson(self, filename):
+        """Write the IR to a JSON file."""
 
         s = []
         for function in self.ir:
@@ -289,14 +387,38 @@ class IR:
                 [
                     f".{function}",
                     self.ir[function]["arguments"],
-                    len(self.symbolTable.table[function]["variables"]),
+                    self.ir[function]["declarations"],
                 ]
             )
             for block in self.ir[function]["blocks"]:
                 for instruction in block.instructions:
-                    s.append(instruction)
+                    s.append(instruction.toList())
+
+        writeFile(filename, json.dumps(s), self.context)
+
+    def writeBinary(self, filename):
+        """Write the IR to a binary file, one instruction at a time."""
 
-        writeFile(filename, json.dumps(s))
+        file = openOutput(filename, "wb", self.context)
+        if file is None:
+            return
+
+        with file:
+            writer = binaryIr.Writer(file)
+            for function in self.ir:
+                writer.function(
+                    function,
+                    self.ir[function]["arguments"],
+                    self.ir[function]["declarations"],
+                )
+                for block in self.ir[function]["blocks"]:
+                    for instruction in block.instructions:
+                        writer.instruction(instruction)
+            writer.flush()
+
+        self.context.messages.add(
+            CompilerMessage(f"Wrote to file: '{filename}'.", "success")
+        )
 
     def __str__(self):
         s = []
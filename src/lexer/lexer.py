@@ -4,6 +4,7 @@ Converts a file into a list of identified tokens.
 """
 
 import re
+import sys
 import logging
 import lexer.tokens as tokens
 from lexer.tokens import Token, symbols, keywords
@@ -11,6 +12,11 @@ from util import CompilerMessage
 
 debug = False
 
+# Names are interned, so every token, node, symbol table key and IR operand
+# for the same name shares one string. Comparing two of them is then an
+# identity check and the hash is only ever computed once.
+intern = sys.intern
+
 
 def tokenize(code):
     """Parse the file (as a string) into a list of tokens."""
@@ -35,6 +41,51 @@ def tokenize(code):
     return codeTokens
 
 
+def iterTokenize(lines):
+    """
+    Tokenize an iterable of lines (like an open file) one token at a time.
+    Yields the same tokens as tokenize without holding them all in memory.
+    """
+
+    isComment = False
+    escaped = ""
+
+    # Tokens held back until we know they are not the start of a float
+    window = []
+
+    def release():
+        while window:
+            if window[0].kind == tokens.number:
+                if len(window) < 3 and (len(window) < 2 or window[1].kind == tokens.period):
+                    return
+                if window[1].kind == tokens.period and window[2].kind == tokens.number:
+                    yield Token(tokens.number, f"{window[0].content}.{window[2].content}")
+                    del window[:3]
+                    continue
+            yield window.pop(0)
+
+    for line in lines:
+        line = escaped + line.rstrip("\r\n").replace("\t", "")
+
+        # Join escaped lines with the line after them
+        if line.endswith("\\"):
+            escaped = line[:-1]
+            continue
+        escaped = ""
+
+        lineTokens, isComment = tokenizeLine(line, isComment)
+        window.extend(lineTokens)
+        yield from release()
+
+    if escaped:
+        lineTokens, isComment = tokenizeLine(escaped, isComment)
+        window.extend(lineTokens)
+
+    window.append(Token(tokens.eof, "$"))
+    yield from release()
+    yield from window
+
+
 def tokenizeLine(line, isComment):
     """Parse a line into tokens"""
     lineTokens = []
@@ -163,7 +214,7 @@ def tokenizeLine(line, isComment):
 
         if symbol == tokens.colon:
             if matchNumber(line[start:end]) is None:
-                lineTokens.append(Token(tokens.label, line[start:end]))
+                lineTokens.append(Token(tokens.label, intern(line[start:end])))
                 start = end + 1
                 end = start
 
@@ -227,7 +278,7 @@ def tokenizeChunk(text):
     if keyword is not None:
         if debug is True:
             logging.debug("Found keyword: %s", text)
-        return Token(keyword, text)
+        return Token(keyword, intern(text))
 
     # Check if it a number second
     number = matchNumber(text)
@@ -241,14 +292,14 @@ def tokenizeChunk(text):
     if identifier is not None:
         if debug is True:
             logging.debug("Found identifier: %s", text)
-        return Token(tokens.identifier, text)
+        return Token(tokens.identifier, intern(text))
 
     label = matchLabel(text)
     if label is not None:
         if debug is True:
             logging.debug("Found label: %s", text)
         print(f"Found label: {text}")
-        return Token(tokens.label, text[:-1])
+        return Token(tokens.label, intern(text[:-1]))
 
     # If it is none of the above, we do not recognize this type
     raise CompilerMessage(f"Unrecogized token: '{text}'")
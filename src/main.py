@@ -6,9 +6,16 @@ import sys
 import getopt
 import logging
 import os
+import io
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from util import readFile, ensureDirectory
 
-from parser.lrParser import LRParser
+from parser.lrParser import ParserRun, ParseStats, getParseTables, loadedTables
+import parser.treeCache as treeCache
+from parser.events import DeclarationStream
+from parser.parallel import parseParallel
+from parser.treeWriter import writeTree, formats
 import lexer.lexer as lexer
 from parser.grammar import (
     DeclarationList,
@@ -21,9 +28,29 @@ from parser.grammar import (
     StructList,
     VarList,
 )
-from ir.ir import IR, readJson
-from symbolTable.symbolTable import buildSymbolTable, flattenTree
-from util import CompilerMessage, messages
+from parser.lowering import lowerTree
+from ir.ir import IR, readIr
+import ir.functionCache as functionCache
+from symbolTable.symbolTable import (
+    SymbolTable,
+    buildSymbolTable,
+    flattenTree,
+    visitChildren,
+)
+from util import CompilerMessage, CompilationContext, messages
+
+# The recursive list rules that are collapsed after parsing
+flattenReducers = (
+    Arguments,
+    Parameters,
+    DeclarationList,
+    StatementList,
+    StatementListNew,
+    SwitchCaseList,
+    EnumList,
+    StructList,
+    VarList,
+)
 
 
 class Compiler:
@@ -36,12 +63,31 @@ class Compiler:
         self.output = options.get("output")
         self.input = options.get("input")
         self.asmOutput = options.get("asmOutput")
+        self.useCache = options.get("cache", False)
+        self.useLowering = options.get("lower", False)
+        self.treeFormat = options.get("treeFormat", "text")
+        self.maxDepth = options.get("maxDepth")
+        self.parseStats = options.get("parseStats")
+        self.incremental = options.get("incremental")
+        self.jobs = options.get("jobs")
+
+        # The counters and messages of this compilation alone
+        self.context = options.get("context") or CompilationContext()
+
         self.tokens = []
-        self.parseTree = None
+        self.fromCache = False
+        self.sourceHash = None
+        self.grammarHash = None
+        self._parseTree = None
+        self.ast = None
         self.symbolTable = None
         self.ir = None
         self.asm = None
 
+        # Function cache hits and misses of the last analyze
+        self.functionHits = 0
+        self.functionMisses = 0
+
         # Setup default grammar if none provided
         if self.grammar is None:
             # messages.add(
@@ -55,15 +101,43 @@ class Compiler:
 
         # Warn if output flag exists but no filename specified
         if "-o" in self.flags and self.output is None:
-            messages.add(
+            self.context.messages.add(
                 CompilerMessage("No output file specified. Not dumping IR.", "warning")
             )
 
+    @property
+    def parseTree(self):
+        """The parse tree. Setting it drops the AST lowered from the old one."""
+
+        return self._parseTree
+
+    @parseTree.setter
+    def parseTree(self, value):
+        self._parseTree = value
+        self.ast = None
+
     def tokenize(self):
         """Tokenize the input file."""
 
-        # Read in the file and tokenize
+        # Read in the file
         code = readFile(self.filename)
+
+        # Look for a cached parse tree of this exact source and grammar
+        if self.useCache:
+            self.sourceHash = treeCache.hashText(code)
+            self.grammarHash = treeCache.hashText(readFile(self.grammar))
+
+            # Parser statistics need a real parse
+            if "-f" not in self.flags and self.parseStats is None:
+                tree = treeCache.lookup(self.sourceHash, self.grammarHash)
+                if tree is not None:
+                    self.parseTree = tree
+                    self.fromCache = True
+
+            # The tokens are only needed if they are printed
+            if self.fromCache and "-s" not in self.flags:
+                return self.tokens
+
         self.tokens = lexer.tokenize(code)
 
         if self.tokens is None:
@@ -73,7 +147,7 @@ class Compiler:
 
         # Print the tokens
         if "-s" in self.flags:
-            messages.add(CompilerMessage("Tokens:", "important"))
+            self.context.messages.add(CompilerMessage("Tokens:", "important"))
             for token in self.tokens:
                 print(token)
 
@@ -82,23 +156,45 @@ class Compiler:
     def parse(self):
         """Parse the tokens using our LR Parser."""
 
+        # Reuse the tree decoded from the cache
+        if self.fromCache:
+            if "-p" in self.flags:
+                self.printParseTree()
+
+            return self.parseTree
+
         # Cannot parse until we tokenize
         if not self.tokens:
             raise CompilerMessage("Cannot parse without tokenizing first.")
 
-        parser = LRParser()
-
         # Check if we should force generate the tables
-        if "-f" in self.flags:
-            parser.loadParseTables(self.grammar, force=True)
-        else:
-            parser.loadParseTables(self.grammar, force=False)
+        # Otherwise tables already loaded by this process are shared
+        tables = getParseTables(
+            self.grammar, force="-f" in self.flags, context=self.context
+        )
+        stats = ParseStats() if self.parseStats is not None else None
 
         # Parse the tokens and save the parse tree
-        self.parseTree = parser.parse(self.tokens)
+        # An IncrementalParser shared between compiles reuses unchanged subtrees
+        if self.incremental is not None and stats is None:
+            self.parseTree = self.incremental.parse(self.tokens, self.context)
+        elif self.jobs is not None and stats is None:
+            self.parseTree = parseParallel(
+                tables, self.tokens, self.jobs, context=self.context
+            )
+        else:
+            self.parseTree = ParserRun(tables, stats, self.context).parse(self.tokens)
+
+        if stats is not None:
+            stats.save(self.parseStats, tables)
+            self.context.messages.add(
+                CompilerMessage(
+                    f"Saved parser statistics to '{self.parseStats}'.", "success"
+                )
+            )
 
         if self.parseTree is None:
-            messages.add(CompilerMessage("Failed to parse the tokens."))
+            self.context.messages.add(CompilerMessage("Failed to parse the tokens."))
             return None
 
         # Change [Program] to Program
@@ -107,26 +203,38 @@ class Compiler:
         #messages.add(CompilerMessage("Successfully parsed the tokens.", "success"))
 
         # Flatten the parse tree
-        for reduce in [
-            Arguments,
-            Parameters,
-            DeclarationList,
-            StatementList,
-            StatementListNew,
-            SwitchCaseList,
-            EnumList,
-            StructList,
-            VarList,
-        ]:
-            flattenTree(self.parseTree, reducer=reduce)
+        flattenTree(self.parseTree, flattenReducers)
+
+        # Save the flattened tree so unchanged files can skip lexing and parsing
+        if self.useCache:
+            treeCache.store(self.sourceHash, self.grammarHash, self.parseTree)
 
         # Print the parse tree
         if "-p" in self.flags:
-            messages.add(CompilerMessage("Parse Tree:", "important"))
-            parser.print()
+            self.printParseTree()
 
         return self.parseTree
 
+    def printParseTree(self):
+        """Print the parse tree in the requested format."""
+
+        self.context.messages.add(CompilerMessage("Parse Tree:", "important"))
+        writeTree(self.parseTree, fmt=self.treeFormat, maxDepth=self.maxDepth)
+
+    def lower(self, always=False):
+        """
+        Return the tree the later phases walk: the compact AST when lowering
+        was asked for, as it only pays for itself over several walks, and the
+        parse tree otherwise. Pass always to get the AST regardless.
+        """
+
+        if not (self.useLowering or always):
+            return self.parseTree
+        if self.ast is None:
+            self.ast = lowerTree(self.parseTree)
+
+        return self.ast
+
     def buildSymbolTable(self):
         """Build a symbol table from a parse tree."""
 
@@ -135,27 +243,41 @@ class Compiler:
             raise CompilerMessage("Cannot build symbol table without a parse tree.")
 
         # Save the symbol table
-        self.symbolTable = buildSymbolTable(self.parseTree)
+        self.symbolTable = buildSymbolTable(self.lower(), context=self.context)
 
         if self.symbolTable is None:
-            messages.add(CompilerMessage("Failed to build the symbol table."))
+            self.context.messages.add(
+                CompilerMessage("Failed to build the symbol table.")
+            )
             return None
 
        # messages.add(CompilerMessage("Successfully built the symbol table.", "success"))
 
         # Print the symbol table if flag is present
         if "-t" in self.flags:
-            messages.add(CompilerMessage("Symbol Table:", "important"))
+            self.context.messages.add(CompilerMessage("Symbol Table:", "important"))
             self.symbolTable.print()
         return self.symbolTable
 
+    def check(self):
+        """
+        Check the syntax and semantics of the file, stopping before the IR.
+        Returns whether the file is valid, errors are raised as usual.
+        """
+
+        self.tokenize()
+        if self.parse() is None:
+            return False
+
+        return self.buildSymbolTable() is not None
+
     def generateIr(self):
         """Convert a parse tree to the first intermediate representation."""
 
         # Read in an IR from a file
         if "-i" in self.flags and self.input is not None:
-            self.ir = readJson(self.input)
-            messages.add(
+            self.ir = readIr(self.input)
+            self.context.messages.add(
                 CompilerMessage(
                     f"Succesfully parsed the IR in '{self.input}'.", "success"
                 )
@@ -170,17 +292,63 @@ class Compiler:
                 raise CompilerMessage("Cannot generate an IR without a symbol table.")
 
             # Create a new instance of IR
-            self.ir = IR(self.parseTree, self.symbolTable)
+            self.ir = IR(self.lower(), self.symbolTable)
 
             # Generate the IR
             output = self.ir.generate()
 
             if output is None:
-                messages.add(CompilerMessage("Failed to generate an IR."))
+                self.context.messages.add(
+                    CompilerMessage("Failed to generate an IR.")
+                )
                 return None
 
             #messages.add(CompilerMessage("Successfully generated an IR.", "success"))
 
+        self.outputIr()
+
+        return self.ir
+
+    def analyze(self):
+        """
+        Build the symbol table and then the IR, in two walks of the tree
+        instead of three. The results are the same as buildSymbolTable
+        followed by generateIr. With the cache on, unchanged functions are
+        reused from the function cache instead.
+        """
+
+        if not self.parseTree:
+            raise CompilerMessage("Cannot build symbol table without a parse tree.")
+
+        # Reuse the scope and IR of every unchanged function
+        if self.useCache:
+            # The cache keys functions by their lowered shape, and a hit saves
+            # far more than lowering costs
+            cached = functionCache.analyze(self.lower(always=True), self.context)
+        else:
+            cached = None
+        if cached is not None:
+            self.symbolTable, self.ir, self.functionHits, self.functionMisses = cached
+        else:
+            # Node values are computed while building the symbol table
+            self.symbolTable = buildSymbolTable(
+                self.lower(), prepare=True, context=self.context
+            )
+            self.ir = IR(self.lower(), self.symbolTable)
+
+        if "-t" in self.flags:
+            self.context.messages.add(CompilerMessage("Symbol Table:", "important"))
+            self.symbolTable.print()
+
+        if cached is None:
+            self.ir.generate(prepared=True)
+        self.outputIr()
+
+        return self.ir
+
+    def outputIr(self):
+        """Print and save the IR as asked for by the flags."""
+
         if "-r" in self.flags:
             #messages.add(CompilerMessage("Intermediate Representation:", "important"))
             print("---------------- ANÁLISIS LÉXICO EXITOSO ----------------------\n")
@@ -192,9 +360,133 @@ class Compiler:
         if "-o" in self.flags and self.output is not None:
             self.ir.write(self.output)
 
+    def stream(self):
+        """
+        Compile straight from parser events, one top-level declaration at a time.
+        Only the symbols and IR of a declaration are kept once it is emitted,
+        so memory is bounded by the biggest function instead of the file.
+        Temporaries are numbered per function, so their names can differ
+        from a regular compile of the same file.
+        """
+
+        if "-s" in self.flags or "-p" in self.flags:
+            self.context.messages.add(
+                CompilerMessage(
+                    "Tokens and parse trees are not printed when streaming.", "warning"
+                )
+            )
+
+        tables = getParseTables(
+            self.grammar, force="-f" in self.flags, context=self.context
+        )
+        self.symbolTable = SymbolTable(self.context)
+        self.ir = IR(None, self.symbolTable)
+
+        def emit(declaration):
+            flattenTree(declaration, flattenReducers)
+
+            ast = lowerTree(declaration) if self.useLowering else declaration
+            visitChildren(ast, self.symbolTable, level=1, prepare=True)
+            self.ir.visit(ast)
+
+        with open(self.filename) as file:
+            parsed = ParserRun(tables, context=self.context).parseEvents(
+                lexer.iterTokenize(file), DeclarationStream(tables, emit)
+            )
+
+        if parsed is None:
+            self.context.messages.add(CompilerMessage("Failed to parse the tokens."))
+            return None
+
+        self.symbolTable.verifyLabels()
+
+        if "-t" in self.flags:
+            self.context.messages.add(CompilerMessage("Symbol Table:", "important"))
+            self.symbolTable.print()
+
+        self.outputIr()
+
         return self.ir
 
 
+# The options every file is checked with in a worker process
+checkOptions = None
+
+
+def loadChecker(options, tables):
+    """Keep the check options and the parse tables in a worker process."""
+
+    global checkOptions
+    checkOptions = options
+    loadedTables[options["grammar"]] = tables
+
+
+def checkFile(filename):
+    """Check a file, returning whether it is valid and its diagnostics."""
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            valid = Compiler(dict(checkOptions, filename=filename)).check()
+        except CompilerMessage as err:
+            print(err)
+            valid = False
+        # A file that breaks the compiler must not stop the others being checked
+        except Exception as err:  # pylint: disable=broad-except
+            print(CompilerMessage(f"{type(err).__name__}: {err}"))
+            valid = False
+
+    return valid, output.getvalue()
+
+
+def checkFiles(filenames, options):
+    """
+    Check the syntax and semantics of many files on a pool of processes,
+    printing the diagnostics of each file in order. The parse tables are
+    loaded once here and handed to every worker. Returns the number of
+    invalid files.
+    """
+
+    grammar = Compiler(options).grammar
+    tables = getParseTables(grammar, force="-f" in options.get("flags", []))
+    workerOptions = {
+        "grammar": grammar,
+        "cache": options.get("cache", False),
+        "lower": options.get("lower", False),
+    }
+    jobs = min(options.get("jobs") or os.cpu_count() or 1, len(filenames))
+
+    # Small batches keep the workers busy without a round trip per file
+    if jobs < 2:
+        loadChecker(workerOptions, tables)
+        results = map(checkFile, filenames)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(
+            jobs, initializer=loadChecker, initargs=(workerOptions, tables)
+        )
+        chunk = max(1, len(filenames) // (jobs * 4))
+        results = pool.map(checkFile, filenames, chunksize=chunk)
+
+    invalid = 0
+    try:
+        for filename, (valid, output) in zip(filenames, results):
+            if not valid:
+                invalid += 1
+                print(CompilerMessage(f"Check failed: '{filename}'."))
+            sys.stdout.write(output)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    level = "error" if invalid else "success"
+    messages.add(
+        CompilerMessage(f"Checked {len(filenames)} files, {invalid} invalid.", level)
+    )
+
+    return invalid
+
+
 def printUsage():
     """Print a usage statement."""
 
@@ -202,7 +494,8 @@ def printUsage():
     end = "\033[0m"
 
     print(f"\n  {bold}Usage{end}:\n")
-    print("    python3 main.py [<flags>] filename\n")
+    print("    python3 main.py [<flags>] filename")
+    print("    python3 main.py --check [<flags>] filename...\n")
     print(f"  {bold}Flags{end}:\n")
     print("     -h, --help                  Output this usage information.")
     print("     -v, --verbose               Generate a log file with debug info.")
@@ -217,11 +510,21 @@ def printUsage():
     )
     print("     -r, --representation        Generate an intermediate representation.")
     print("     -i, --input <filename>      Input an IR file and start from there.")
-    print("     -o, --output <filename>     Output the IR to a file.")
+    print(
+        "     -o, --output <filename>     Output the IR to a file, as JSON, or binary if it ends in .irb."
+    )
     print(
         "     -a, --asm                   Generate assembly instructions from the IR."
     )
     print("     -n, --asmOutput <filename>  Output the assembly to a file.")
+    print("         --no-cache              Do not read or write the parse tree and function caches.")
+    print("         --tree-format <format>  Print the parse tree as text, sexpr or jsonl.")
+    print("         --max-depth <depth>     Only print the parse tree this many levels deep.")
+    print("         --parse-stats <filename> Save parser hot-path counters as JSON.")
+    print("         --stream                Compile one declaration at a time without a tree.")
+    print("         --lower                 Lower the parse tree into a compact AST first.")
+    print("         --jobs <count>          Parse function bodies, or check files, in this many processes.")
+    print("         --check                 Only check the syntax and semantics of each file given.")
     print()
 
 
@@ -245,6 +548,14 @@ def parseArguments():
                 "output=",
                 "input=",
                 "asmOutput=",
+                "no-cache",
+                "tree-format=",
+                "max-depth=",
+                "parse-stats=",
+                "stream",
+                "lower",
+                "jobs=",
+                "check",
             ],
         )
     except getopt.GetoptError as err:
@@ -257,6 +568,14 @@ def parseArguments():
     output = None
     inputFile = None
     asmOutput = None
+    cache = True
+    treeFormat = "text"
+    maxDepth = None
+    parseStats = None
+    stream = False
+    lower = False
+    jobs = None
+    check = False
 
     for opt, arg in opts:
         if opt in ("-h", "--help"):
@@ -287,6 +606,36 @@ def parseArguments():
         elif opt in ("-n", "--asmOutput"):
             flags.append("-n")
             asmOutput = arg
+        elif opt == "--no-cache":
+            cache = False
+        elif opt == "--tree-format":
+            if arg not in formats:
+                print(f"Unknown tree format '{arg}'.")
+                printUsage()
+                sys.exit(2)
+            treeFormat = arg
+        elif opt == "--max-depth":
+            try:
+                maxDepth = int(arg)
+            except ValueError:
+                print(f"Invalid max depth '{arg}'.")
+                printUsage()
+                sys.exit(2)
+        elif opt == "--parse-stats":
+            parseStats = arg
+        elif opt == "--stream":
+            stream = True
+        elif opt == "--lower":
+            lower = True
+        elif opt == "--jobs":
+            try:
+                jobs = int(arg)
+            except ValueError:
+                print(f"Invalid job count '{arg}'.")
+                printUsage()
+                sys.exit(2)
+        elif opt == "--check":
+            check = True
 
     try:
         filename = args[0]
@@ -297,7 +646,23 @@ def parseArguments():
             printUsage()
             sys.exit()
 
-    return filename, grammar, flags, output, inputFile, asmOutput
+    return {
+        "filename": filename,
+        "grammar": grammar,
+        "flags": flags,
+        "output": output,
+        "input": inputFile,
+        "asmOutput": asmOutput,
+        "cache": cache,
+        "treeFormat": treeFormat,
+        "maxDepth": maxDepth,
+        "parseStats": parseStats,
+        "stream": stream,
+        "lower": lower,
+        "jobs": jobs,
+        "check": check,
+        "filenames": args,
+    }
 
 
 def startLog():
@@ -322,7 +687,17 @@ def startLog():
 def main():
     """Run the compiler from the command line."""
 
-    filename, grammar, flags, output, inputFile, asmOutput = parseArguments()
+    options = parseArguments()
+    flags = options["flags"]
+
+    # Checking stops after the symbol table and reports every file
+    if options["check"]:
+        try:
+            invalid = checkFiles(options["filenames"], options)
+        except CompilerMessage as err:
+            print(err)
+            sys.exit(2)
+        sys.exit(1 if invalid else 0)
 
     # Define levels for each step of the compiler
     # Run up to max level
@@ -339,9 +714,9 @@ def main():
         # The output file is the name of the input file
         # with .c replaced with .s in the current working directory.
         flags.append("-n")
-        basename = os.path.basename(filename)
+        basename = os.path.basename(options["filename"])
         noExtension = basename.rsplit(".", 1)[0]
-        asmOutput = f"{noExtension}.s"
+        options["asmOutput"] = f"{noExtension}.s"
 
     if "-s" in flags:
         level = 1
@@ -358,14 +733,10 @@ def main():
     if "-n" in flags:
         level = 5
 
-    options = {
-        "filename": filename,
-        "grammar": grammar,
-        "flags": flags,
-        "output": output,
-        "input": inputFile,
-        "asmOutput": asmOutput,
-    }
+    # Collecting parser statistics needs at least the parse step
+    if options["parseStats"] is not None:
+        level = max(level, 2)
+
     compiler = Compiler(options)
 
     try:
@@ -373,17 +744,23 @@ def main():
         if "-v" in flags:
             startLog()
 
+        # Streaming runs every step up to the IR from the parser events
+        if options["stream"] and "-i" not in flags:
+            compiler.stream()
+            if level >= 5:
+                compiler.assemble()
         # If not starting from IR
-        if "-i" not in flags:
+        elif "-i" not in flags:
             for i in range(level + 1):
                 if i == 1:
                     compiler.tokenize()
                 elif i == 2:
                     compiler.parse()
+                elif i == 3 and level >= 4:
+                    # Builds the IR too, sharing a walk of the tree
+                    compiler.analyze()
                 elif i == 3:
                     compiler.buildSymbolTable()
-                elif i == 4:
-                    compiler.generateIr()
                 elif i == 5:
                     compiler.assemble()
         else:
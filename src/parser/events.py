@@ -0,0 +1,69 @@
+"""
+Handlers for the shift and reduce events of ParserRun.parseEvents.
+TreeBuilder builds the same parse tree as ParserRun.parse, and
+DeclarationStream hands each top-level declaration to a callback as soon
+as it is parsed, so a whole translation unit is never held in memory.
+"""
+
+
+class TreeBuilder:
+    """Build parse tree nodes from parser events."""
+
+    def __init__(self, tables):
+        self.builders = tables.builders
+        self.shiftBuilders = tables.shiftBuilders
+
+    def shift(self, token, content):
+        """Only terminals like IDs and numbers become parse tree nodes."""
+
+        builder = self.shiftBuilders.get(token)
+        if builder is not None:
+            return builder(content)
+
+        return None
+
+    def reduce(self, lhs, production, values):
+        """Build the node of a rule, or pass its nodes through if it has no class."""
+
+        nodes = []
+        for value in values:
+            if isinstance(value, list):
+                nodes.extend(value)
+            elif value is not None:
+                nodes.append(value)
+
+        builder = self.builders[production]
+        if builder is not None:
+            return builder(nodes)
+
+        # Rules without a node class pass one or more nodes up untouched
+        if len(nodes) == 1:
+            return nodes[0]
+
+        return nodes or None
+
+
+class DeclarationStream(TreeBuilder):
+    """
+    Build the parse tree of one top-level declaration at a time.
+    Each declaration is passed to onDeclaration and then dropped,
+    along with the declaration list and program that would hold it.
+    """
+
+    def __init__(self, tables, onDeclaration):
+        super().__init__(tables)
+        self.onDeclaration = onDeclaration
+
+    def reduce(self, lhs, production, values):
+        if lhs == "declaration":
+            self.onDeclaration(super().reduce(lhs, production, values))
+            return None
+
+        if lhs == "declarationList":
+            return None
+
+        # Tell a finished parse apart from a failed one
+        if lhs == "program":
+            return True
+
+        return super().reduce(lhs, production, values)
@@ -1,10 +1,11 @@
-# pylint: disable=missing-docstring, attribute-defined-outside-init
+# pylint: disable=missing-docstring, attribute-defined-outside-init, unused-argument
 
 """
 Classes that represent grammar rules for our Parse Tree.
 """
 
-from util import unique
+from parser.treeWriter import writeTree
+from ir.instructions import Instr, Opcode, Temp, newTemp
 
 
 def parseToken(desc, content="", children=None):
@@ -50,34 +51,33 @@ class Node:
         General node print method.
         First, print the class name, then print all its children.
 
-        This method is overriden at lower level nodes like ConstNum.
+        Terminal nodes like ConstNum print their value instead.
         """
 
-        printPrefix(level)
-        print(self.__class__.__name__)
-
-        if isinstance(self.children, list):
-            for child in self.children:
-                child.print(level + 1)
-        else:
-            for child in self.children[0]:
-                child.print(level + 1)
+        writeTree(self, level=level)
 
     # pylint: disable=no-self-use
-    def ir(self):
+    def ir(self, context):
         return None
 
-    def prepare(self):
+    def prepare(self, context):
         return None
 
     # pylint: enable=no-self-use
 
-    def visit(self):
-        if hasattr(self, "children"):
-            for child in self.children:
-                child.visit()
+    def visit(self, context):
+        """Prepare every node below this one, children before their parents."""
 
-        self.prepare()
+        stack = [(self, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                node.prepare(context)
+                continue
+
+            stack.append((node, True))
+            if hasattr(node, "children"):
+                stack.extend((child, False) for child in reversed(node.children))
 
 
 # Parse Tree Node Classes
@@ -104,7 +104,7 @@ class FunctionDeclaration(Node):
 
 
 class Arguments(Node):
-    def prepare(self):
+    def prepare(self, context):
         s = []
         for i in self.children:
             s.append(i.name)
@@ -124,7 +124,7 @@ class Argument(Node):
 
 
 class Parameters(Node):
-    def prepare(self):
+    def prepare(self, context):
         s = []
         for i in self.children:
             s.append(i.value)
@@ -155,11 +155,11 @@ class StatementNew(Node):
 
 
 class ReturnStatement(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.expr = self.children[0]
 
-    def ir(self):
-        return ["ret", self.expr.value]
+    def ir(self, context):
+        return Instr(Opcode.RETURN, a=self.expr.value)
 
 
 class VariableDeclaration(Node):
@@ -172,19 +172,24 @@ class VariableDeclaration(Node):
         if len(self.children) == 3:
             self.expr = self.children[2]
 
-    def ir(self):
+    def ir(self, context):
         if len(self.children) == 3:
-            return [self.name, "=", self.expr.children[0].value]
+            # Read past the Expression wrapper, which is prepared before a
+            # unary child has its value, unless the tree was lowered
+            expr = self.expr
+            if type(expr) is Expression:
+                expr = expr.children[0]
+            return Instr(Opcode.COPY, self.name, expr.value)
 
         return None
 
 
 class LabelDeclaration(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
-    def ir(self):
-        return ["label", self.value]
+    def ir(self, context):
+        return Instr(Opcode.LABEL, target=self.value)
 
 
 # Assignments
@@ -195,9 +200,9 @@ class VariableAssignment(Node):
         self.children = children
         self.name = children[0].name
 
-    def ir(self):
-        recent = unique.count["none"]
-        return [self.name, "=", f"r{recent}"]
+    def ir(self, context):
+        recent = context.unique.count["none"]
+        return Instr(Opcode.COPY, self.name, Temp(f"r{recent}"))
 
 
 class IncrementAssignment(Node):
@@ -205,9 +210,9 @@ class IncrementAssignment(Node):
         self.children = children
         self.name = self.children[0].value
 
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", self.name, "+", "1"]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.BINARY, self.value, self.name, "1", "+")
 
 
 class DecrementAssignment(Node):
@@ -215,9 +220,9 @@ class DecrementAssignment(Node):
         self.children = children
         self.name = self.children[0].value
 
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", self.name, "-", "1"]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.BINARY, self.value, self.name, "1", "-")
 
 
 class PlusEqualAssignment(Node):
@@ -226,9 +231,9 @@ class PlusEqualAssignment(Node):
         self.name = self.children[0].value
         self.expr = self.children[1]
 
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", self.name, "+", self.expr.value]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.BINARY, self.value, self.name, self.expr.value, "+")
 
 
 class MinusEqualAssignment(Node):
@@ -237,9 +242,9 @@ class MinusEqualAssignment(Node):
         self.name = self.children[0].value
         self.expr = self.children[1]
 
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", self.name, "-", self.expr.value]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.BINARY, self.value, self.name, self.expr.value, "-")
 
 
 class MultEqualAssignment(Node):
@@ -248,9 +253,9 @@ class MultEqualAssignment(Node):
         self.name = self.children[0].value
         self.expr = self.children[1]
 
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", self.name, "*", self.expr.value]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.BINARY, self.value, self.name, self.expr.value, "*")
 
 
 class DivEqualAssignment(Node):
@@ -259,9 +264,9 @@ class DivEqualAssignment(Node):
         self.name = self.children[0].value
         self.expr = self.children[1]
 
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", self.name, "/", self.expr.value]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.BINARY, self.value, self.name, self.expr.value, "/")
 
 
 class CallAssignment(Node):
@@ -270,9 +275,9 @@ class CallAssignment(Node):
         self.name = self.children[0].value
         self.expr = self.children[1]
 
-    def ir(self):
-        self.value = unique.new()
-        return f"{self.value} = call {self.name} - {self.expr.value}"
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.CALL, self.value, self.name, self.expr.value)
 
 
 class ExpressionAssignment(Node):
@@ -281,107 +286,107 @@ class ExpressionAssignment(Node):
         self.name = self.children[0].value
         self.expr = self.children[1]
 
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", self.expr.value]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.COPY, self.value, self.expr.value)
 
 
 # Expressions
 
 
 class Expression(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
 
 class NestedExpression(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
 
 class MathExpression(Node):
-    def prepare(self):
-        self.value = unique.new()
+    def prepare(self, context):
+        self.value = newTemp(context)
         self.a = self.children[0].value
         self.b = self.children[1].value
 
 
 class AdditionExpression(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "+", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "+")
 
 
 class SubtractionExpression(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "-", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "-")
 
 
 class MultiplicationExpression(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "*", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "*")
 
 
 class DivisionExpression(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "/", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "/")
 
 
 class ModulusExpression(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "%", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "%")
 
 
 class BooleanAnd(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "&&", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "&&")
 
 
 class BooleanOr(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "||", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "||")
 
 
 class BooleanNot(Node):
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", "!", self.children[0].value]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.UNARY, self.value, self.children[0].value, operator="!")
 
 
 class ComparisonExpression(Node):
-    def prepare(self):
-        self.value = unique.new()
+    def prepare(self, context):
+        self.value = newTemp(context)
         self.a = self.children[0].value
         self.b = self.children[1].value
 
 
 class LTOEExpression(ComparisonExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "<=", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "<=")
 
 
 class GTOEExpression(ComparisonExpression):
-    def ir(self):
-        return [self.value, "=", self.a, ">=", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, ">=")
 
 
 class LTExpression(ComparisonExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "<", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "<")
 
 
 class GTExpression(ComparisonExpression):
-    def ir(self):
-        return [self.value, "=", self.a, ">", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, ">")
 
 
 class NotEqualExpression(ComparisonExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "!=", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "!=")
 
 
 class EqualExpression(ComparisonExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "==", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "==")
 
 
 # Statements
@@ -392,23 +397,22 @@ class ForStatement(Node):
 
 
 class WhileStatement(Node):
-    def ir(self):
-        return ["while", self.children[0].ir()]
+    pass
 
 
 class WhileCondition(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
 
 class BreakStatement(Node):
-    def ir(self):
-        return ["break"]
+    def ir(self, context):
+        return Instr(Opcode.BREAK)
 
 
 class ContinueStatement(Node):
-    def ir(self):
-        return ["continue"]
+    def ir(self, context):
+        return Instr(Opcode.CONTINUE)
 
 
 class IncludeStatement(Node):
@@ -421,17 +425,17 @@ class CallStatement(Node):
         self.name = self.children[0].value
         self.parameters = self.children[1]
 
-    def prepare(self):
-        self.value = unique.new()
+    def prepare(self, context):
+        self.value = newTemp(context)
 
-    def ir(self):
-        return ["call", self.value, "=", self.name, self.parameters.value]
+    def ir(self, context):
+        return Instr(Opcode.CALL, self.value, self.name, self.parameters.value)
 
 
 class GotoStatement(Node):
-    def ir(self):
+    def ir(self, context):
         self.value = self.children[0].value
-        return ["goto", self.value]
+        return Instr(Opcode.GOTO, target=self.value)
 
 
 class IfStatement(Node):
@@ -453,7 +457,7 @@ class IfBody(Node):
 
 
 class Condition(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
 
@@ -462,7 +466,7 @@ class ElseStatement(Node):
 
 
 class SwitchStatement(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
         for case in self.children[1].children:
@@ -474,44 +478,44 @@ class SwitchCaseList(Node):
 
 
 class SwitchCase(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
 
 class SwitchCondition(Node):
-    def prepare(self):
+    def prepare(self, context):
         self.value = self.children[0].value
 
 
 class BitAnd(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "&", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "&")
 
 
 class BitOr(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "|", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "|")
 
 
 class BitXor(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "^", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "^")
 
 
 class BitNot(Node):
-    def ir(self):
-        self.value = unique.new()
-        return [self.value, "=", "~", self.children[0].value]
+    def ir(self, context):
+        self.value = newTemp(context)
+        return Instr(Opcode.UNARY, self.value, self.children[0].value, operator="~")
 
 
 class LeftShift(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, "<<", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, "<<")
 
 
 class RightShift(MathExpression):
-    def ir(self):
-        return [self.value, "=", self.a, ">>", self.b]
+    def ir(self, context):
+        return Instr(Opcode.BINARY, self.value, self.a, self.b, ">>")
 
 
 class EnumStatement(Node):
@@ -538,6 +542,49 @@ class VarList(Node):
     pass
 
 
+class NodeList(Node):
+    """
+    The items of an X* or X+ repetition in the grammar, in order.
+    Each reduction links to the shorter list before it instead of copying it,
+    and the items are collected the first time children is read. Earlier
+    lists are never changed, so the parser can reuse them.
+    """
+
+    def __init__(self, children, previous=None):
+        self.value = None
+        self.items = children
+        self.previous = previous
+
+    @classmethod
+    def extend(cls, children):
+        """Build a list from the list before it and the next items."""
+
+        return cls(children[1:], children[0])
+
+    @property
+    def children(self):
+        if self.previous is not None:
+            parts = []
+            node = self
+            while node.previous is not None:
+                parts.append(node.items)
+                node = node.previous
+
+            items = list(node.items)
+            for part in reversed(parts):
+                items.extend(part)
+
+            self.items = items
+            self.previous = None
+
+        return self.items
+
+    @children.setter
+    def children(self, children):
+        self.items = children
+        self.previous = None
+
+
 # A dictionary of all the parse tree nodes we recognize
 # Key: string of the grammar rule
 # Value: the associated class
@@ -622,10 +669,6 @@ class TypeSpecifier(Node):
     def __init__(self, value):
         self.value = value
 
-    def print(self, level=0):
-        printPrefix(level)
-        print(f"{self.__class__.__name__}: {self.value}")
-
 
 class ConstNum(Node):
     """Number constant node."""
@@ -633,10 +676,6 @@ class ConstNum(Node):
     def __init__(self, value):
         self.value = value
 
-    def print(self, level=0):
-        printPrefix(level)
-        print(f"{self.__class__.__name__}: {self.value}")
-
 
 class Identifier(Node):
     """ID node."""
@@ -644,10 +683,6 @@ class Identifier(Node):
     def __init__(self, value):
         self.value = value
 
-    def print(self, level=0):
-        printPrefix(level)
-        print(f"{self.__class__.__name__}: {self.value}")
-
 
 class Filename(Node):
     """Filename node."""
@@ -655,10 +690,6 @@ class Filename(Node):
     def __init__(self, value):
         self.value = value
 
-    def print(self, level=0):
-        printPrefix(level)
-        print(f"{self.__class__.__name__}: {self.value}")
-
 
 class String(Node):
     """String node."""
@@ -666,10 +697,6 @@ class String(Node):
     def __init__(self, value):
         self.value = value
 
-    def print(self, level=0):
-        printPrefix(level)
-        print(f"{self.__class__.__name__}: {self.value}")
-
 
 class Label(Node):
     """Label node."""
@@ -677,10 +704,6 @@ class Label(Node):
     def __init__(self, value):
         self.value = value
 
-    def print(self, level=0):
-        printPrefix(level)
-        print(f"{self.__class__.__name__}: {self.value}")
-
 
 # A dictionary of all the terminal parse tree nodes we recognize
 # Key: string of the grammar rule
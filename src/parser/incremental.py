@@ -0,0 +1,266 @@
+"""
+Incremental reparsing for editor and watch-mode compiles.
+Every reduction remembers the parser state it started from and how many
+tokens it spans. After an edit, subtrees whose tokens (and the token that
+follows them) did not change are shifted whole whenever the parser reaches
+the state they started from, so only the edited region is parsed again.
+"""
+
+from util import CompilerMessage, CompilationContext
+
+
+class Subtree:
+    """
+    A reduced nonterminal from a previous parse.
+    children holds the sub-Subtrees, and the token counts (1 for a token,
+    0 for an EMPTY symbol) of everything else that was reduced with it.
+    """
+
+    __slots__ = ("lhs", "state", "length", "values", "children")
+
+    def __init__(self, lhs, state, length, values, children):
+        self.lhs = lhs
+        self.state = state
+        self.length = length
+        self.values = values
+        self.children = children
+
+
+def sameToken(a, b):
+    """Check if two tokens have the same kind and content."""
+
+    return a.kind is b.kind and a.content == b.content
+
+
+class IncrementalParser:
+    """
+    Parse successive versions of a token list, reusing unchanged subtrees.
+    The returned nodes are shared with later parses, so callers may only
+    change them in ways that are safe to repeat (flattenTree is).
+    """
+
+    def __init__(self, tables, context=None):
+        self.tables = tables
+
+        # Where errors go when a parse is not given a compilation of its own
+        self.context = context if context is not None else CompilationContext()
+
+        # The previous version of the tokens and the Subtree of its program
+        self.tokens = None
+        self.root = None
+
+        # How many subtrees and tokens the last parse reused
+        self.reusedSubtrees = 0
+        self.reusedTokens = 0
+
+    def parse(self, tokens, context=None):
+        """
+        Parse the tokens, reusing what we can from the previous parse.
+        Syntax errors are reported to the messages of the context.
+        """
+
+        if context is None:
+            context = self.context
+
+        old = self.tokens
+        stream = []
+        prefix = suffix = delta = 0
+
+        if old is not None and self.root is not None:
+            # Find the unchanged tokens before and after the edit
+            limit = min(len(old), len(tokens))
+            while prefix < limit and sameToken(old[prefix], tokens[prefix]):
+                prefix += 1
+            while suffix < limit - prefix and sameToken(
+                old[-1 - suffix], tokens[-1 - suffix]
+            ):
+                suffix += 1
+
+            delta = len(tokens) - len(old)
+            stream.append((self.root, 0))
+
+        # Old token positions at or after this one are in the unchanged suffix
+        oldSuffix = len(old) - suffix if old is not None else 0
+        newSuffix = len(tokens) - suffix
+
+        def reusable(subtree, offset):
+            # The subtree's tokens and the token after it must be unchanged
+            return offset + subtree.length < prefix or offset >= oldSuffix
+
+        terminals = self.tables.terminals
+        actions = self.tables.parseActions
+        goto = self.tables.goto
+        productions = self.tables.productions
+        builders = self.tables.builders
+        shiftBuilders = self.tables.shiftBuilders
+
+        values = []
+        lookahead = 0
+        states = [0]
+        starts = [0]
+
+        # The Subtree or token count of every symbol on the stack
+        symbols = []
+
+        self.reusedSubtrees = 0
+        self.reusedTokens = 0
+
+        while True:
+            state = states[-1]
+            realToken = tokens[lookahead]
+            if realToken.kind.desc() in terminals:
+                token = realToken.kind.desc()
+            else:
+                token = realToken.content
+
+            try:
+                row = actions[state]
+            except KeyError:
+                return self.fail(
+                    f"No entry in the action table for [{state}][{token}]", context
+                )
+
+            action = row.get(token)
+
+            # Look for an old subtree starting at this token
+            if stream:
+                if lookahead < prefix:
+                    position = lookahead
+                elif lookahead >= newSuffix:
+                    position = lookahead - delta
+                else:
+                    position = None
+
+                subtree = None
+                while stream and position is not None:
+                    subtree, offset = stream[-1]
+                    end = offset + subtree.length
+
+                    # Skip subtrees we have already parsed past
+                    if end < position or (end == position and offset < position):
+                        stream.pop()
+                        subtree = None
+                        continue
+
+                    # Break down subtrees that start before this token
+                    # or that cannot be reused as a whole
+                    if offset < position or (
+                        offset == position and not reusable(subtree, offset)
+                    ):
+                        stream.pop()
+                        self.breakDown(stream, subtree, offset)
+                        subtree = None
+                        continue
+
+                    if offset > position:
+                        subtree = None
+                    break
+
+                if subtree is not None:
+                    nextState = goto.get(state, {}).get(subtree.lhs)
+                    if subtree.state == state and nextState is not None:
+                        # Shift the whole subtree as if it had just been reduced
+                        stream.pop()
+                        starts.append(len(values))
+                        states.append(nextState)
+                        symbols.append(subtree)
+                        values.extend(subtree.values)
+                        lookahead += subtree.length
+
+                        self.reusedSubtrees += 1
+                        self.reusedTokens += subtree.length
+                        continue
+
+                    # The parser will shift this token before it could reach
+                    # the subtree's state, so only its pieces can be reused
+                    if action is not None and action >= 0:
+                        stream.pop()
+                        self.breakDown(stream, subtree, offset)
+                        continue
+
+            if action is None:
+                # if actions happens to have EMPTY in the set
+                action = row.get("EMPTY")
+                if action is None:
+                    return self.fail(
+                        f"State {state} does not have Token {token}", context
+                    )
+
+                # Shift an EMPTY symbol, which consumes nothing
+                if action >= 0:
+                    starts.append(len(values))
+                    states.append(action)
+                    symbols.append(0)
+                continue
+
+            # If the action table says to shift, shift the next token
+            if action >= 0:
+                starts.append(len(values))
+                states.append(action)
+                symbols.append(1)
+                lookahead += 1
+
+                builder = shiftBuilders.get(token)
+                if builder is not None:
+                    values.append(builder(realToken.content))
+                continue
+
+            # Otherwise reduce, remembering the new subtree for the next parse
+            production = ~action
+            lhs, length = productions[production]
+
+            if lhs == "ACC":
+                break
+
+            start = starts[-length]
+            children = tuple(symbols[-length:])
+            del states[-length:]
+            del starts[-length:]
+            del symbols[-length:]
+
+            builder = builders[production]
+            if builder is not None:
+                nodes = values[start:]
+                del values[start:]
+                values.append(builder(nodes))
+
+            size = 0
+            for child in children:
+                size += child if isinstance(child, int) else child.length
+
+            symbols.append(
+                Subtree(lhs, states[-1], size, tuple(values[start:]), children)
+            )
+
+            nextState = goto[states[-1]].get(lhs)
+            if nextState is not None:
+                starts.append(start)
+                states.append(nextState)
+
+        self.tokens = tokens
+        self.root = symbols[-1]
+
+        return values
+
+    @staticmethod
+    def breakDown(stream, subtree, offset):
+        """Replace a subtree in the stream with its child subtrees."""
+
+        pieces = []
+        for child in subtree.children:
+            if isinstance(child, int):
+                offset += child
+            else:
+                pieces.append((child, offset))
+                offset += child.length
+
+        stream.extend(reversed(pieces))
+
+    def fail(self, message, context):
+        """Report a parse error and forget the previous parse."""
+
+        context.messages.add(CompilerMessage(message))
+        self.tokens = None
+        self.root = None
+
+        return None
@@ -0,0 +1,90 @@
+"""
+Lower the flattened parse tree into a compact AST.
+The grammar leaves behind wrapper nodes that only pass their single child
+through, so every walker after parsing visits them for nothing. Lowering
+copies the tree without those layers and leaves the parse tree untouched.
+"""
+
+import parser.grammar as grammar
+
+# Nodes that are dropped when they wrap exactly one child
+wrappers = {
+    grammar.Program,
+    grammar.Declaration,
+    grammar.Statement,
+    grammar.Expression,
+    grammar.NestedExpression,
+    grammar.IfBody,
+    grammar.Condition,
+    grammar.WhileCondition,
+    grammar.SwitchCondition,
+}
+
+
+def lowerTree(root):
+    """Return a copy of the parse tree with the wrapper nodes removed."""
+
+    root = unwrap(root)
+    if not hasattr(root, "children"):
+        return root
+
+    top = copyNode(root)
+    stack = [(root, top)]
+    while stack:
+        original, node = stack.pop()
+        attributes = node.__dict__
+
+        children = []
+        for child in original.children:
+            # Terminals are never changed by later passes, so they are shared
+            if not hasattr(child, "children"):
+                children.append(child)
+                continue
+
+            lowered = unwrap(child)
+            if hasattr(lowered, "children"):
+                copy = copyNode(lowered)
+                stack.append((lowered, copy))
+                lowered = copy
+            children.append(lowered)
+
+            # Point attributes like expr or condition at the lowered child
+            for name, value in attributes.items():
+                if value is child:
+                    attributes[name] = lowered
+
+        node.children = children
+
+    return top
+
+
+def unwrap(node):
+    """Skip the wrapper nodes around a node."""
+
+    while type(node) in wrappers and len(node.children) == 1:
+        node = node.children[0]
+
+    return node
+
+
+def copyNode(node):
+    """Copy a node, sharing its children until they are replaced."""
+
+    # A shallow copy, without the overhead of copy.copy
+    copy = object.__new__(type(node))
+    copy.__dict__.update(node.__dict__)
+
+    return copy
+
+
+def countNodes(root):
+    """Count the nodes in a tree."""
+
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(getattr(node, "children", ()))
+
+    return count
@@ -8,9 +8,17 @@ Parses the list of tokens using the action and goto tables.
 import logging
 import os
 import json
+import threading
+from types import MappingProxyType
 from halo import Halo
 import parser.grammar as grammar
-from util import readFile, messages, CompilerMessage, ensureDirectory
+from util import (
+    readFile,
+    messages,
+    CompilerMessage,
+    ensureDirectory,
+    CompilationContext,
+)
 
 debug = True
 printDebug = False
@@ -36,12 +44,20 @@ class LRParser:
         self.actions = {}
         self.goto = {}
 
+        # Action entries that overwrote a different action while building
+        self.conflicts = []
+
         # Parse tree, represented as a node list
         self.parseTree = []
 
+        # The frozen ParseTables every parse shares, built on first use
+        self.frozenTables = None
+
     def buildTables(self):
         """Build the item sets, transitions, and action goto tables."""
 
+        self.frozenTables = None
+
         # Start itemset 0 with the accepting state
         self.itemSets[0] = [Item("ACC", "program", 0, "$")]
 
@@ -99,6 +115,8 @@ class LRParser:
         the rule points to.
         """
 
+        self.frozenTables = None
+
         # Augment rules with accepting state
         self.rules["ACC"] = [["program"]]
 
@@ -135,6 +153,11 @@ class LRParser:
                 else:
                     self.rules[rule[0]] = [rule[last:]]
 
+        # Rewrite X*, X+ and [X] into the rules they stand for
+        for alternatives in list(self.rules.values()):
+            for i, r in enumerate(alternatives):
+                alternatives[i] = [self.desugar(token) for token in r]
+
         # add all the nonTerminals to self.nonTerminal list
         for k in self.rules:
             if k not in self.nonTerminals:
@@ -199,6 +222,29 @@ class LRParser:
         #    for v in self.first[k]:
         #        print('\t', v)
 
+    def desugar(self, token):
+        """
+        Replace an EBNF operator with a generated nonTerminal named after it.
+        X* and X+ become left recursive lists, which keep the parse stack
+        shallow however long the list is, and [X] is either X or nothing.
+        """
+
+        if isRepetition(token):
+            item = self.desugar(token[:-1])
+            if token not in self.rules:
+                # X* is built on X+, like the hand written lists, so that the
+                # lookaheads of its reductions include the first tokens of X
+                if token[-1] == "*":
+                    self.rules[token] = [[self.desugar(item + "+")], ["EMPTY"]]
+                else:
+                    self.rules[token] = [[token, item], [item]]
+        elif isOption(token):
+            item = self.desugar(token[1:-1])
+            if token not in self.rules:
+                self.rules[token] = [[item], ["EMPTY"]]
+
+        return token
+
     def closure(self, setNum):
         """
         Close out an item set.
@@ -378,9 +424,9 @@ class LRParser:
                                 if item.rhs == " ".join(r):
                                     if itemSetNum not in self.actions.keys():
                                         self.actions[itemSetNum] = {}
-                                    self.actions[itemSetNum][
-                                        item.following
-                                    ] = "r %s %i" % (k, i)
+                                    self.setAction(
+                                        itemSetNum, item.following, "r %s %i" % (k, i)
+                                    )
 
         # go through transition table to get:
         for k1, v1 in self.transitions.items():
@@ -394,19 +440,95 @@ class LRParser:
                 else:
                     if k1 not in self.actions.keys():
                         self.actions[k1] = {}
-                    self.actions[k1][k2] = "s %i" % (v2)
+                    self.setAction(k1, k2, "s %i" % (v2))
+
+    def setAction(self, state, token, action):
+        """
+        Set an action table entry, recording a conflict if it replaces
+        a different action. The newest action always wins.
+        """
 
-    def loadParseTables(self, grammarFile, force=False):
+        previous = self.actions[state].get(token)
+        if previous is not None and previous != action:
+            if previous[0] == "s" or action[0] == "s":
+                kind = "shift/reduce"
+            else:
+                kind = "reduce/reduce"
+
+            self.conflicts.append(
+                {
+                    "kind": kind,
+                    "state": state,
+                    "token": token,
+                    "replaced": previous,
+                    "chosen": action,
+                }
+            )
+
+        self.actions[state][token] = action
+
+    def tableReport(self, tableFileName=None):
+        """Summarize the conflicts, size and density of the built tables."""
+
+        states = sorted(self.itemSets.keys())
+        entriesPerState = {}
+        for state in states:
+            entriesPerState[state] = {
+                "actions": len(self.actions.get(state, {})),
+                "goto": len(self.goto.get(state, {})),
+            }
+
+        actionEntries = sum(e["actions"] for e in entriesPerState.values())
+        gotoEntries = sum(e["goto"] for e in entriesPerState.values())
+        cells = len(states) * (len(self.terminals) + len(self.nonTerminals))
+
+        report = {
+            "states": len(states),
+            "terminals": len(self.terminals),
+            "nonTerminals": len(self.nonTerminals),
+            "productions": sum(len(v) for v in self.rules.values()),
+            "actionEntries": actionEntries,
+            "gotoEntries": gotoEntries,
+            "density": (actionEntries + gotoEntries) / cells if cells else 0,
+            "shiftReduceConflicts": sum(
+                1 for c in self.conflicts if c["kind"] == "shift/reduce"
+            ),
+            "reduceReduceConflicts": sum(
+                1 for c in self.conflicts if c["kind"] == "reduce/reduce"
+            ),
+            "conflicts": self.conflicts,
+            "entriesPerState": entriesPerState,
+        }
+
+        if tableFileName is not None and os.path.isfile(tableFileName):
+            report["tableFileBytes"] = os.path.getsize(tableFileName)
+
+        return report
+
+    def saveReport(self, reportFileName, tableFileName=None):
+        """Dump the table report as JSON."""
+
+        report = self.tableReport(tableFileName)
+        with open(reportFileName, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+
+        return report
+
+    def loadParseTables(self, grammarFile, force=False, context=None):
         """
         Load the saved grammar tables if they exist.
-        Otherwise generate new ones and save them.
+        Otherwise generate new ones and save them, reporting to the messages
+        of the compilation's context, or of the process without one.
         """
 
+        collector = context.messages if context is not None else messages
+
         grammarName = grammarFile.split("/")[1].split(".")[0]
         tableFile = "{}{}{}".format("tables/", grammarName, "_table.json")
+        reportFile = "{}{}{}".format("tables/", grammarName, "_report.json")
 
         # Ensure the tables directory exists
-        ensureDirectory("tables")
+        ensureDirectory("tables", context)
 
         # Parse the input grammar
         self.parseGrammar(readFile(grammarFile))
@@ -418,7 +540,7 @@ class LRParser:
             self.loadTables(readFile(tableFile))
         else:
             # Parse the tokens using an LR(1) table
-            messages.add(
+            collector.add(
                 CompilerMessage(
                     "Generating new tables. Consider removing the -f flag.", "warning"
                 )
@@ -429,10 +551,29 @@ class LRParser:
 
             self.buildTables()
             self.saveTables(tableFile)
+            report = self.saveReport(reportFile, tableFile)
 
             spinner.stop()
             spinner.succeed("Finished generating new tables.")
 
+            collector.add(
+                CompilerMessage(
+                    f"{report['states']} states, "
+                    f"{report['actionEntries'] + report['gotoEntries']} entries, "
+                    f"{report['density']:.2%} dense. Report saved to '{reportFile}'.",
+                    "success",
+                )
+            )
+            if self.conflicts:
+                collector.add(
+                    CompilerMessage(
+                        f"{report['shiftReduceConflicts']} shift/reduce and "
+                        f"{report['reduceReduceConflicts']} reduce/reduce conflicts "
+                        "were resolved by overwriting.",
+                        "warning",
+                    )
+                )
+
     def saveTables(self, tableFileName):
         """Dump the action and goto tables as JSON."""
 
@@ -447,6 +588,7 @@ class LRParser:
     def loadTables(self, tableFile):
         """Parse the saved action and goto tables from the JSON."""
 
+        self.frozenTables = None
         lines = tableFile.splitlines()
         tempActions = json.loads(lines[0])
         for key, value in tempActions.items():
@@ -455,10 +597,11 @@ class LRParser:
         for key, value in tempGoto.items():
             self.goto[int(key)] = value
 
-    def parse(self, tokens):
+    def parse(self, tokens, stats=None):
         """
         Parse the program (as a list of tokens)
         using our actino and goto tables.
+        Counters are recorded into stats when a ParseStats is given.
         """
 
         # Save this for testing!
@@ -468,153 +611,24 @@ class LRParser:
             self.printTransitions()
             self.printTable()
 
-        lookahead = 0
-        done = False
-        states = [0]
-        output = []
-        stack = []
-
-        while not done:
-            state = states[len(states) - 1]
-            realToken = tokens[lookahead]
-            if realToken.kind.desc() in self.terminals:
-                token = realToken.kind.desc()
-            else:
-                token = realToken.content
-
-            if debug:
-                logging.debug(
-                    "---\nState: %s\nStates: %s\nlookahead Token: %s\
-                        \nstack: %s\noutput: %s\nActions: %s\n",
-                    state,
-                    states,
-                    token,
-                    stack,
-                    output,
-                    self.actions[state],
-                )
-            if printDebug:
-                print(
-                    "---\nState: %s\nStates: %s\nlookahead Token: %s\n"
-                    "stack: %s\noutput: %s\nparse Tree: %s\n"
-                    % (state, states, token, stack, output, self.parseTree)
-                )
-
-            try:
-                # Check if we have an entry in our action table for the lookahead token
-                if token in self.actions[state].keys():
-                    result = self.actions[state][token]
-                    output.append(result)
-                    result = result.split(" ")
-
-                    # If the action table says to shift, shift the next token
-                    if result[0] == "s":
-                        states.append(int(result[1]))
-                        stack.append(token)
-                        lookahead += 1
-
-                        node = grammar.parseToken(token, realToken.content)
-                        self.parseTree.append(node)
-
-                    # If the action table says to reduce
-                    if result[0] == "r":
-                        # Get the corresponding rule from our rules table
-                        rule = self.rules[result[1]][int(result[2])]
-
-                        # Check if the tokens on the stack match a grammar rule
-                        match = True
-                        for i, r in enumerate(rule):
-                            if r != stack[len(stack) - len(rule) + i]:
-                                print(
-                                    "------\n",
-                                    r,
-                                    " != ",
-                                    stack[len(stack) - len(rule) + i],
-                                )
-                                print(result[1], result[2])
-                                match = False
-
-                        # If one of the grammar rules matched...
-                        if match:
-                            # Reduce the tokens on the stack to our new rule token
-                            if result[1] != "ACC":
-                                # Remove the "empty" nodes from our parse tree
-                                c = [
-                                    x
-                                    for x in self.parseTree[-len(rule) :]
-                                    if x is not None
-                                ]
-
-                                tempNode = grammar.parseToken(result[1], children=c)
-
-                                # print(rule)
-                                # print(self.parseTree)
-                                # print(c)
-
-                                if tempNode:
-                                    if rule != ["EMPTY"]:
-                                        del self.parseTree[-len(rule) :]
-                                    self.parseTree.append(tempNode)
-                                    # print(self.parseTree, "\n")
-
-                            del stack[-len(rule) :]
-                            del states[-len(rule) :]
-                            stack.append(result[1])
-                            if debug is True:
-                                logging.debug("Reducing rule %s -> %s", result[1], rule)
-
-                            # Check if there is a goto rule for our current state
-                            topState = states[-1]
-                            topStack = stack[-1]
-                            if topStack in self.goto[topState].keys():
-                                states.append(self.goto[topState][topStack])
-                        else:
-                            messages.add(
-                                CompilerMessage(
-                                    "Tried to reduce a rule with invalid tokens on stack."
-                                )
-                            )
-
-                            return None
-
-                # if actions happens to have EMPTY in the set
-                else:
-                    if "EMPTY" in self.actions[state].keys():
-                        result = self.actions[state]["EMPTY"]
-                        output.append(result)
-                        result = result.split(" ")
-
-                        # If the action table says to shift, shift the next token
-                        if result[0] == "s":
-                            states.append(int(result[1]))
-                            stack.append("EMPTY")
-
-                    else:
-                        messages.add(
-                            CompilerMessage(
-                                f"State {state} does not have Token {token}"
-                            )
-                        )
-                        messages.add(CompilerMessage(self.actions[state]))
-                        messages.add(CompilerMessage(f"Stack: {stack}"))
-                        return None
+        # Every call gets a fresh run, so the tree never carries over
+        run = ParserRun(self.tables(), stats)
+        self.parseTree = run.parse(tokens)
 
-            except KeyError:
-                messages.add(
-                    CompilerMessage(
-                        f"No entry in the action table for [{state}][{token}]"
-                    )
-                )
-                return None
+        return self.parseTree
 
-            # Check if we have reached the accepting state
-            if len(stack) == 1 and stack[0] == "ACC":
-                done = True
+    def tables(self):
+        """
+        Freeze the rules and tables into a shareable ParseTables.
+        They are only frozen again after the grammar or tables change.
+        """
 
-        if debug:
-            logging.debug(output)
+        if self.frozenTables is None:
+            self.frozenTables = ParseTables(
+                self.rules, self.terminals, self.nonTerminals, self.actions, self.goto
+            )
 
-        return self.parseTree
+        return self.frozenTables
 
     def updateSetNum(self):
         """Update the number of item sets that we have generated."""
@@ -683,6 +697,469 @@ class LRParser:
                 node.print(0)
 
 
+class ParserRun:
+    """
+    A single parse of a token list.
+    Runs only hold per-parse state, so they are cheap to create
+    and any number of them can share one set of ParseTables.
+    """
+
+    __slots__ = ("tables", "parseTree", "stats", "context")
+
+    def __init__(self, tables, stats=None, context=None):
+        self.tables = tables
+
+        # Optional ParseStats to record hot-path counters into
+        self.stats = stats
+
+        # The compilation that syntax errors are reported to
+        self.context = context if context is not None else CompilationContext()
+
+        # Parse tree, represented as a node list
+        self.parseTree = []
+
+    def parse(self, tokens):
+        """
+        Parse the program (as a list of tokens)
+        using the shared action and goto tables.
+        """
+
+        terminals = self.tables.terminals
+        actions = self.tables.parseActions
+        goto = self.tables.goto
+        productions = self.tables.productions
+        builders = self.tables.builders
+        shiftBuilders = self.tables.shiftBuilders
+        values = self.parseTree
+
+        # Only pay for debug logging when a log is actually being written
+        trace = debug and logging.getLogger().isEnabledFor(logging.DEBUG)
+
+        # Hot-path counters, only when instrumentation was asked for
+        stats = self.stats
+        if stats is not None:
+            stats.parses += 1
+            stats.tokens += len(tokens)
+            stateVisits = stats.states
+            reductions = stats.productions
+            shifts = stats.shifts
+
+        lookahead = 0
+        states = [0]
+        output = []
+
+        # Where the values of each state on the stack start in the parse tree
+        starts = [0]
+
+        while True:
+            state = states[-1]
+            realToken = tokens[lookahead]
+            if realToken.kind.desc() in terminals:
+                token = realToken.kind.desc()
+            else:
+                token = realToken.content
+
+            if stats is not None:
+                stateVisits[state] = stateVisits.get(state, 0) + 1
+                if len(states) > stats.maxStackDepth:
+                    stats.maxStackDepth = len(states)
+
+            if trace:
+                logging.debug(
+                    "---\nState: %s\nStates: %s\nlookahead Token: %s\
+                        \noutput: %s\nActions: %s\n",
+                    state,
+                    states,
+                    token,
+                    output,
+                    self.tables.actions.get(state),
+                )
+            if printDebug:
+                print(
+                    "---\nState: %s\nStates: %s\nlookahead Token: %s\n"
+                    "output: %s\nparse Tree: %s\n"
+                    % (state, states, token, output, values)
+                )
+
+            try:
+                row = actions[state]
+            except KeyError:
+                self.context.messages.add(
+                    CompilerMessage(
+                        f"No entry in the action table for [{state}][{token}]"
+                    )
+                )
+                return None
+
+            # Shifts are stored as the next state, reductions as ~production
+            action = row.get(token)
+            if action is None:
+                # if actions happens to have EMPTY in the set
+                action = row.get("EMPTY")
+                if action is None:
+                    collector = self.context.messages
+                    collector.add(
+                        CompilerMessage(f"State {state} does not have Token {token}")
+                    )
+                    collector.add(CompilerMessage(self.tables.actions[state]))
+                    collector.add(CompilerMessage(f"States: {states}"))
+                    return None
+
+                # Shift an EMPTY symbol, which consumes nothing
+                if action >= 0:
+                    starts.append(len(values))
+                    states.append(action)
+                    if trace:
+                        output.append(action)
+                continue
+
+            if trace:
+                output.append(action)
+
+            # If the action table says to shift, shift the next token
+            if action >= 0:
+                starts.append(len(values))
+                states.append(action)
+                lookahead += 1
+
+                if stats is not None:
+                    shifts[token] = shifts.get(token, 0) + 1
+
+                # Only terminals like IDs and numbers become parse tree nodes
+                builder = shiftBuilders.get(token)
+                if builder is not None:
+                    values.append(builder(realToken.content))
+                continue
+
+            # Otherwise reduce, replacing the values of the rule with a new node
+            production = ~action
+            lhs, length = productions[production]
+
+            if stats is not None:
+                reductions[production] = reductions.get(production, 0) + 1
+
+            if lhs == "ACC":
+                break
+
+            start = starts[-length]
+            del states[-length:]
+            del starts[-length:]
+
+            # Rules without a node class pass their values through untouched
+            builder = builders[production]
+            if builder is not None:
+                children = values[start:]
+                del values[start:]
+                values.append(builder(children))
+
+            if trace:
+                logging.debug("Reducing rule %s", lhs)
+
+            # Check if there is a goto rule for our current state
+            nextState = goto[states[-1]].get(lhs)
+            if nextState is not None:
+                starts.append(start)
+                states.append(nextState)
+
+        if trace:
+            logging.debug(output)
+
+        return values
+
+    def parseEvents(self, tokens, handler):
+        """
+        Parse an iterable of tokens, reporting each shift and reduction to
+        the handler instead of building parse tree nodes.
+
+        handler.shift(token, content) and handler.reduce(lhs, production, values)
+        return the value kept for the symbol, values holding one per rule symbol.
+        Only the values of the symbols on the stack are kept, so memory grows
+        with nesting depth unless the handler holds on to them itself.
+        Returns the value of the program, or None if parsing fails.
+        """
+
+        terminals = self.tables.terminals
+        actions = self.tables.parseActions
+        goto = self.tables.goto
+        productions = self.tables.productions
+
+        tokens = iter(tokens)
+        realToken = next(tokens)
+        states = [0]
+
+        # The value of every symbol on the stack
+        values = []
+
+        while True:
+            state = states[-1]
+            if realToken.kind.desc() in terminals:
+                token = realToken.kind.desc()
+            else:
+                token = realToken.content
+
+            try:
+                row = actions[state]
+            except KeyError:
+                self.context.messages.add(
+                    CompilerMessage(
+                        f"No entry in the action table for [{state}][{token}]"
+                    )
+                )
+                return None
+
+            action = row.get(token)
+            if action is None:
+                # if actions happens to have EMPTY in the set
+                action = row.get("EMPTY")
+                if action is None:
+                    self.context.messages.add(
+                        CompilerMessage(f"State {state} does not have Token {token}")
+                    )
+                    return None
+
+                # Shift an EMPTY symbol, which consumes nothing
+                if action >= 0:
+                    states.append(action)
+                    values.append(None)
+                continue
+
+            if action >= 0:
+                states.append(action)
+                values.append(handler.shift(token, realToken.content))
+                realToken = next(tokens)
+                continue
+
+            production = ~action
+            lhs, length = productions[production]
+
+            if lhs == "ACC":
+                return values[-1]
+
+            children = values[-length:]
+            del states[-length:]
+            del values[-length:]
+
+            value = handler.reduce(lhs, production, children)
+
+            nextState = goto[states[-1]].get(lhs)
+            if nextState is not None:
+                states.append(nextState)
+                values.append(value)
+
+    def print(self):
+        """Print the parse tree."""
+
+        for node in self.parseTree:
+            if node:
+                node.print(0)
+
+
+class ParseStats:
+    """
+    Hot-path counters collected by instrumented ParserRuns.
+    One instance can accumulate the counts of many parses,
+    but should only be used from one thread at a time.
+    """
+
+    __slots__ = ("parses", "tokens", "states", "productions", "shifts", "maxStackDepth")
+
+    def __init__(self):
+        self.parses = 0
+        self.tokens = 0
+        self.maxStackDepth = 0
+
+        # Visits per state, reductions per production id and shifts per terminal
+        self.states = {}
+        self.productions = {}
+        self.shifts = {}
+
+    def toDict(self, tables):
+        """Return the counters, most frequent first, with productions named."""
+
+        def mostFrequent(counts):
+            return dict(sorted(counts.items(), key=lambda c: (-c[1], str(c[0]))))
+
+        # Production ids only make sense together with the tables
+        names = []
+        for lhs, alternatives in tables.rules.items():
+            for rule in alternatives:
+                names.append(f"{lhs} -> {' '.join(rule)}")
+
+        return {
+            "parses": self.parses,
+            "tokens": self.tokens,
+            "maxStackDepth": self.maxStackDepth,
+            "states": {str(k): v for k, v in mostFrequent(self.states).items()},
+            "productions": {
+                names[k]: v for k, v in mostFrequent(self.productions).items()
+            },
+            "shifts": mostFrequent(self.shifts),
+        }
+
+    def save(self, filename, tables):
+        """Dump the counters as JSON."""
+
+        with open(filename, "w") as outfile:
+            json.dump(self.toDict(tables), outfile, indent=2)
+
+
+class ParseTables:
+    """
+    The grammar rules and action and goto tables of a parser.
+    Instances are immutable once built, so a single set of tables
+    can be shared by many ParserRuns, including from several threads.
+    """
+
+    __slots__ = (
+        "rules",
+        "terminals",
+        "nonTerminals",
+        "actions",
+        "goto",
+        "productions",
+        "builders",
+        "shiftBuilders",
+        "parseActions",
+    )
+
+    def __init__(self, rules, terminals, nonTerminals, actions, goto):
+        freeze = object.__setattr__
+        freeze(
+            self,
+            "rules",
+            MappingProxyType({k: tuple(map(tuple, v)) for k, v in rules.items()}),
+        )
+        freeze(self, "terminals", frozenset(terminals))
+        freeze(self, "nonTerminals", tuple(nonTerminals))
+        freeze(
+            self,
+            "actions",
+            MappingProxyType({k: MappingProxyType(dict(v)) for k, v in actions.items()}),
+        )
+        freeze(
+            self,
+            "goto",
+            MappingProxyType({k: MappingProxyType(dict(v)) for k, v in goto.items()}),
+        )
+
+        # Number every production, and precompute the node class it reduces to.
+        # A builder of None marks a rule that passes its children through.
+        productions = []
+        builders = []
+        productionIds = {}
+        for lhs, alternatives in self.rules.items():
+            for i, rule in enumerate(alternatives):
+                productionIds[(lhs, i)] = len(productions)
+                productions.append((lhs, len(rule)))
+                builders.append(builderFor(lhs, rule))
+        freeze(self, "productions", tuple(productions))
+        freeze(self, "builders", tuple(builders))
+        freeze(
+            self,
+            "shiftBuilders",
+            MappingProxyType(
+                {t: grammar.terminals[t] for t in self.terminals if t in grammar.terminals}
+            ),
+        )
+
+        # Decode the "s 3" and "r rule 1" strings once instead of on every action
+        parseActions = {}
+        for state, row in self.actions.items():
+            parseActions[state] = {}
+            for token, action in row.items():
+                action = action.split(" ")
+                if action[0] == "s":
+                    parseActions[state][token] = int(action[1])
+                else:
+                    parseActions[state][token] = ~productionIds[
+                        (action[1], int(action[2]))
+                    ]
+        freeze(
+            self,
+            "parseActions",
+            MappingProxyType({k: MappingProxyType(v) for k, v in parseActions.items()}),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ParseTables are immutable.")
+
+    def __reduce__(self):
+        # Mapping proxies cannot be pickled, so rebuild from plain dicts
+        return (
+            ParseTables,
+            (
+                dict(self.rules),
+                self.terminals,
+                self.nonTerminals,
+                {k: dict(v) for k, v in self.actions.items()},
+                {k: dict(v) for k, v in self.goto.items()},
+            ),
+        )
+
+
+def builderFor(lhs, rule):
+    """Return the node class a production reduces to, or None to pass through."""
+
+    if lhs == "ACC":
+        return None
+
+    if lhs in grammar.nodes:
+        return grammar.nodes[lhs]
+
+    # The generated rules of X+ build one NodeList per repetition,
+    # and X* passes that list through or builds an empty one
+    if isRepetition(lhs):
+        if rule[0] == lhs:
+            return grammar.NodeList.extend
+        if lhs[-1] == "*" and rule[0] != "EMPTY":
+            return None
+        return grammar.NodeList
+
+    return None
+
+
+# Tables that have already been loaded, keyed by grammar filename
+loadedTables = {}
+loadedTablesLock = threading.Lock()
+
+
+def getParseTables(grammarFile, force=False, context=None):
+    """
+    Return the shared ParseTables for a grammar, loading them only once.
+    Forcing regenerates the tables and replaces the shared copy. Messages
+    about loading them go to the context, if one is given.
+    """
+
+    with loadedTablesLock:
+        if force or grammarFile not in loadedTables:
+            parser = LRParser()
+            parser.loadParseTables(grammarFile, force=force, context=context)
+            loadedTables[grammarFile] = parser.tables()
+
+        return loadedTables[grammarFile]
+
+
+def isRepetition(token):
+    """Check if a grammar token is an X* or X+ repetition."""
+
+    return len(token) > 1 and token[-1] in "*+" and isOperand(token[:-1])
+
+
+def isOption(token):
+    """Check if a grammar token is an [X] option."""
+
+    return len(token) > 2 and token[0] == "[" and token[-1] == "]" and isOperand(
+        token[1:-1]
+    )
+
+
+def isOperand(token):
+    """Check if a token can be repeated or made optional."""
+
+    # Operators like ++ are tokens themselves, only names can be repeated
+    return token.isidentifier() or isRepetition(token) or isOption(token)
+
+
 class Item:
     """
     An item is like a grammar rule.
@@ -0,0 +1,259 @@
+"""
+Parse the bodies of top-level functions in worker processes.
+Function bodies are found by brace matching and parsed from the state the
+parser is in when it reaches the first body. The main process then parses
+the rest of the program, splicing in each body that starts from that same
+state, and parses any other body itself.
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import lexer.tokens as tokens
+from parser.lrParser import ParserRun
+from parser.treeCache import kinds, kindIds, terminalKinds
+
+# The tables of a worker process, set once by its initializer
+workerTables = None
+
+
+def splitFunctions(tokenList):
+    """Return the opening and closing brace indices of every top-level block."""
+
+    blocks = []
+    depth = 0
+    for index, token in enumerate(tokenList):
+        if token.kind is tokens.openCurly:
+            if depth == 0:
+                start = index
+            depth += 1
+        elif token.kind is tokens.closeCurly:
+            depth -= 1
+            if depth == 0:
+                blocks.append((start, index))
+            elif depth < 0:
+                return []
+
+    return blocks if depth == 0 else []
+
+
+def tokenKeys(tables, tokenList):
+    """Return the action table key and content of every token."""
+
+    terminals = tables.terminals
+    keys = []
+    for token in tokenList:
+        desc = token.kind.desc()
+        keys.append((desc if desc in terminals else token.content, token.content))
+
+    return keys
+
+
+def resume(tables, keys, lookahead, states, starts, values, stop=None, bodies=None):
+    """
+    Run the parser over token keys, continuing from the given stacks.
+    Returns True when the program is accepted or just before the token at
+    index stop would be shifted, and None on a syntax error or when a
+    reduction would pop the first state.
+    bodies maps a token index to the stacks of a body parsed from states[-1]
+    and is spliced in when the parser is about to shift that token there.
+    """
+
+    actions = tables.parseActions
+    goto = tables.goto
+    productions = tables.productions
+    builders = tables.builders
+    shiftBuilders = tables.shiftBuilders
+
+    while True:
+        state = states[-1]
+        token, content = keys[lookahead]
+
+        row = actions.get(state)
+        if row is None:
+            return None
+
+        action = row.get(token)
+        if action is None:
+            # if actions happens to have EMPTY in the set
+            action = row.get("EMPTY")
+            if action is None:
+                return None
+
+            # Shift an EMPTY symbol, which consumes nothing
+            if action >= 0:
+                starts.append(len(values))
+                states.append(action)
+            continue
+
+        if action >= 0:
+            if lookahead == stop:
+                return True
+
+            if bodies is not None:
+                body = bodies.get(lookahead)
+                if body is not None and body[0] == state:
+                    # Push the body's stacks as if we had parsed it here
+                    bodyState, bodyStates, bodyStarts, bodyValues, close = body
+                    offset = len(values)
+                    states.extend(bodyStates)
+                    starts.extend(start + offset for start in bodyStarts)
+                    values.extend(bodyValues)
+                    lookahead = close
+                    continue
+
+            starts.append(len(values))
+            states.append(action)
+            lookahead += 1
+
+            builder = shiftBuilders.get(token)
+            if builder is not None:
+                values.append(builder(content))
+            continue
+
+        production = ~action
+        lhs, length = productions[production]
+
+        if lhs == "ACC":
+            return True
+
+        if length >= len(states):
+            return None
+
+        start = starts[-length]
+        del states[-length:]
+        del starts[-length:]
+
+        builder = builders[production]
+        if builder is not None:
+            children = values[start:]
+            del values[start:]
+            values.append(builder(children))
+
+        nextState = goto[states[-1]].get(lhs)
+        if nextState is not None:
+            starts.append(start)
+            states.append(nextState)
+
+
+def parseBody(tables, state, keys):
+    """
+    Parse the tokens of a function body, ending with its closing brace,
+    starting from the given state. Returns the stacks pushed on top of the
+    state, or None if the body does not parse from there.
+    """
+
+    states = [state]
+    starts = [0]
+    values = []
+    if resume(tables, keys, 0, states, starts, values, stop=len(keys) - 1) is None:
+        return None
+
+    return states[1:], starts[1:], values
+
+
+def packNodes(values):
+    """
+    Flatten nodes into a postorder list of kind ids, each followed by the
+    value of a terminal or the child count of any other node. This is much
+    cheaper to send between processes than pickling the nodes.
+    """
+
+    ops = []
+    stack = [(node, False) for node in reversed(values)]
+    while stack:
+        node, visited = stack.pop()
+        kind = type(node)
+        if kind in terminalKinds:
+            ops += (kindIds[kind], node.value)
+        elif visited:
+            ops += (kindIds[kind], len(node.children))
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+
+    return ops
+
+
+def unpackNodes(ops):
+    """Rebuild the nodes flattened by packNodes."""
+
+    values = []
+    pairs = iter(ops)
+    for kind, number in zip(pairs, pairs):
+        cls = kinds[kind]
+        if cls in terminalKinds:
+            # Names arrive as fresh copies, so intern them again
+            values.append(cls(sys.intern(number)))
+        else:
+            children = values[len(values) - number :]
+            del values[len(values) - number :]
+            values.append(cls(children))
+
+    return values
+
+
+def loadWorker(tables):
+    """Keep the parse tables in a worker process."""
+
+    global workerTables
+    workerTables = tables
+
+
+def parseBatch(state, batch):
+    """Parse a batch of function bodies in a worker process."""
+
+    results = []
+    for keys in batch:
+        result = parseBody(workerTables, state, keys)
+        if result is not None:
+            result = (result[0], result[1], packNodes(result[2]))
+        results.append(result)
+
+    return results
+
+
+def parseParallel(tables, tokenList, jobs=None, minFunctions=8, context=None):
+    """
+    Parse the tokens like ParserRun.parse, parsing the function bodies in
+    up to jobs worker processes. Small programs and programs that cannot be
+    split are parsed serially, as is any program with a syntax error so it
+    is reported as usual, to the messages of the context.
+    """
+
+    jobs = jobs or os.cpu_count() or 1
+    blocks = splitFunctions(tokenList)
+    if jobs < 2 or len(blocks) < minFunctions:
+        return ParserRun(tables, context=context).parse(tokenList)
+
+    keys = tokenKeys(tables, tokenList)
+    states = [0]
+    starts = [0]
+    values = []
+
+    # Guess that every body starts from the state of the first one
+    first = blocks[0][0] + 1
+    if resume(tables, keys, 0, states, starts, values, stop=first) is None:
+        return ParserRun(tables, context=context).parse(tokenList)
+    state = states[-1]
+
+    bodies = [keys[start + 1 : end + 1] for start, end in blocks]
+    size = max(1, len(bodies) // (jobs * 4))
+    batches = [bodies[i : i + size] for i in range(0, len(bodies), size)]
+
+    with ProcessPoolExecutor(jobs, initializer=loadWorker, initargs=(tables,)) as pool:
+        results = []
+        for batch in pool.map(parseBatch, [state] * len(batches), batches):
+            results.extend(batch)
+
+    spliced = {}
+    for (start, end), result in zip(blocks, results):
+        if result is not None:
+            bodyStates, bodyStarts, ops = result
+            spliced[start + 1] = (state, bodyStates, bodyStarts, unpackNodes(ops), end)
+
+    # Bodies that failed in a worker are parsed here instead
+    if resume(tables, keys, first, states, starts, values, bodies=spliced) is None:
+        return ParserRun(tables, context=context).parse(tokenList)
+
+    return values
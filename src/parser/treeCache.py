@@ -0,0 +1,196 @@
+"""
+On-disk cache of flattened parse trees.
+A tree is stored as a preorder list of node kind ids plus a table of the
+terminal value strings, keyed by the hash of the source and the grammar.
+The cache is kept under the user's cache directory, and the least recently
+used trees are deleted once it grows past cacheLimit.
+"""
+
+import hashlib
+import os
+import sys
+import parser.grammar as grammar
+from util import userCacheDirectory, CacheSize
+
+cacheDirectory = userCacheDirectory("trees")
+
+# The least recently used trees are deleted once the cache is bigger than this
+cacheLimit = 64 * 1024 * 1024
+cacheSize = CacheSize(".tree")
+
+# Bump this whenever the binary layout below changes
+version = 1
+magic = b"CTRE"
+
+# Every node class we know how to rebuild, indexed by its kind id
+kinds = sorted(
+    set(grammar.nodes.values()) | set(grammar.terminals.values()) | {grammar.NodeList},
+    key=lambda cls: cls.__name__,
+)
+kindIds = {cls: i for i, cls in enumerate(kinds)}
+terminalKinds = set(grammar.terminals.values())
+
+# Changing the node classes invalidates every cached tree
+kindsHash = hashlib.sha256(
+    " ".join(cls.__name__ for cls in kinds).encode()
+).digest()[:8]
+
+
+def hashText(text):
+    """Return a short hex digest of the text."""
+
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+
+def cachePath(sourceHash, grammarHash):
+    """Return the cache filename for a source and grammar hash."""
+
+    return os.path.join(cacheDirectory, f"{sourceHash}-{grammarHash}.tree")
+
+
+def writeVarint(out, number):
+    """Append an unsigned LEB128 varint to the bytearray."""
+
+    while number >= 0x80:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def readVarint(data, pos):
+    """Read an unsigned LEB128 varint, returning the number and new position."""
+
+    number = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, pos
+        shift += 7
+
+
+def encodeTree(root):
+    """Encode a parse tree into the compact binary cache format."""
+
+    strings = []
+    stringIds = {}
+    body = bytearray()
+    count = 0
+
+    # Walk the tree in preorder with an explicit stack
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        writeVarint(body, kindIds[type(node)])
+
+        if type(node) in terminalKinds:
+            value = str(node.value)
+            if value not in stringIds:
+                stringIds[value] = len(strings)
+                strings.append(value)
+            writeVarint(body, stringIds[value])
+        else:
+            writeVarint(body, len(node.children))
+            stack.extend(reversed(node.children))
+
+    out = bytearray(magic)
+    out.append(version)
+    out += kindsHash
+    writeVarint(out, len(strings))
+    for value in strings:
+        raw = value.encode()
+        writeVarint(out, len(raw))
+        out += raw
+    writeVarint(out, count)
+    out += body
+
+    return bytes(out)
+
+
+def decodeTree(data):
+    """Rebuild a parse tree from the compact binary cache format."""
+
+    if data[:4] != magic or data[4] != version or data[5:13] != kindsHash:
+        return None
+
+    pos = 13
+    numStrings, pos = readVarint(data, pos)
+    strings = []
+    for _ in range(numStrings):
+        length, pos = readVarint(data, pos)
+        # Interned like the names of freshly lexed tokens
+        strings.append(sys.intern(data[pos : pos + length].decode()))
+        pos += length
+
+    count, pos = readVarint(data, pos)
+
+    # Each entry is [class, children still expected, children so far]
+    pending = []
+    root = None
+    for _ in range(count):
+        kind, pos = readVarint(data, pos)
+        cls = kinds[kind]
+
+        if cls in terminalKinds:
+            index, pos = readVarint(data, pos)
+            node = cls(strings[index])
+        else:
+            numChildren, pos = readVarint(data, pos)
+            if numChildren:
+                pending.append([cls, numChildren, []])
+                continue
+            node = cls([])
+
+        # Attach the finished node, completing any parents it fills up
+        while pending:
+            parent = pending[-1]
+            parent[2].append(node)
+            if len(parent[2]) < parent[1]:
+                break
+            pending.pop()
+            node = parent[0](parent[2])
+        else:
+            root = node
+
+    return root
+
+
+def lookup(sourceHash, grammarHash):
+    """
+    Return the decoded tree cached for the hashes, or None if there is none
+    or its file is unusable, in which case the next store replaces it.
+    """
+
+    path = cachePath(sourceHash, grammarHash)
+    try:
+        with open(path, "rb") as file:
+            tree = decodeTree(file.read())
+    except (IOError, IndexError, UnicodeDecodeError):
+        return None
+
+    # Mark the tree as recently used, so pruning keeps it
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    return tree
+
+
+def store(sourceHash, grammarHash, root):
+    """Save an encoded parse tree under the source and grammar hashes."""
+
+    os.makedirs(cacheDirectory, exist_ok=True)
+
+    # Write to a temporary file first so readers never see a partial tree
+    path = cachePath(sourceHash, grammarHash)
+    tempPath = f"{path}.{os.getpid()}"
+    data = encodeTree(root)
+    with open(tempPath, "wb") as file:
+        file.write(data)
+    os.replace(tempPath, path)
+
+    cacheSize.add(cacheDirectory, len(data), cacheLimit)
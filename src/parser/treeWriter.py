@@ -0,0 +1,142 @@
+"""
+Buffered, iterative writers for dumping parse trees.
+Supports the indented text format of Node.print,
+compact S-expressions, and one JSON object per line.
+"""
+
+import json
+import sys
+
+formats = ["text", "sexpr", "jsonl"]
+
+# Flush the buffer to the output once it holds this many characters
+bufferSize = 1 << 16
+
+
+class BufferedOutput:
+    """Collect output strings and write them in large chunks."""
+
+    def __init__(self, out):
+        self.out = out
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        """Buffer some text, flushing when the buffer is full."""
+
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= bufferSize:
+            self.flush()
+
+    def flush(self):
+        """Write everything buffered so far."""
+
+        if self.parts:
+            self.out.write("".join(self.parts))
+            self.parts = []
+            self.size = 0
+        self.out.flush()
+
+
+def isTerminal(node):
+    """Terminal nodes hold a value instead of children."""
+
+    return not hasattr(node, "children")
+
+
+def getChildren(node):
+    """Return the children of a node the same way Node.print walks them."""
+
+    if isinstance(node.children, list):
+        return node.children
+    return node.children[0]
+
+
+def writeText(root, out, maxDepth, level):
+    """Write the tree as indented text, matching Node.print."""
+
+    stack = [(root, level)]
+    while stack:
+        node, depth = stack.pop()
+        prefix = "   " * depth + "| -  "
+
+        if isTerminal(node):
+            out.write(f"{prefix}{node.__class__.__name__}: {node.value}\n")
+            continue
+
+        out.write(f"{prefix}{node.__class__.__name__}\n")
+        if maxDepth is None or depth - level < maxDepth:
+            stack.extend((child, depth + 1) for child in reversed(getChildren(node)))
+
+
+def writeSexpr(root, out, maxDepth):
+    """Write the tree as a single S-expression."""
+
+    # Strings on the stack are written out as they are popped
+    stack = [(root, 0)]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, str):
+            out.write(entry)
+            continue
+
+        node, depth = entry
+        if isTerminal(node):
+            out.write(f"({node.__class__.__name__} {json.dumps(str(node.value))})")
+            continue
+
+        out.write(f"({node.__class__.__name__}")
+        stack.append(")")
+
+        children = getChildren(node)
+        if maxDepth is not None and depth >= maxDepth:
+            if children:
+                out.write(" ...")
+            continue
+
+        for child in reversed(children):
+            stack.append((child, depth + 1))
+            stack.append(" ")
+
+    out.write("\n")
+
+
+def writeJsonLines(root, out, maxDepth):
+    """Write one JSON object per node in preorder."""
+
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        entry = {"depth": depth, "node": node.__class__.__name__}
+
+        if isTerminal(node):
+            entry["value"] = str(node.value)
+        else:
+            children = getChildren(node)
+            entry["children"] = len(children)
+            if maxDepth is None or depth < maxDepth:
+                stack.extend((child, depth + 1) for child in reversed(children))
+
+        out.write(json.dumps(entry, separators=(",", ":")))
+        out.write("\n")
+
+
+def writeTree(root, fmt="text", maxDepth=None, level=0, out=None):
+    """
+    Write a parse tree in the given format.
+    Nodes more than maxDepth levels below the root are left out.
+    """
+
+    output = BufferedOutput(out if out is not None else sys.stdout)
+
+    if fmt == "text":
+        writeText(root, output, maxDepth, level)
+    elif fmt == "sexpr":
+        writeSexpr(root, output, maxDepth)
+    elif fmt == "jsonl":
+        writeJsonLines(root, output, maxDepth)
+    else:
+        raise ValueError(f"Unknown tree format '{fmt}'.")
+
+    output.flush()
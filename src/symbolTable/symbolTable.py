@@ -3,100 +3,170 @@ Contains the Symbol Table class.
 """
 
 import parser.grammar as grammar
-from util import CompilerMessage
+from util import CompilerMessage, Dispatch, CompilationContext
+
+
+class Scope:
+    """
+    A scope of the program: its variables, labels and child scopes.
+    Scopes only point down to their children, so a symbol table holds no
+    reference cycles for the garbage collector to find.
+    """
+
+    __slots__ = ("name", "variables", "labels", "children")
+
+    def __init__(self, name):
+        self.name = name
+        self.variables = {}
+        self.labels = {}
+        self.children = {}
+
+    def describe(self, nested=False):
+        """Describe the scope like the nested dicts the symbol table used to be."""
+
+        parts = [f"'name': {self.name!r}"]
+        if nested:
+            parts.append("'..': {...}")
+        parts.append(f"'variables': {self.variables!r}")
+        parts.append(f"'labels': {self.labels!r}")
+        for name, child in self.children.items():
+            parts.append(f"{name!r}: {child.describe(True)}")
+
+        return "{" + ", ".join(parts) + "}"
+
+    def __repr__(self):
+        return self.describe()
+
+
+class Symbol:
+    """A declared name, with the node that declared it and every use of it."""
+
+    __slots__ = ("name", "scope", "declaration", "uses")
+
+    def __init__(self, name, scope, declaration=None):
+        self.name = name
+        self.scope = scope
+        self.declaration = declaration
+        self.uses = []
+
+    def __repr__(self):
+        return f"Symbol({self.scope}.{self.name}, {len(self.uses)} uses)"
 
 
 class SymbolTable:
     """Symbol Table that represents all variables and their scopes in the program."""
 
-    def __init__(self):
-        self.table = {}
-        self.table["name"] = "global"
-        self.table["variables"] = {}
-        self.table["labels"] = {}
+    def __init__(self, context=None):
+        self.table = Scope("global")
         self.current = self.table
         self.level = 0
 
-    def startScope(self, name, level):
-        """Initialize a new scope."""
+        # The open scopes, from the global scope to the current one
+        self.scopes = [self.table]
 
-        if name in self.current:
-            raise CompilerMessage(f"Scope with name {name} already exists.")
+        # The scope and symbol of each binding of a name, innermost last,
+        # so find is one lookup
+        self.bindings = {}
 
-        # Add the new scope dict
-        self.current[name] = {}
-        self.current[name]["name"] = name
+        # Every symbol by its scope and name, the def-use index of the program
+        self.symbols = {}
 
-        # Initialize the dict with a .. and variables entry
-        self.current[name][".."] = self.current
-        self.current[name]["variables"] = {}
-        self.current[name]["labels"] = {}
+        # The compilation the table belongs to, which numbers its temporaries
+        self.context = context if context is not None else CompilationContext()
 
-        # Update the current pointer
-        self.current = self.current[name]
+    def bind(self, name, declaration=None):
+        """Bind a name in the current scope, returning its new symbol."""
+
+        scope = self.current.name
+        symbol = Symbol(name, scope, declaration)
+        self.symbols[(scope, name)] = symbol
+        self.bindings.setdefault(name, []).append((scope, symbol))
+
+        return symbol
+
+    def startScope(self, name, level, node=None):
+        """Initialize a new scope."""
+
+        if name in self.current.children:
+            raise CompilerMessage(f"Scope with name {name} already exists.")
+
+        # The scope is visible from its parent, and its own name from inside it
+        symbol = self.bind(name, node)
+        scope = Scope(name)
+        self.current.children[name] = scope
+        self.scopes.append(scope)
+        self.current = scope
+        self.bindings[name].append((name, symbol))
 
         # Set the current level of scope
         self.level = level
 
-    def declareVariable(self, t, name):
+    def declareVariable(self, t, name, node=None):
         """Declare a new variable in the current scope."""
 
-        if name in self.current["variables"]:
+        if name in self.current.variables:
             raise CompilerMessage(f"Variable with name '{name}' already exists.")
 
         # Add the variable to the current scope
-        self.current["variables"][name] = t
+        self.current.variables[name] = t
+        self.bind(name, node)
 
     def useLabel(self, name):
         """Add a new label to the label list as unverified."""
 
-        if name not in self.current["labels"]:
-            self.current["labels"][name] = False
+        if name not in self.current.labels:
+            self.current.labels[name] = False
+            self.bind(name)
 
-    def declareLabel(self, name):
+    def declareLabel(self, name, node=None):
         """Add a new label to the label list as verified."""
 
-        if name in self.current["labels"] and self.current["labels"][name] is True:
+        labels = self.current.labels
+        if labels.get(name) is True:
             raise CompilerMessage(f"Label with name '{name}' already exists.")
 
-        self.current["labels"][name] = True
+        if name not in labels:
+            self.bind(name, node)
+        else:
+            self.symbols[(self.current.name, name)].declaration = node
+        labels[name] = True
 
     def endScope(self):
         """Finalize a scope and return it's parent scope."""
 
-        # Go back up one scope
-        if ".." in self.current:
-            self.current = self.current[".."]
+        # The global scope is never closed
+        if len(self.scopes) == 1:
+            return
 
-    def find(self, name):
-        """Find the specified variable in the Symbol Table, starting from the current scope."""
+        # Unbind everything the scope bound, in any order since it is innermost
+        scope = self.scopes.pop()
+        bindings = self.bindings
+        for names in (scope.variables, scope.labels, scope.children, (scope.name,)):
+            for name in names:
+                stack = bindings[name]
+                stack.pop()
+                if not stack:
+                    del bindings[name]
 
-        c = self.current
+        self.current = self.scopes[-1]
 
-        # Search the global table first
-        if c == self.table:
-            if name in c["variables"] or name in c or name in c["labels"]:
-                return self.table["name"]
-
-            return None
+    def find(self, name):
+        """Find the scope the specified name is visible from, starting from the current scope."""
 
-        # Search up the tree from our current scope
-        # as long as there is a parent
-        while ".." in c:
-            if name in c["variables"] or c["name"] == name or name in c["labels"]:
-                return c["name"]
+        stack = self.bindings.get(name)
+        if stack:
+            return stack[-1][0]
 
-            # Loop will break without checking global scope
-            # So check if the parent is global scope before exiting
-            if c[".."] == self.table:
-                if name in self.table["variables"] or name in self.table:
-                    return self.table["name"]
+        # Not found in any scope
+        return None
 
-                return None
+    def resolve(self, name):
+        """Return the symbol a name refers to in the current scope, or None."""
 
-            c = c[".."]
+        stack = self.bindings.get(name)
+        if stack:
+            return stack[-1][1]
 
-        # Not found in any scope, return False
         return None
 
     def print(self, node=None, level=0):
@@ -106,14 +176,13 @@ class SymbolTable:
             node = self.table
 
         grammar.printPrefix(level)
-        print(f"{node['name']}: {node['variables']}, {node['labels']}")
+        print(f"{node.name}: {node.variables}, {node.labels}")
 
-        for key in node:
-            if key not in ["name", "variables", "..", "labels"]:
-                self.print(node[key], level + 1)
+        for child in node.children.values():
+            self.print(child, level + 1)
 
     def __str__(self):
-        return str(self.table)
+        return self.table.describe()
 
     def verifyLabels(self, c=None):
         """Check for used but undeclared labels."""
@@ -121,133 +190,191 @@ class SymbolTable:
         if c is None:
             c = self.table
 
-        if c["labels"] is not False:
-            for l in c["labels"]:
-                if c["labels"][l] is False:
-                    raise CompilerMessage(f"The label {l} was used but never declared.")
+        for l in c.labels:
+            if c.labels[l] is False:
+                raise CompilerMessage(f"The label {l} was used but never declared.")
 
-        for key in c:
-            if key not in ["name", "variables", "..", "labels"]:
-                self.verifyLabels(c[key])
+        for child in c.children.values():
+            self.verifyLabels(child)
 
 
-def flattenTree(root, reducer, seen=False):
+def flattenTree(root, reducers):
     """
     Collapse recursive rules to have a single parent.
-    The grammar rule to collapse should be specified in reducer.
-    i.e. DeclarationList or StatementList.
+    The grammar rules to collapse should be specified in reducers.
+    i.e. (DeclarationList, StatementList).
+    Returns the root, which is flattened in place.
     """
 
     # TODO: fix collapsing nested recursive rules
 
-    if isinstance(root, reducer):
-        if not seen:
-            seen = True
+    # Every kind of list is collapsed in the same walk. Each entry also
+    # holds the kinds of list whose items it is in, which are not collapsed.
+    stack = [(root, ())]
+    while stack:
+        node, skipped = stack.pop()
+        kind = type(node)
+
+        if kind in reducers and kind not in skipped:
+            skipped += (kind,)
+
+            # A list that was flattened by an earlier compile that shared
+            # this node, or has a single item, is left as it is
+            if not getattr(node, "flattened", False) and len(node.children) > 1:
+                # Collect the items down the left recursive chain, last item first
+                items = [node.children[1]]
+                chain = node.children[0]
+                while type(chain) is kind:
+                    if getattr(chain, "flattened", False):
+                        items.extend(reversed(chain.children))
+                        break
+
+                    if len(chain.children) == 1:
+                        # This is a DecList that only has a Dec child
+                        items.append(chain.children[0])
+                        break
+
+                    items.append(chain.children[1])
+                    chain = chain.children[0]
+                else:
+                    items.append(chain)
+
+                items.reverse()
+                node.children = items
+                node.flattened = True
+
+            stack.extend([(child, skipped) for child in reversed(node.children)])
+        elif kind is list:
+            stack.extend([(child, skipped) for child in reversed(node)])
+        elif hasattr(node, "children"):
+            children = node.children
+            if children and type(children[0]) is list:
+                node.children = children = children[0]
+
+            stack.extend([(child, skipped) for child in reversed(children)])
 
-            if len(root.children) <= 1:
-                return root
+    return root
 
-            c = flattenTree(root.children[0], reducer, seen)
 
-            root.children = [root.children[1]]
+def buildSymbolTable(parseTree, prepare=False, context=None):
+    """
+    Given the parse tree, build a symbol table.
+    With prepare, the node values are also computed in the same walk,
+    so the IR can be generated without a walk of its own for them.
+    """
 
-            if isinstance(c, list):
-                for i in c:
-                    root.children.append(i)
-            else:
-                root.children.append(c)
+    # Build the symbol table
+    st = SymbolTable(context)
+    visitChildren(parseTree, st, prepare=prepare)
 
-            root.children.reverse()
+    # Verify all labels are valid
+    st.verifyLabels()
 
-            return root
+    return st
 
-        if len(root.children) == 1:
-            # This is a DecList that only has a Dec child, no recurse
-            return root.children[0]
 
-        # Save the sibling
-        dec = root.children[1]
+def visitChildren(node, st, level=0, prepare=False):
+    """Visit each node of the parse tree."""
 
-        # Recurse on the DecList
-        children = flattenTree(root.children[0], reducer, seen)
+    # A level of None marks a node whose children have all been visited
+    context = st.context
+    stack = [(node, level)]
+    push = stack.append
+    while stack:
+        node, level = stack.pop()
+        if level is None:
+            # The same postorder as Node.visit, so temporaries are numbered alike
+            node.prepare(context)
+            continue
+
+        # Update the symbol table for every visited node
+        handler = symbolHandlers[type(node)]
+        if handler is not None:
+            handler(node, st, level)
+
+        if type(node) is list:
+            children = node
+        else:
+            children = getattr(node, "children", None)
+            if not children:
+                if prepare:
+                    node.prepare(context)
+                continue
+            if prepare:
+                push((node, None))
 
-        c = [dec]
+        level += 1
+        for child in reversed(children):
+            push((child, level))
 
-        if isinstance(children, list):
-            for i in children:
-                c.append(i)
-        else:
-            c.append(children)
 
-        return c
+# The symbol table update of each kind of node
+symbolHandlers = Dispatch()
 
-    # Current node is not a DecList,
-    # we just want to descend the parse tree
-    if isinstance(root, list):
-        for item in root:
-            flattenTree(item, reducer, seen)
+# The child of each kind of declaration that is the name it declares
+nameIndexes = {
+    grammar.FunctionDeclaration: 1,
+    grammar.Argument: 1,
+    grammar.VariableDeclaration: 1,
+    grammar.LabelDeclaration: 0,
+}
 
-    # Current node is not a DecList,
-    # but we will need to update its children reference
-    if hasattr(root, "children"):
-        children = []
-        for item in root.children:
-            children.append(flattenTree(item, reducer, seen))
+# Every handler takes the same arguments, whether it needs them or not
+# pylint: disable=unused-argument
 
-        if isinstance(children, list) and len(children) >= 1:
-            if isinstance(children[0], list):
-                children = children[0]
 
-        root.children = children
-        return root
+@symbolHandlers.register(grammar.FunctionDeclaration)
+def startFunction(node, st, level):
+    """Close the previous function's scope and open a new one."""
 
-    # Not a reducer node, not a list, not a "complex" node
-    # Just return it to be appended as a child
-    return root
+    if st.level == level:
+        st.endScope()
+    st.startScope(node.name, level, node)
 
 
-def buildSymbolTable(parseTree):
-    """Given the parse tree, build a symbol table."""
+@symbolHandlers.register(grammar.VariableDeclaration, grammar.Argument)
+def declareVariable(node, st, level):
+    """Declare a variable or argument in the current scope."""
 
-    # Build the symbol table
-    st = SymbolTable()
-    visitChildren(parseTree, st)
+    st.declareVariable(node.type, node.name, node)
 
-    # Verify all labels are valid
-    st.verifyLabels()
 
-    return st
+@symbolHandlers.register(grammar.GotoStatement)
+def useLabel(node, st, level):
+    """Record a label that a goto jumps to."""
 
+    st.useLabel(node.children[0].value)
 
-def visitChildren(node, st, level=0):
-    """Visit each node of the parse tree."""
 
-    # Update the symbol table for every visited node
-    updateSymbolTable(node, st, level)
+@symbolHandlers.register(grammar.LabelDeclaration)
+def declareLabel(node, st, level):
+    """Declare a label in the current scope."""
+
+    st.declareLabel(node.children[0].value, node)
+
+
+@symbolHandlers.register(grammar.Identifier)
+def checkIdentifier(node, st, level):
+    """Check that an identifier was declared and record it as a use."""
+
+    symbol = st.resolve(node.value)
+    if symbol is None:
+        raise CompilerMessage(f"Identifier {node.value} is undefined.")
+
+    # The name in a declaration is not a use of it
+    declaration = symbol.declaration
+    if declaration is None:
+        symbol.uses.append(node)
+    elif node is not declaration.children[nameIndexes[type(declaration)]]:
+        symbol.uses.append(node)
+
 
-    if hasattr(node, "children"):
-        for child in node.children:
-            visitChildren(child, st, level + 1)
-    elif isinstance(node, list):
-        for child in node:
-            visitChildren(child, st, level + 1)
+# pylint: enable=unused-argument
 
 
 def updateSymbolTable(node, st, level=0):
     """Check if symbol table should be updated based on node."""
 
-    if isinstance(node, grammar.FunctionDeclaration):
-        if st.level == level:
-            st.endScope()
-        st.startScope(node.name, level)
-    elif isinstance(node, grammar.VariableDeclaration):
-        st.declareVariable(node.type, node.name)
-    elif isinstance(node, grammar.Argument):
-        st.declareVariable(node.type, node.name)
-    elif isinstance(node, grammar.GotoStatement):
-        st.useLabel(node.children[0].value)
-    elif isinstance(node, grammar.LabelDeclaration):
-        st.declareLabel(node.children[0].value)
-    elif isinstance(node, grammar.Identifier):
-        if st.find(node.value) is None:
-            raise CompilerMessage(f"Identifier {node.value} is undefined.")
+    handler = symbolHandlers[type(node)]
+    if handler is not None:
+        handler(node, st, level)
@@ -6,7 +6,7 @@ import os
 
 
 class Unique:
-    """Class to contain unique values."""
+    """Counters that generate the unique names of a compilation."""
 
     def __init__(self):
         self.count = {"none": 0}
@@ -32,7 +32,38 @@ class Unique:
         return f"r{self.count['none']}"
 
 
-unique = Unique()
+class Dispatch(dict):
+    """
+    Handlers looked up by the class of a node.
+    A class without a handler of its own uses the one of its nearest
+    registered base class, as a chain of isinstance checks would, and the
+    answer is remembered so later lookups are a single dict access.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.registered = {}
+
+    def register(self, *classes):
+        """Decorator to register a handler for the given classes."""
+
+        def decorator(handler):
+            for cls in classes:
+                self.registered[cls] = handler
+            self.clear()
+            return handler
+
+        return decorator
+
+    def __missing__(self, cls):
+        handler = None
+        for base in cls.__mro__:
+            if base in self.registered:
+                handler = self.registered[base]
+                break
+
+        self[cls] = handler
+        return handler
 
 
 def readFile(filename):
@@ -46,37 +77,50 @@ def readFile(filename):
         raise CompilerMessage(f"Cannot read file: {filename}.")
 
 
-def writeFile(filename, content=None):
-    """Write a file with specified content."""
+def writeFile(filename, content=None, context=None):
+    """
+    Write a file with specified content, reporting to the messages of the
+    compilation's context, or of the process without one.
+    """
 
     if not content:
         raise CompilerMessage(f"No content specified to write to file '{filename}'.")
 
-    try:
-        with open(filename, "x") as file:
+    file = openOutput(filename, context=context)
+    if file is not None:
+        with file:
             file.write(str(content))
-            messages.add(CompilerMessage(f"Wrote to file: '{filename}'.", "success"))
+            collector = context.messages if context is not None else messages
+            collector.add(CompilerMessage(f"Wrote to file: '{filename}'.", "success"))
+
+
+def openOutput(filename, mode="w", context=None):
+    """
+    Open a new file to write, asking before overwriting one that exists.
+    Returns None if the user chose not to overwrite it.
+    """
+
+    collector = context.messages if context is not None else messages
+    try:
+        return open(filename, mode.replace("w", "x"))
     except FileExistsError:
-        messages.add(
+        collector.add(
             CompilerMessage(f"The file '{filename}' already exists.", "warning")
         )
         choice = input("Overwrite it? [y/n]: ")
         if choice in ["y", "Y"]:
             try:
-                with open(filename, "w") as file:
-                    file.write(str(content))
-                    messages.add(
-                        CompilerMessage(f"Wrote to file: '{filename}'.", "success")
-                    )
+                return open(filename, mode)
             except IOError:
                 raise CompilerMessage(f"Error overwriting file: '{filename}'.")
-        else:
-            messages.add(
-                CompilerMessage(f"Did not overwrite the file '{filename}'.", "warning")
-            )
 
+        collector.add(
+            CompilerMessage(f"Did not overwrite the file '{filename}'.", "warning")
+        )
+        return None
 
-def ensureDirectory(path):
+
+def ensureDirectory(path, context=None):
     """Ensure that a path exists as a directory."""
 
     # Check if the path is a file instead of directory
@@ -88,12 +132,89 @@ def ensureDirectory(path):
 
     # Ensure the directory exists.
     if not os.path.exists(f"{path}/"):
-        messages.add(
+        collector = context.messages if context is not None else messages
+        collector.add(
             CompilerMessage(f"No '{path}' directory found, creating one.", "warning")
         )
         os.makedirs(path)
 
 
+def userCacheDirectory(name):
+    """
+    Return the directory of one of the compiler's caches. It is under the
+    user's cache directory, so compiles from any working directory share it
+    and nothing is written next to the sources. The caches create their
+    directories silently, unlike the output directories the user names.
+    """
+
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(root, "c_compiler", name)
+
+
+def pruneCache(path, suffix, limit):
+    """
+    Delete the least recently used files ending in suffix from a cache
+    directory until the rest fit in limit bytes. Entries are touched when
+    they are used, so their modification time is when they were last used.
+    Returns the size of the files that are left.
+    """
+
+    try:
+        entries = []
+        total = 0
+        for entry in os.scandir(path):
+            if entry.name.endswith(suffix):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    except OSError:
+        return 0
+
+    entries.sort()
+    for _, size, entryPath in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(entryPath)
+        except OSError:
+            # Another compile may have pruned it first
+            pass
+        total -= size
+
+    return total
+
+
+class CacheSize:
+    """
+    A running estimate of the size of a cache directory, so the directory is
+    only scanned the first time it is written to and whenever the estimate
+    goes over the limit, instead of after every write. Pruning goes down to
+    three quarters of the limit, so the scans after it are spread out.
+    """
+
+    def __init__(self, suffix):
+        self.suffix = suffix
+        self.path = None
+        self.size = None
+
+    def add(self, path, size, limit):
+        """Count a file just written to the cache, pruning it if it is too big."""
+
+        # The directory can be changed between writes, as the tests do
+        if path != self.path:
+            self.path = path
+            self.size = None
+
+        if self.size is None:
+            self.size = pruneCache(path, self.suffix, limit)
+        else:
+            self.size += size
+            if self.size > limit:
+                self.size = pruneCache(path, self.suffix, limit * 3 // 4)
+
+
 class MessageCollector:
     """A collector class that hold compiler messages."""
 
@@ -138,4 +259,18 @@ class CompilerMessage(Exception):
         return f"{bold}{error}✖ Error:{reset} {self.message}"
 
 
+# The messages of the process itself, like directories it had to create
 messages = MessageCollector()
+
+
+class CompilationContext:
+    """
+    The state of a single compilation, passed from phase to phase: the
+    counters that number its temporaries and labels, and the collector its
+    messages go to. Compilations with their own contexts are independent,
+    so they number from the start every time and can run side by side.
+    """
+
+    def __init__(self, collector=None):
+        self.unique = Unique()
+        self.messages = collector if collector is not None else MessageCollector()
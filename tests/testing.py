@@ -1,12 +1,66 @@
-# pylint: disable=line-too-long
+# pylint: disable=line-too-long,global-statement
 
 """
 Each test case has an accompanying class.
 Each have methods such as: test_lexer, test_parser & test_symbolTable
 """
 
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
 import unittest
-from src.main import Compiler
+from concurrent.futures import ThreadPoolExecutor
+from src.main import Compiler, checkFiles
+import parser.treeCache as treeCache
+import ir.functionCache as functionCache
+from parser.lrParser import LRParser, ParserRun, ParseStats, getParseTables
+from parser.incremental import IncrementalParser
+from parser.lowering import lowerTree, countNodes, wrappers
+from parser.events import TreeBuilder
+from parser.parallel import parseParallel, splitFunctions
+from benchmarks.generate import generateProgram
+from benchmarks.tables import generateGrammar
+from ir.ir import IR, readIr
+import ir.binaryIr as binaryIr
+import code_generation.intermediate_code as intermediateCode
+from ir.instructions import Instr, Opcode, Temp, operandKind
+from ir.cfg import buildGraphs
+from symbolTable.symbolTable import SymbolTable
+from util import Dispatch, CompilationContext
+from parser.treeWriter import writeTree
+import parser.grammar as grammar
+import lexer.lexer as lexer
+import util
+from util import readFile
+
+
+def setUpModule():
+    """Keep what the tests cache out of the user's cache directory."""
+
+    global cacheDirectory, savedDirectories
+    cacheDirectory = tempfile.TemporaryDirectory()
+    savedDirectories = (treeCache.cacheDirectory, functionCache.cacheDirectory)
+    treeCache.cacheDirectory = os.path.join(cacheDirectory.name, "trees")
+    functionCache.cacheDirectory = os.path.join(cacheDirectory.name, "functions")
+
+
+def tearDownModule():
+    """Restore the cache directories and remove what the tests cached."""
+
+    treeCache.cacheDirectory, functionCache.cacheDirectory = savedDirectories
+    cacheDirectory.cleanup()
+
+
+def printTree(root):
+    """Capture the pretty printed parse tree as a string."""
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        root.print(0)
+    return out.getvalue()
 
 
 class ArgumentsTestCase(unittest.TestCase):
@@ -1144,5 +1198,1101 @@ class WhileTestCase(unittest.TestCase):
         self.assertEqual(str(self.compiler.symbolTable), result)
 
 
+# Lexer
+
+
+class InternTestCase(unittest.TestCase):
+    """Test case for sharing one string per name."""
+
+    def test_sharedNames(self):
+        """Test that every use of a name is the same string object."""
+
+        compiler = Compiler({"filename": "samples/arguments.c"})
+        compiler.tokenize()
+        compiler.parse()
+        compiler.buildSymbolTable()
+
+        names = [token.content for token in compiler.tokens if token.content == "sum"]
+        self.assertEqual(len(names), 6)
+        self.assertTrue(all(name is names[0] for name in names))
+
+        # The names of a cached tree are the lexer's names too
+        stack = [treeCache.decodeTree(treeCache.encodeTree(compiler.parseTree))]
+        cached = []
+        while stack:
+            node = stack.pop()
+            stack.extend(getattr(node, "children", []))
+            if getattr(node, "value", None) == "sum":
+                cached.append(node.value)
+        self.assertTrue(cached)
+        self.assertTrue(all(name is names[0] for name in cached))
+
+        scope = compiler.symbolTable.table.children[names[0]]
+        self.assertTrue(all(name is lexer.intern(name) for name in scope.variables))
+
+
+# Parser
+
+
+class TreeCacheTestCase(unittest.TestCase):
+    """Test case for the on-disk parse tree cache."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.savedDirectory = treeCache.cacheDirectory
+        treeCache.cacheDirectory = self.directory.name
+
+    def tearDown(self):
+        treeCache.cacheDirectory = self.savedDirectory
+        self.directory.cleanup()
+
+    def test_roundTrip(self):
+        """Test that a decoded tree matches the original tree."""
+
+        compiler = Compiler({"filename": "samples/recursive_function.c"})
+        compiler.tokenize()
+        compiler.parse()
+
+        tree = treeCache.decodeTree(treeCache.encodeTree(compiler.parseTree))
+        self.assertEqual(printTree(tree), printTree(compiler.parseTree))
+
+    def test_cacheHit(self):
+        """Test that a cached tree skips lexing and parsing."""
+
+        options = {"filename": "samples/switch.c", "cache": True}
+        first = Compiler(options)
+        first.tokenize()
+        first.parse()
+        first.buildSymbolTable()
+
+        second = Compiler(options)
+        second.tokenize()
+        tree = second.parse()
+        self.assertEqual(second.tokens, [])
+        self.assertIs(type(tree), type(first.parseTree))
+
+        second.buildSymbolTable()
+        self.assertEqual(str(second.symbolTable), str(first.symbolTable))
+
+    def test_unreadable(self):
+        """Test that an unusable cache file is parsed again and replaced."""
+
+        options = {"filename": "samples/switch.c", "cache": True}
+        first = Compiler(options)
+        first.tokenize()
+        first.parse()
+
+        with open(treeCache.cachePath(first.sourceHash, first.grammarHash), "wb") as file:
+            file.write(b"CTRE")
+
+        second = Compiler(options)
+        second.tokenize()
+        tree = second.parse()
+        self.assertFalse(second.fromCache)
+        self.assertEqual(printTree(tree), printTree(first.parseTree))
+        self.assertIsNotNone(treeCache.lookup(first.sourceHash, first.grammarHash))
+
+    def test_prune(self):
+        """Test that the least recently used trees are deleted past the limit."""
+
+        compiler = Compiler({"filename": "samples/switch.c"})
+        compiler.tokenize()
+        tree = compiler.parse()
+        size = len(treeCache.encodeTree(tree))
+
+        savedLimit = treeCache.cacheLimit
+        treeCache.cacheLimit = 3 * size
+        try:
+            for used, name in enumerate(["first", "second", "third"]):
+                treeCache.store(name, "grammar", tree)
+                os.utime(treeCache.cachePath(name, "grammar"), (used, used))
+
+            # Looking a tree up marks it as used, so the second and third are
+            # the oldest, and pruning goes down to three quarters of the limit
+            self.assertIsNotNone(treeCache.lookup("first", "grammar"))
+            treeCache.store("fourth", "grammar", tree)
+        finally:
+            treeCache.cacheLimit = savedLimit
+
+        self.assertIsNotNone(treeCache.lookup("first", "grammar"))
+        self.assertIsNone(treeCache.lookup("second", "grammar"))
+        self.assertIsNone(treeCache.lookup("third", "grammar"))
+        self.assertIsNotNone(treeCache.lookup("fourth", "grammar"))
+
+    def test_pruneScans(self):
+        """Test that the cache directory is only scanned when it may be too big."""
+
+        compiler = Compiler({"filename": "samples/switch.c"})
+        compiler.tokenize()
+        tree = compiler.parse()
+        size = len(treeCache.encodeTree(tree))
+
+        scans = []
+
+        def pruneCache(path, suffix, limit):
+            scans.append(path)
+            return savedPrune(path, suffix, limit)
+
+        savedPrune, savedLimit = util.pruneCache, treeCache.cacheLimit
+        util.pruneCache, treeCache.cacheLimit = pruneCache, 4 * size
+        try:
+            for name in range(6):
+                treeCache.store(str(name), "grammar", tree)
+        finally:
+            util.pruneCache, treeCache.cacheLimit = savedPrune, savedLimit
+
+        # Once for the first write, then once the fifth tree goes over the
+        # limit, which leaves three trees and room for the sixth
+        self.assertEqual(len(scans), 2)
+        remaining = [name for name in os.listdir(self.directory.name) if name.endswith(".tree")]
+        self.assertEqual(len(remaining), 4)
+
+
+class ParseTablesTestCase(unittest.TestCase):
+    """Test case for sharing ParseTables between ParserRuns."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tables = getParseTables("grammars/main_grammar.txt")
+        cls.files = ["samples/while.c", "samples/switch.c", "samples/call.c"]
+        cls.tokens = [lexer.tokenize(readFile(f)) for f in cls.files]
+
+    def test_immutable(self):
+        """Test that the shared tables cannot be modified."""
+
+        with self.assertRaises(AttributeError):
+            self.tables.actions = {}
+        with self.assertRaises(TypeError):
+            self.tables.actions[0]["ID"] = "s 1"
+
+    def test_loadedOnce(self):
+        """Test that the tables are only loaded once per grammar."""
+
+        self.assertIs(getParseTables("grammars/main_grammar.txt"), self.tables)
+
+    def test_frozenOnce(self):
+        """Test that a parser freezes its tables once for all of its parses."""
+
+        parser = LRParser()
+        parser.loadParseTables("grammars/main_grammar.txt")
+        tables = parser.tables()
+        parser.parse(self.tokens[0])
+        self.assertIs(parser.tables(), tables)
+
+        # Rebuilding the tables freezes them again
+        parser.loadTables(readFile("tables/main_grammar_table.json"))
+        self.assertIsNot(parser.tables(), tables)
+
+    def test_threads(self):
+        """Test that parses from several threads match serial parses."""
+
+        def parse(tokens):
+            return treeCache.encodeTree(ParserRun(self.tables).parse(tokens)[0])
+
+        expected = [parse(tokens) for tokens in self.tokens]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(parse, self.tokens * 20))
+
+        self.assertEqual(results, expected * 20)
+
+
+class TreeWriterTestCase(unittest.TestCase):
+    """Test case for the parse tree writers."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.compiler = Compiler({"filename": "samples/basic_math.c"})
+        cls.compiler.tokenize()
+        cls.compiler.parse()
+
+    def write(self, root, **kwargs):
+        """Write a tree into a string."""
+
+        out = io.StringIO()
+        writeTree(root, out=out, **kwargs)
+        return out.getvalue()
+
+    def test_text(self):
+        """Test the indented text format."""
+
+        result = self.write(self.compiler.parseTree, maxDepth=2)
+        self.assertEqual(
+            result, "| -  Program\n   | -  DeclarationList\n      | -  Declaration\n"
+        )
+
+    def test_sexpr(self):
+        """Test the S-expression format."""
+
+        result = self.write(self.compiler.parseTree, fmt="sexpr", maxDepth=3)
+        self.assertEqual(
+            result, "(Program (DeclarationList (Declaration (FunctionDeclaration ...))))\n"
+        )
+
+    def test_jsonl(self):
+        """Test the JSON lines format."""
+
+        lines = self.write(self.compiler.parseTree, fmt="jsonl").splitlines()
+        self.assertEqual(lines[0], '{"depth":0,"node":"Program","children":1}')
+        self.assertIn('{"depth":4,"node":"Identifier","value":"main"}', lines)
+
+    def test_deep(self):
+        """Test that very deep trees do not hit the recursion limit."""
+
+        root = grammar.ConstNum("1")
+        for _ in range(10000):
+            root = grammar.Expression([root])
+
+        self.assertEqual(len(self.write(root, fmt="jsonl").splitlines()), 10001)
+
+
+class TableReportTestCase(unittest.TestCase):
+    """Test case for the grammar conflict and table statistics report."""
+
+    def test_conflicts(self):
+        """Test that an ambiguous grammar reports its shift/reduce conflict."""
+
+        parser = LRParser()
+        parser.parseGrammar("program -> e\ne -> e + e \\ ID\n")
+        parser.buildTables()
+        report = parser.tableReport()
+
+        self.assertEqual(report["shiftReduceConflicts"], 1)
+        self.assertEqual(report["reduceReduceConflicts"], 0)
+        self.assertEqual(report["conflicts"][0]["token"], "+")
+        self.assertEqual(report["states"], len(report["entriesPerState"]))
+        self.assertTrue(0 < report["density"] <= 1)
+
+    def test_syntheticGrammar(self):
+        """Test that the benchmark grammars only have the conflict of the C grammar."""
+
+        parser = LRParser()
+        parser.parseGrammar(generateGrammar(2, 2, 2))
+        parser.buildTables()
+        report = parser.tableReport()
+
+        # Ending the program or shifting another declaration, which shifts
+        self.assertEqual(
+            {conflict["replaced"] for conflict in report["conflicts"]},
+            {"r program 0"},
+        )
+        self.assertEqual(report["productions"], 20)
+
+
+class ParseStatsTestCase(unittest.TestCase):
+    """Test case for the parser hot-path counters."""
+
+    def test_counters(self):
+        """Test the counters of a parse of while.c"""
+
+        tables = getParseTables("grammars/main_grammar.txt")
+        tokens = lexer.tokenize(readFile("samples/while.c"))
+        stats = ParseStats()
+        tree = ParserRun(tables, stats).parse(tokens)
+        result = stats.toDict(tables)
+
+        # Every token but the end of file marker is shifted once
+        self.assertTrue(tree)
+        self.assertEqual(sum(result["shifts"].values()), len(tokens) - 1)
+        self.assertEqual(result["shifts"]["while"], 1)
+        self.assertEqual(result["productions"]["whileStatement -> while ( whileCondition ) { statementList }"], 1)
+        self.assertEqual(result["productions"]["ACC -> program"], 1)
+        self.assertGreater(result["maxStackDepth"], 5)
+
+
+class IncrementalParserTestCase(unittest.TestCase):
+    """Test case for reparsing edited files."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "edited.c")
+
+    def compile(self, code, incremental=None, context=None):
+        with open(self.filename, "w") as file:
+            file.write(code)
+        compiler = Compiler(
+            {"filename": self.filename, "incremental": incremental, "context": context}
+        )
+        compiler.tokenize()
+        if compiler.parse() is not None:
+            compiler.buildSymbolTable()
+        return compiler
+
+    def test_edit(self):
+        """Test that reparsing after edits matches a full parse."""
+
+        code = readFile("samples/multiple_functions.c")
+        incremental = IncrementalParser(getParseTables("grammars/main_grammar.txt"))
+        self.compile(code, incremental)
+
+        edits = [
+            ("int foobar() {\n", "int foobar() {\n\tint a;\n\ta = 2 + 3;\n"),
+            ("return 0;", "return 1;"),
+            ("\tint a;\n\ta = 2 + 3;\n", ""),
+        ]
+        for old, new in edits:
+            code = code.replace(old, new, 1)
+            edited = self.compile(code, incremental)
+            full = self.compile(code)
+
+            self.assertGreater(incremental.reusedSubtrees, 0)
+            self.assertLess(incremental.reusedTokens, len(edited.tokens))
+            self.assertEqual(
+                treeCache.encodeTree(edited.parseTree),
+                treeCache.encodeTree(full.parseTree),
+            )
+            self.assertEqual(str(edited.symbolTable), str(full.symbolTable))
+
+    def test_syntaxError(self):
+        """Test that an edit with a syntax error is reported, then recovered from."""
+
+        code = readFile("samples/multiple_functions.c")
+        incremental = IncrementalParser(getParseTables("grammars/main_grammar.txt"))
+        self.compile(code, incremental)
+
+        context = CompilationContext()
+        with contextlib.redirect_stdout(io.StringIO()):
+            broken = self.compile(code.replace("return 0;", "return 0"), incremental, context)
+        self.assertIsNone(broken.parseTree)
+        errors = [str(message) for message in context.messages.messages]
+        self.assertTrue(any("does not have Token" in error for error in errors))
+
+        # The failed parse is forgotten, so the fixed code is parsed in full
+        fixed = self.compile(code, incremental)
+        self.assertEqual(incremental.reusedSubtrees, 0)
+        self.assertEqual(
+            treeCache.encodeTree(fixed.parseTree),
+            treeCache.encodeTree(self.compile(code).parseTree),
+        )
+
+
+class LoweringTestCase(unittest.TestCase):
+    """Test case for lowering the parse tree into a compact AST."""
+
+    def setUp(self):
+        self.compiler = Compiler({"filename": "samples/if_else.c"})
+        self.compiler.tokenize()
+        self.compiler.parse()
+        self.compiler.buildSymbolTable()
+
+    def generate(self, tree):
+        # Number the temporaries and labels from the start for each tree
+        ir = IR(tree, self.compiler.symbolTable, CompilationContext())
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            ir.generate()
+            ir.print()
+        return out.getvalue()
+
+    def test_wrappers(self):
+        """Test that the wrapper nodes are removed and the parse tree is kept."""
+
+        before = printTree(self.compiler.parseTree)
+        ast = lowerTree(self.compiler.parseTree)
+
+        self.assertEqual(printTree(self.compiler.parseTree), before)
+        self.assertLess(countNodes(ast), countNodes(self.compiler.parseTree))
+
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            self.assertNotIn(type(node), wrappers)
+            stack.extend(getattr(node, "children", []))
+
+    def test_ir(self):
+        """Test that the AST generates the same IR as the parse tree."""
+
+        self.assertEqual(
+            self.generate(lowerTree(self.compiler.parseTree)),
+            self.generate(self.compiler.parseTree),
+        )
+
+    def test_option(self):
+        """Test that the later phases only walk the AST when lowering is asked for."""
+
+        self.assertIs(self.compiler.lower(), self.compiler.parseTree)
+
+        compiler = Compiler({"filename": "samples/if_else.c", "lower": True})
+        compiler.tokenize()
+        compiler.parse()
+        self.assertIsNot(compiler.lower(), compiler.parseTree)
+        self.assertEqual(countNodes(compiler.lower()), countNodes(lowerTree(compiler.parseTree)))
+
+
+class EventParseTestCase(unittest.TestCase):
+    """Test case for the event-driven parse and the streaming compile."""
+
+    def test_treeBuilder(self):
+        """Test that building the tree from events matches a regular parse."""
+
+        tables = getParseTables("grammars/main_grammar.txt")
+        code = readFile("samples/complex.c")
+        tree = ParserRun(tables).parseEvents(
+            lexer.iterTokenize(code.splitlines()), TreeBuilder(tables)
+        )
+        expected = ParserRun(tables).parse(lexer.tokenize(code))[0]
+
+        self.assertEqual(treeCache.encodeTree(tree), treeCache.encodeTree(expected))
+
+    def test_stream(self):
+        """Test that a streamed compile gives the same IR as a regular one."""
+
+        options = {"filename": "samples/switch.c", "flags": ["-r"]}
+        regular = io.StringIO()
+        with contextlib.redirect_stdout(regular):
+            compiler = Compiler(options)
+            compiler.tokenize()
+            compiler.parse()
+            compiler.buildSymbolTable()
+            compiler.generateIr()
+
+        streamed = io.StringIO()
+        with contextlib.redirect_stdout(streamed):
+            compiler = Compiler(options)
+            compiler.stream()
+
+        self.assertEqual(streamed.getvalue(), regular.getvalue())
+
+
+class ParallelParseTestCase(unittest.TestCase):
+    """Test case for parsing function bodies in worker processes."""
+
+    def setUp(self):
+        self.tables = getParseTables("grammars/main_grammar.txt")
+
+    def test_parallel(self):
+        """Test that a parallel parse matches a serial parse."""
+
+        tokens = lexer.tokenize(generateProgram(12, 6))
+        self.assertEqual(len(splitFunctions(tokens)), 13)
+
+        serial = ParserRun(self.tables).parse(tokens)
+        parallel = parseParallel(self.tables, tokens, jobs=2)
+        self.assertEqual(
+            treeCache.encodeTree(parallel[0]), treeCache.encodeTree(serial[0])
+        )
+
+    def test_syntaxError(self):
+        """Test that a syntax error in a body is still reported."""
+
+        code = generateProgram(12, 6).replace("return", "return return", 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(parseParallel(self.tables, lexer.tokenize(code), jobs=2))
+
+
+class GrammarOperatorTestCase(unittest.TestCase):
+    """Test case for the X*, X+ and [X] operators in grammar files."""
+
+    grammarText = (
+        "program -> declaration+\n"
+        "declaration -> typeSpecifier ID ( ) { statement* } \\ typeSpecifier ID [init] ;\n"
+        "init -> = constNum\n"
+        "statement -> ID ;\n"
+    )
+
+    def parse(self, code, stats=None):
+        parser = LRParser()
+        parser.parseGrammar(self.grammarText)
+        parser.buildTables()
+        return ParserRun(parser.tables(), stats).parse(lexer.tokenize(code))
+
+    def test_desugar(self):
+        """Test that the operators become left recursive rules."""
+
+        parser = LRParser()
+        parser.parseGrammar(self.grammarText + "other -> ID ++ ;\n")
+
+        self.assertEqual(parser.rules["declaration+"], [["declaration+", "declaration"], ["declaration"]])
+        self.assertEqual(parser.rules["statement*"], [["statement+"], ["EMPTY"]])
+        self.assertEqual(parser.rules["statement+"], [["statement+", "statement"], ["statement"]])
+        self.assertEqual(parser.rules["[init]"], [["init"], ["EMPTY"]])
+        self.assertEqual(parser.rules["other"], [["ID", "++", ";"]])
+
+    def test_parse(self):
+        """Test that lists are built flat, in order, on a shallow stack."""
+
+        body = "".join(f"s{i};" for i in range(200))
+        stats = ParseStats()
+        tree = self.parse(f"int x = 3; int y; int main() {{ {body} }} int f() {{ }}", stats)
+        declarations = tree[0].children[0]
+
+        self.assertIsInstance(declarations, grammar.NodeList)
+        self.assertEqual(len(declarations.children), 4)
+        self.assertEqual([node.value for node in declarations.children[0].children], ["int", "x", "3"])
+        self.assertEqual([node.value for node in declarations.children[1].children], ["int", "y"])
+        statements = declarations.children[2].children[2]
+        self.assertEqual(len(statements.children), 200)
+        self.assertEqual(statements.children[199].children[0].value, "s199")
+        self.assertEqual(declarations.children[3].children[2].children, [])
+        self.assertLess(stats.maxStackDepth, 12)
+
+
+# Symbol table
+
+
+class ScopeTestCase(unittest.TestCase):
+    """Test case for symbol table scopes and lookups."""
+
+    def test_bindings(self):
+        """Test that lookups see the innermost binding until its scope ends."""
+
+        st = SymbolTable()
+        st.declareVariable("int", "x")
+        st.startScope("f", 1)
+        st.declareVariable("int", "x")
+        st.useLabel("end")
+
+        self.assertEqual(st.find("x"), "f")
+        self.assertEqual(st.find("f"), "f")
+        self.assertEqual(st.find("end"), "f")
+        self.assertIsNone(st.find("y"))
+
+        st.endScope()
+        self.assertEqual(st.find("x"), "global")
+        self.assertEqual(st.find("f"), "global")
+        self.assertIsNone(st.find("end"))
+        self.assertEqual(
+            str(st),
+            "{'name': 'global', 'variables': {'x': 'int'}, 'labels': {}, 'f': {'name': 'f', '..': {...}, 'variables': {'x': 'int'}, 'labels': {'end': False}}}",
+        )
+
+
+class DefUseTestCase(unittest.TestCase):
+    """Test case for the def-use index of the symbol table."""
+
+    def test_uses(self):
+        """Test that each symbol records its declaration and every use."""
+
+        code = (
+            "int x;\n"
+            "int f(int a) { return a + x; }\n"
+            "int main() { int x = 1; goto end; x = f(x); end: return x; }\n"
+        )
+        with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as file:
+            file.write(code)
+        self.addCleanup(os.remove, file.name)
+
+        compiler = Compiler({"filename": file.name, "flags": []})
+        compiler.tokenize()
+        compiler.parse()
+        compiler.buildSymbolTable()
+        symbols = compiler.symbolTable.symbols
+
+        def uses(key):
+            return len(symbols[key].uses)
+
+        self.assertEqual(uses(("global", "x")), 1)
+        self.assertEqual(uses(("f", "a")), 1)
+        self.assertEqual(uses(("global", "f")), 1)
+        self.assertEqual(uses(("main", "x")), 3)
+        self.assertEqual(uses(("main", "end")), 1)
+        self.assertEqual(uses(("global", "main")), 0)
+        self.assertEqual(type(symbols[("main", "end")].declaration), grammar.LabelDeclaration)
+        self.assertTrue(all(use.value == "x" for use in symbols[("main", "x")].uses))
+
+    def test_functionCache(self):
+        """Test that functions reused from the cache have the same def-use index."""
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        savedDirectory = functionCache.cacheDirectory
+        self.addCleanup(setattr, functionCache, "cacheDirectory", savedDirectory)
+        functionCache.cacheDirectory = directory.name
+
+        filename = os.path.join(directory.name, "program.c")
+        with open(filename, "w") as file:
+            file.write("int g = 2;\n" + generateProgram(3, 6).replace("return", "g = g + 1;\n\treturn"))
+
+        def index():
+            compiler = Compiler({"filename": filename, "cache": True, "flags": []})
+            with contextlib.redirect_stdout(io.StringIO()):
+                compiler.tokenize()
+                compiler.parse()
+                compiler.analyze()
+
+            # Nodes by their position in the AST, so both runs can be compared
+            positions = {}
+            stack = [compiler.lower(always=True)]
+            while stack:
+                node = stack.pop()
+                positions[id(node)] = len(positions)
+                stack.extend(reversed(getattr(node, "children", [])))
+
+            symbols = {
+                key: (
+                    positions.get(id(symbol.declaration)),
+                    [positions[id(use)] for use in symbol.uses],
+                )
+                for key, symbol in compiler.symbolTable.symbols.items()
+            }
+            return compiler, symbols
+
+        cold, expected = index()
+        warm, symbols = index()
+        # The first function is not cached, as it holds the global's instructions
+        self.assertEqual((cold.functionHits, warm.functionMisses), (0, 1))
+        self.assertEqual(warm.functionHits, 3)
+        self.assertEqual(symbols, expected)
+        self.assertTrue(expected[("global", "g")][1])
+        self.assertTrue(all(declaration is not None for declaration, _ in symbols.values()))
+
+
+# Intermediate representation
+
+
+class AnalyzeTestCase(unittest.TestCase):
+    """Test case for building the symbol table and IR with shared walks."""
+
+    def compile(self, filename, analyze):
+        compiler = Compiler({"filename": filename, "flags": ["-r"]})
+        compiler.tokenize()
+        compiler.parse()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            if analyze:
+                compiler.analyze()
+            else:
+                compiler.buildSymbolTable()
+                compiler.generateIr()
+        return str(compiler.symbolTable), output.getvalue()
+
+    def test_analyze(self):
+        """Test that analyze gives the same results as the separate steps."""
+
+        for filename in ["samples/for.c", "samples/switch.c", "samples/complex.c"]:
+            expected = self.compile(filename, False)
+            self.assertEqual(self.compile(filename, True), expected)
+
+    def test_deepTree(self):
+        """Test that trees deeper than the recursion limit can be compiled."""
+
+        terms = 2 * sys.getrecursionlimit()
+        code = "int main() { int x = " + "+".join(["1"] * terms) + "; return x; }\n"
+        with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as file:
+            file.write(code)
+        self.addCleanup(os.remove, file.name)
+
+        compiler = Compiler({"filename": file.name, "flags": []})
+        compiler.tokenize()
+        compiler.parse()
+        ir = compiler.analyze().ir["main"]
+        instructions = [i for block in ir["blocks"] for i in block.instructions]
+        adds = [i for i in instructions if i.operator == "+"]
+        self.assertEqual(len(adds), terms - 1)
+
+
+class FunctionCacheTestCase(unittest.TestCase):
+    """Test case for reusing the IR of unchanged functions."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.savedDirectories = (treeCache.cacheDirectory, functionCache.cacheDirectory)
+        treeCache.cacheDirectory = self.directory.name
+        functionCache.cacheDirectory = self.directory.name
+
+    def tearDown(self):
+        treeCache.cacheDirectory, functionCache.cacheDirectory = self.savedDirectories
+        self.directory.cleanup()
+
+    def compile(self, code, cache):
+        filename = os.path.join(self.directory.name, "program.c")
+        with open(filename, "w") as file:
+            file.write(code)
+
+        compiler = Compiler({"filename": filename, "cache": cache, "flags": ["-r"]})
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            compiler.tokenize()
+            compiler.parse()
+            compiler.analyze()
+        return compiler, output.getvalue()
+
+    def test_edit(self):
+        """Test that only edited functions are rebuilt, with the same IR."""
+
+        code = "int g = 3;\n" + generateProgram(6, 8)
+        compiler, _ = self.compile(code, True)
+        self.assertEqual((compiler.functionHits, compiler.functionMisses), (0, 7))
+
+        # The new statements shift the numbers of every later function
+        edited = code.replace(
+            "int f2(int a, int b) {",
+            "int f2(int a, int b) {\n\tint z = a * b;\n\tif (z > g) {\n\t\tz = 1;\n\t}",
+        )
+        compiler, output = self.compile(edited, True)
+        self.assertEqual((compiler.functionHits, compiler.functionMisses), (5, 2))
+
+        fresh, expected = self.compile(edited, False)
+        self.assertEqual(output, expected)
+        self.assertEqual(str(compiler.symbolTable), str(fresh.symbolTable))
+
+    def test_internedNames(self):
+        """Test that the names of a reused function are the lexer's strings."""
+
+        code = generateProgram(2, 4)
+        self.compile(code, True)
+        compiler, _ = self.compile(code, True)
+        self.assertEqual(compiler.functionMisses, 0)
+
+        for name, scope in compiler.symbolTable.table.children.items():
+            self.assertTrue(all(variable is lexer.intern(variable) for variable in scope.variables))
+            for block in compiler.ir.ir[name]["blocks"]:
+                for instruction in block.instructions:
+                    if type(instruction.a) is str:
+                        self.assertIs(instruction.a, lexer.intern(instruction.a))
+
+    def test_prune(self):
+        """Test that the least recently used functions are deleted past the limit."""
+
+        savedLimit = functionCache.cacheLimit
+        self.addCleanup(setattr, functionCache, "cacheLimit", savedLimit)
+        functionCache.cacheLimit = 0
+
+        compiler, _ = self.compile(generateProgram(2, 4), True)
+        self.assertEqual(compiler.functionMisses, 3)
+        cached = [name for name in os.listdir(self.directory.name) if name.endswith(".function")]
+        self.assertEqual(cached, [])
+
+
+class InstrTestCase(unittest.TestCase):
+    """Test case for the typed IR instructions."""
+
+    def test_roundTrip(self):
+        """Test that instructions print as lists and read back the same."""
+
+        compiler = Compiler({"filename": "samples/switch.c", "flags": []})
+        compiler.tokenize()
+        compiler.parse()
+        compiler.analyze()
+
+        instructions = [
+            i
+            for function in compiler.ir.ir.values()
+            for block in function["blocks"]
+            for i in block.instructions
+        ]
+        self.assertIn(Opcode.BRANCH, [i.op for i in instructions])
+        for instruction in instructions:
+            entry = json.loads(json.dumps(instruction.toList()))
+            self.assertEqual(str(entry), str(instruction))
+            self.assertEqual(Instr.fromList(entry), instruction)
+
+        copy = Instr.fromList(["r2", "=", "i", "==", "1"])
+        self.assertEqual(copy.op, Opcode.BINARY)
+        self.assertEqual(
+            [operandKind(v) for v in (copy.dest, copy.a, copy.b)],
+            ["temporary", "variable", "constant"],
+        )
+
+    def test_callArguments(self):
+        """Test that the temporaries passed to a call read back as temporaries."""
+
+        call = Instr(Opcode.CALL, Temp("r3"), "sum", [Temp("r1"), "x", "2"])
+        copy = Instr.fromList(json.loads(json.dumps(call.toList())))
+
+        self.assertEqual(copy, call)
+        self.assertEqual(type(copy.dest), Temp)
+        self.assertEqual(
+            [operandKind(argument) for argument in copy.b],
+            ["temporary", "variable", "constant"],
+        )
+
+
+class JumpTestCase(unittest.TestCase):
+    """Test case for patching the jumps out of loops and ifs."""
+
+    def instructions(self, code):
+        """Return the block label and each instruction of main."""
+
+        with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as file:
+            file.write(code)
+        self.addCleanup(os.remove, file.name)
+
+        compiler = Compiler({"filename": file.name, "flags": []})
+        compiler.tokenize()
+        compiler.parse()
+        blocks = compiler.analyze().ir["main"]["blocks"]
+
+        return [(block.label, i) for block in blocks for i in block.instructions]
+
+    def test_nestedBreak(self):
+        """Test that breaks and continues leave their own loop, however deep."""
+
+        code = (
+            "int main() {\n"
+            "\tint x = 0;\n"
+            "\tint y = 0;\n"
+            "\twhile (x < 10) {\n"
+            "\t\tx = x + 1;\n"
+            "\t\tif (x == 5) {\n\t\t\tbreak;\n\t\t}\n"
+            "\t\twhile (y < 3) {\n\t\t\ty = y + 1;\n\t\t\tcontinue;\n\t\t}\n"
+            "\t}\n"
+            "\treturn x;\n"
+            "}\n"
+        )
+
+        instructions = self.instructions(code)
+        branches = [(label, i) for label, i in instructions if i.op is Opcode.BRANCH]
+        gotos = [i.target for _, i in instructions if i.op is Opcode.GOTO]
+
+        # The outer condition, the if, then the inner condition
+        outer, inner = branches[0], branches[2]
+
+        # The break, the inner continue, then each loop back to its condition
+        self.assertEqual(gotos, [outer[1].otherwise, inner[0], inner[0], outer[0]])
+        self.assertTrue(all(i.otherwise is not None for _, i in branches))
+
+    def test_nestedElse(self):
+        """Test that an if jumps past an else of several blocks."""
+
+        code = (
+            "int main() {\n"
+            "\tint x = 0;\n"
+            "\tif (x < 1) {\n\t\tx = 1;\n\t} else {\n"
+            "\t\tif (x < 2) {\n\t\t\tx = 2;\n\t\t}\n"
+            "\t\tx = 3;\n"
+            "\t}\n"
+            "\treturn x;\n"
+            "}\n"
+        )
+
+        instructions = self.instructions(code)
+        branches = [(label, i) for label, i in instructions if i.op is Opcode.BRANCH]
+        gotos = [i.target for _, i in instructions if i.op is Opcode.GOTO]
+        end = [label for label, i in instructions if i.op is Opcode.RETURN]
+
+        # The else starts with the inner condition, and the body skips all of it
+        outer, inner = branches
+        self.assertEqual(outer[1].otherwise, inner[0])
+        self.assertEqual(gotos, end)
+
+
+class ControlFlowGraphTestCase(unittest.TestCase):
+    """Test case for the control-flow graphs of IR functions."""
+
+    def test_edges(self):
+        """Test the edges and order of a loop, and updating them after an edit."""
+
+        compiler = Compiler({"filename": "samples/break.c", "flags": []})
+        compiler.tokenize()
+        compiler.parse()
+        cfg = buildGraphs(compiler.analyze())["main"]
+
+        start, condition, body, jump, decrement, end, last = cfg.blocks
+        self.assertEqual(cfg.successors[start], [condition])
+        self.assertEqual(cfg.successors[condition], [body, end])
+        self.assertEqual(cfg.predecessors[condition], [start, decrement])
+        self.assertEqual(cfg.predecessors[end], [condition, jump])
+        self.assertEqual(cfg.successors[end], [])
+
+        # The block after the return can never be reached
+        order = cfg.reversePostorder()
+        self.assertEqual(order[:2], [start, condition])
+        self.assertNotIn(last, order)
+        self.assertLess(order.index(body), order.index(jump))
+
+        # Make the break return instead
+        jump.instructions[-1] = Instr(Opcode.RETURN, a="i")
+        cfg.refresh(jump)
+        self.assertEqual(cfg.successors[jump], [])
+        self.assertEqual(cfg.predecessors[end], [condition])
+        self.assertIn(jump, cfg.reversePostorder())
+
+
+class BinaryIrTestCase(unittest.TestCase):
+    """Test case for the binary IR file format."""
+
+    def test_roundTrip(self):
+        """Test that an IR written in either format reads back the same."""
+
+        compiler = Compiler({"filename": "samples/switch.c", "flags": []})
+        compiler.tokenize()
+        compiler.parse()
+        compiler.analyze()
+
+        with tempfile.TemporaryDirectory() as directory:
+            binaryFile = f"{directory}/switch.irb"
+            jsonFile = f"{directory}/switch.json"
+            otherFile = f"{directory}/switch.ir"
+            with contextlib.redirect_stdout(io.StringIO()):
+                compiler.ir.write(binaryFile)
+                compiler.ir.write(jsonFile)
+                compiler.ir.write(otherFile)
+
+            # Only the .irb extension asks for the binary format
+            self.assertTrue(binaryIr.isBinary(binaryFile))
+            self.assertFalse(binaryIr.isBinary(jsonFile))
+            self.assertEqual(readFile(otherFile), readFile(jsonFile))
+
+            for read in (readIr(binaryFile), readIr(jsonFile)):
+                self.assertEqual(list(read.ir), list(compiler.ir.ir))
+                for name, function in compiler.ir.ir.items():
+                    copy = read.ir[name]
+                    self.assertEqual(copy["arguments"], function["arguments"])
+                    self.assertEqual(copy["declarations"], function["declarations"])
+                    self.assertEqual(
+                        [(b.label, b.instructions) for b in copy["blocks"]],
+                        [(b.label, b.instructions) for b in function["blocks"]],
+                    )
+
+            # Temporaries keep their type without going by their names
+            instructions = [
+                i
+                for function in readIr(binaryFile).ir.values()
+                for block in function["blocks"]
+                for i in block.instructions
+            ]
+            self.assertIn(Temp, [type(i.dest) for i in instructions])
+
+    def test_largeTable(self):
+        """Test operands past the first bytes of the string table and call lists."""
+
+        instructions = [Instr(Opcode.LABEL, target="_L1")]
+        for i in range(20000):
+            instructions.append(
+                Instr(Opcode.BINARY, Temp(f"r{i}"), f"v{i}", "1", operator="+")
+            )
+        instructions.append(Instr(Opcode.CALL, Temp("r0"), "f", ["a", Temp("r1"), "2"]))
+        instructions.append(Instr(Opcode.BRANCH, a=Temp("r9"), target="_L1"))
+
+        buffer = io.BytesIO()
+        writer = binaryIr.Writer(buffer)
+        writer.function("main", ["a"], 3)
+        for instruction in instructions:
+            writer.instruction(instruction)
+        writer.flush()
+
+        records = list(binaryIr.decodeRecords(buffer.getvalue()))
+        self.assertEqual(records[0], ("main", ["a"], 3))
+        self.assertEqual(records[1:], instructions)
+        self.assertIs(type(records[-2].b[1]), Temp)
+
+
+# Utilities
+
+
+class DispatchTestCase(unittest.TestCase):
+    """Test case for looking up handlers by node class."""
+
+    def test_lookup(self):
+        """Test that subclasses use the handler of their nearest base class."""
+
+        handlers = Dispatch()
+        handlers.register(grammar.MathExpression)("math")
+        handlers.register(grammar.BooleanAnd, grammar.BooleanOr)("boolean")
+
+        self.assertEqual(handlers[grammar.AdditionExpression], "math")
+        self.assertEqual(handlers[grammar.BooleanOr], "boolean")
+        self.assertIsNone(handlers[grammar.BooleanNot])
+        self.assertIsNone(handlers[list])
+
+        # Registering again forgets the remembered lookups
+        handlers.register(grammar.Node)("node")
+        self.assertEqual(handlers[grammar.BooleanNot], "node")
+        self.assertEqual(handlers[grammar.AdditionExpression], "math")
+
+
+class CompilationContextTestCase(unittest.TestCase):
+    """Test case for compilations with contexts of their own."""
+
+    def compile(self, filename):
+        compiler = Compiler({"filename": filename, "flags": []})
+        compiler.tokenize()
+        compiler.parse()
+        ir = compiler.analyze()
+        return [
+            str(i)
+            for function in ir.ir.values()
+            for block in function["blocks"]
+            for i in block.instructions
+        ]
+
+    def test_independent(self):
+        """Test that compilations number from the start, even side by side."""
+
+        filenames = ["samples/switch.c", "samples/while.c", "samples/complex.c"] * 4
+        expected = [self.compile(filename) for filename in filenames]
+        self.assertEqual(self.compile(filenames[0]), expected[0])
+        self.assertEqual(expected[0][0], "['label', '_L1']")
+
+        with ThreadPoolExecutor(4) as pool:
+            self.assertEqual(list(pool.map(self.compile, filenames)), expected)
+
+    def test_messages(self):
+        """Test that writing the IR reports to the context, not the process."""
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        context = CompilationContext()
+        compiler = Compiler({"filename": "samples/while.c", "flags": [], "context": context})
+        compiler.tokenize()
+        compiler.parse()
+        ir = compiler.analyze()
+
+        processMessages = len(util.messages.messages)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name in ("ir.json", "ir.irb"):
+                ir.write(os.path.join(directory.name, name))
+
+        written = [str(message) for message in context.messages.messages]
+        self.assertEqual(sum("Wrote to file" in message for message in written), 2)
+        self.assertEqual(len(util.messages.messages), processMessages)
+
+    def test_intermediateCode(self):
+        """Test that the older IR generator numbers with its context too."""
+
+        context = CompilationContext()
+        generator = intermediateCode.IR(None, None, context)
+        self.assertIs(generator.unique, context.unique)
+
+
+# Command line
+
+
+class CheckTestCase(unittest.TestCase):
+    """Test case for checking many files without generating an IR."""
+
+    def test_checkFiles(self):
+        """Test that every invalid file is reported, in order, by any pool size."""
+
+        filenames = [
+            "samples/if.c",
+            "samples/undefined_var.c",
+            "samples/while.c",
+            "samples/duplicate_label.c",
+        ]
+        for jobs in (1, 2):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                invalid = checkFiles(filenames, {"flags": [], "jobs": jobs})
+
+            self.assertEqual(invalid, 2)
+            lines = output.getvalue().splitlines()
+            self.assertIn("samples/undefined_var.c", lines[0])
+            self.assertIn("Identifier x is undefined.", lines[1])
+            self.assertIn("samples/duplicate_label.c", lines[2])
+            self.assertIn("Checked 4 files, 2 invalid.", lines[-1])
+
+    def test_unexpectedError(self):
+        """Test that a file the compiler fails on is reported and the rest are checked."""
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        broken = os.path.join(directory.name, "broken.c")
+        with open(broken, "wb") as file:
+            file.write(b"int main() { return \xff 0; }\n")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            invalid = checkFiles(["samples/if.c", broken, "samples/while.c"], {"flags": []})
+
+        self.assertEqual(invalid, 1)
+        lines = output.getvalue().splitlines()
+        self.assertIn(broken, lines[0])
+        self.assertIn("UnicodeDecodeError", lines[1])
+        self.assertIn("Checked 3 files, 1 invalid.", lines[-1])
+
+
 if __name__ == "__main__":
     unittest.main()